@@ -0,0 +1,198 @@
+"""
+Answer cache for the /llm route.
+
+Exact tier: normalized hash of (model, question, evidence/graph context).
+Near-duplicate tier (optional): questions asked against the same context are
+compared with hashed character n-gram vectors held in a small in-memory
+vector index, bucketed by context hash. Entries expire after a TTL and are
+evicted LRU-first under an entry-count and memory cap. An optional SQLite
+file keeps answers across restarts.
+"""
+import os
+import re
+import json
+import math
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+_SPACE_RE=re.compile(r"\s+")
+_TRAILING_RE=re.compile(r"[\s?？。.!！~～]+$")
+
+def normalize(text):
+    text=_SPACE_RE.sub(" ", str(text or "")).strip().lower()
+    return _TRAILING_RE.sub("", text)
+
+def _digest(*parts):
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def ngram_vector(text, dim=4096, sizes=(2, 3)):
+    """Hashed character n-gram vector (sparse dict, L2-normalized)."""
+    vec={}
+    text=normalize(text).replace(" ", "")
+    for n in sizes:
+        for i in range(max(0, len(text)-n+1)):
+            h=int.from_bytes(hashlib.blake2b(text[i:i+n].encode("utf-8"), digest_size=8).digest(), "little")%dim
+            vec[h]=vec.get(h, 0.0)+1.0
+    if not vec and text:
+        vec[int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")%dim]=1.0
+    norm=math.sqrt(sum(v*v for v in vec.values())) or 1.0
+    return {k: v/norm for k, v in vec.items()}
+
+def cosine(a, b):
+    if len(a)>len(b):
+        a, b=b, a
+    return sum(v*b.get(k, 0.0) for k, v in a.items())
+
+class AnswerCache:
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None, semantic=None, threshold=None, db_path=None):
+        env=os.environ.get
+        self.max_entries=max_entries or int(env("LLM_CACHE_MAX_ENTRIES","2000"))
+        self.max_bytes=max_bytes or int(env("LLM_CACHE_MAX_MB","64"))*1024*1024
+        self.ttl=ttl or float(env("LLM_CACHE_TTL","3600"))
+        self.semantic=(env("LLM_CACHE_SEMANTIC","0").lower() in ("1","true","yes")) if semantic is None else semantic
+        self.threshold=threshold or float(env("LLM_CACHE_SIMILARITY","0.92"))
+        self.entries=OrderedDict()   # key -> entry dict, LRU order
+        self.index={}                # context key -> {key: vector}
+        self.bytes=0
+        self.lock=threading.Lock()
+        self.counters={"hits_exact":0, "hits_semantic":0, "misses":0, "stores":0, "evictions":0, "expired":0}
+        self.db=None
+        db_path=env("LLM_CACHE_DB","") if db_path is None else db_path
+        if db_path:
+            self._open_db(db_path)
+
+    # Keys
+    def _keys(self, model, question, context):
+        ctx=_digest(str(model or ""), normalize(context))
+        return _digest(ctx, normalize(question)), ctx
+
+    # Disk backend
+    def _open_db(self, path):
+        self.db=sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, ctx TEXT, question TEXT, answer TEXT, context_path TEXT, created REAL)")
+        self.db.commit()
+        # 预热：把未过期的最近条目装入内存（含近似匹配索引）
+        rows=self.db.execute("SELECT key, ctx, question, answer, context_path, created FROM answers WHERE created > ? ORDER BY created DESC LIMIT ?",
+                             (time.time()-self.ttl, self.max_entries)).fetchall()
+        for key, ctx, question, answer, context_path, created in reversed(rows):
+            self._insert(key, ctx, question, answer, json.loads(context_path or "[]"), created)
+
+    def _db_get(self, key):
+        row=self.db.execute("SELECT ctx, question, answer, context_path, created FROM answers WHERE key=?", (key,)).fetchone()
+        if not row or time.time()-row[4]>self.ttl:
+            return None
+        return row
+
+    # Memory tier
+    def _insert(self, key, ctx, question, answer, context_path, created):
+        size=len(answer.encode("utf-8"))+len(question.encode("utf-8"))+64
+        old=self.entries.pop(key, None)
+        if old:
+            self.bytes-=old["size"]
+        entry={"ctx":ctx, "question":question, "answer":answer, "context_path":context_path, "created":created, "size":size}
+        self.entries[key]=entry
+        self.bytes+=size
+        if self.semantic:
+            self.index.setdefault(ctx, {})[key]=ngram_vector(question)
+        while self.entries and (len(self.entries)>self.max_entries or self.bytes>self.max_bytes):
+            self._drop(next(iter(self.entries)))
+            self.counters["evictions"]+=1
+
+    def _drop(self, key):
+        entry=self.entries.pop(key)
+        self.bytes-=entry["size"]
+        bucket=self.index.get(entry["ctx"])
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self.index[entry["ctx"]]
+
+    def _hit(self, key, tier):
+        entry=self.entries[key]
+        self.entries.move_to_end(key)
+        self.counters["hits_"+tier]+=1
+        return {"answer":entry["answer"], "context_path":entry["context_path"], "tier":tier}
+
+    def get(self, model, question, context):
+        key, ctx=self._keys(model, question, context)
+        now=time.time()
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry and now-entry["created"]>self.ttl:
+                self._drop(key)
+                self.counters["expired"]+=1
+                entry=None
+            if entry:
+                return self._hit(key, "exact")
+            if self.db is not None:
+                row=self._db_get(key)
+                if row:
+                    self._insert(key, row[0], row[1], row[2], json.loads(row[3] or "[]"), row[4])
+                    return self._hit(key, "exact")
+            if self.semantic and ctx in self.index:
+                vec=ngram_vector(question)
+                best, best_key=0.0, None
+                for k, v in list(self.index[ctx].items()):
+                    if now-self.entries[k]["created"]>self.ttl:
+                        self._drop(k)
+                        self.counters["expired"]+=1
+                        continue
+                    score=cosine(vec, v)
+                    if score>best:
+                        best, best_key=score, k
+                if best_key is not None and best>=self.threshold:
+                    return self._hit(best_key, "semantic")
+            self.counters["misses"]+=1
+            return None
+
+    def put(self, model, question, context, answer, context_path=None):
+        if not answer:
+            return
+        key, ctx=self._keys(model, question, context)
+        created=time.time()
+        context_path=list(context_path or [])
+        with self.lock:
+            self._insert(key, ctx, normalize(question), answer, context_path, created)
+            self.counters["stores"]+=1
+            if self.db is not None:
+                try:
+                    self.db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                                    (key, ctx, normalize(question), answer, json.dumps(context_path, ensure_ascii=False), created))
+                    self.db.execute("DELETE FROM answers WHERE created < ?", (created-self.ttl,))
+                    self.db.commit()
+                except sqlite3.Error as e:
+                    print(f"Answer cache write error: {e}")
+
+    def stats(self):
+        with self.lock:
+            out=dict(self.counters)
+            out["entries"]=len(self.entries)
+            out["bytes"]=self.bytes
+        hits=out["hits_exact"]+out["hits_semantic"]
+        lookups=hits+out["misses"]
+        out["hit_rate"]=round(hits/lookups, 4) if lookups else 0.0
+        out["semantic"]=self.semantic
+        out["disk"]=self.db is not None
+        return out
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db=None
+
+_cache=None
+_cache_lock=threading.Lock()
+
+def get_cache():
+    """Process-wide cache, or None when LLM_CACHE=0."""
+    global _cache
+    if os.environ.get("LLM_CACHE","1").lower() in ("0","false","no"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache=AnswerCache()
+        return _cache
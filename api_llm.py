@@ -1,19 +1,38 @@
 import os
 import json
 import time
-import ssl
 import base64
 import io
-import pymysql
+import atexit
+import queue
+import hashlib
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.request import Request, urlopen, build_opener, HTTPSHandler, install_opener
-from urllib.error import HTTPError, URLError
 from urllib.parse import urlparse, parse_qs
+import llm_client
+import answer_cache
+import concept_index
+import upload_stream
+import mastery_store
+import prereq_dag
+import metrics
+import tracing
+import hybrid_retrieval
 
 # MySQL Config
+# pymysql 缺失时同 neo4j 一样降级：日志写入计为 failed，学习记录按 MySQL 不可用处理
+pymysql = None
+try:
+    import pymysql
+except ImportError as e:
+    print(f"DEBUG: pymysql module import failed: {e}")
+
+# 环境变量由调用方预先加载（main/_WriteBehindLogger），建连时不再重复解析 .env
 def _get_mysql_conn():
-    _load_env()
+    if pymysql is None:
+        return None
     host = os.environ.get("MYSQL_HOST", "localhost")
     port = int(os.environ.get("MYSQL_PORT", 3306))
     user = os.environ.get("MYSQL_USER", "root")
@@ -40,17 +59,6 @@ try:
 except ImportError:
     pass
 
-# PDF/Docx Extraction
-try:
-    import pypdf
-except ImportError:
-    pypdf = None
-
-try:
-    import docx
-except ImportError:
-    docx = None
-
 neo4j = None
 try:
     import neo4j as _neo4j
@@ -91,58 +99,486 @@ def _load_cfg(path="neo4j-link.txt"):
         pass
     return cfg
 
-def _query_neo4j(fn):
-    cfg=_load_cfg()
+_neo4j_cfg_cache={"mtime":None,"cfg":{}}
+
+def _neo4j_settings(path="neo4j-link.txt"):
+    # neo4j-link.txt 只在文件变化时重新解析
+    try:
+        mtime=os.stat(path).st_mtime
+    except OSError:
+        mtime=None
+    if mtime!=_neo4j_cfg_cache["mtime"]:
+        _neo4j_cfg_cache["cfg"]=_load_cfg(path)
+        _neo4j_cfg_cache["mtime"]=mtime
+    cfg=_neo4j_cfg_cache["cfg"]
     uri=os.environ.get("NEO4J_URI") or cfg.get("url") or "neo4j://127.0.0.1:7687"
     user=os.environ.get("NEO4J_USER") or cfg.get("user") or "neo4j"
     password=os.environ.get("NEO4J_PASSWORD") or cfg.get("password") or ""
     database=os.environ.get("NEO4J_DATABASE") or cfg.get("database") or None
+    return uri, user, password, database
+
+# Neo4j Driver Registry
+# 每个 (uri, user, database) 共享一个长连接 driver，避免每个请求重新握手/认证/拉取路由表
+_neo4j_drivers={}
+_neo4j_lock=threading.Lock()
+
+def _neo4j_pool_options():
+    return {
+        "max_connection_pool_size": int(os.environ.get("NEO4J_POOL_SIZE","50")),
+        "connection_acquisition_timeout": float(os.environ.get("NEO4J_ACQUIRE_TIMEOUT","10")),
+        "max_connection_lifetime": float(os.environ.get("NEO4J_MAX_CONN_LIFETIME","3600")),
+    }
+
+def _get_neo4j_driver(uri, user, password, database):
+    key=(uri, user, database)
+    stale=None
+    with _neo4j_lock:
+        entry=_neo4j_drivers.get(key)
+        if entry and entry["password"]!=password:
+            # 凭据变更：替换 driver，旧 driver 在锁外关闭
+            stale=entry["driver"]
+            entry=None
+        if entry is None:
+            options=_neo4j_pool_options()
+            entry={
+                "driver": neo4j.GraphDatabase.driver(uri, auth=(user, password), **options),
+                "password": password,
+                "options": options,
+                "created_at": time.time(),
+                "sessions": 0,
+                "active": 0,
+                "errors": 0,
+            }
+            _neo4j_drivers[key]=entry
+    if stale is not None:
+        try:
+            stale.close()
+        except Exception as e:
+            print(f"Neo4j driver close error: {e}")
+    return entry
+
+def _neo4j_pool_stats():
+    out=[]
+    with _neo4j_lock:
+        items=list(_neo4j_drivers.items())
+    for (uri, user, database), entry in items:
+        stat={
+            "uri": uri,
+            "user": user,
+            "database": database,
+            "sessions": entry["sessions"],
+            "active": entry["active"],
+            "errors": entry["errors"],
+            "uptime": round(time.time()-entry["created_at"], 1),
+        }
+        stat.update(entry["options"])
+        # 连接数取自驱动内部连接池，不同驱动版本可能没有该属性
+        pool=getattr(entry["driver"], "_pool", None)
+        conns=getattr(pool, "connections", None)
+        if isinstance(conns, dict):
+            try:
+                stat["connections"]=sum(len(v) for v in list(conns.values()))
+            except Exception:
+                pass
+        out.append(stat)
+    return out
+
+def _close_neo4j_drivers():
+    with _neo4j_lock:
+        entries=list(_neo4j_drivers.values())
+        _neo4j_drivers.clear()
+    for entry in entries:
+        try:
+            entry["driver"].close()
+        except Exception as e:
+            print(f"Neo4j driver close error: {e}")
+
+atexit.register(_close_neo4j_drivers)
+
+def _query_neo4j(fn, database=None):
     if neo4j is None:
         return None
-    
-    driver=neo4j.GraphDatabase.driver(uri, auth=(user, password))
+    uri, user, password, default_db=_neo4j_settings()
+    database=database or default_db
+    entry=_get_neo4j_driver(uri, user, password, database)
+    with _neo4j_lock:
+        entry["sessions"]+=1
+        entry["active"]+=1
     try:
-        with driver.session(database=database) as session:
+        with metrics.timed("neo4j"), entry["driver"].session(database=database) as session:
             return fn(session)
+    except Exception:
+        with _neo4j_lock:
+            entry["errors"]+=1
+        raise
     finally:
-        driver.close()
+        with _neo4j_lock:
+            entry["active"]-=1
+
+# MySQL Connection Pool
+class _MySQLPool:
+    """Small LIFO pool of pymysql connections, pinged before reuse."""
+    def __init__(self, size):
+        self.size=size
+        self.idle=queue.LifoQueue()
+        self.lock=threading.Lock()
+        self.created=0
+
+    def acquire(self):
+        while True:
+            try:
+                conn=self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.ping(reconnect=True)
+                return conn
+            except Exception:
+                self._discard(conn)
+        conn=_get_mysql_conn()
+        if conn:
+            with self.lock:
+                self.created+=1
+        return conn
+
+    def release(self, conn, broken=False):
+        if broken or self.idle.qsize()>=self.size:
+            self._discard(conn)
+        else:
+            self.idle.put(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+# Write-Behind Logger
+# 日志写入不再占用请求线程：先入内存队列，由后台线程按条数/时间阈值批量 executemany
+_LOG_INSERTS={
+    "dialogue": "INSERT INTO dialogue_logs (session_id, role, content, context) VALUES (%s, %s, %s, %s)",
+    "learning": "INSERT INTO learning_logs (session_id, question_id, is_correct, db_name) VALUES (%s, %s, %s, %s)",
+}
+_LOG_STOP=object()
+
+class _WriteBehindLogger:
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.thread=None
+        self.queue=None
+        self.pool=None
+        self.counters={"enqueued":0, "flushed":0, "dropped":0, "failed":0, "batches":0}
+
+    def _start(self):
+        _load_env()
+        self.batch_size=int(os.environ.get("MYSQL_LOG_BATCH","200"))
+        self.flush_interval=float(os.environ.get("MYSQL_LOG_FLUSH_MS","500"))/1000.0
+        self.put_timeout=float(os.environ.get("MYSQL_LOG_BLOCK_MS","50"))/1000.0
+        self.queue=queue.Queue(maxsize=int(os.environ.get("MYSQL_LOG_QUEUE","10000")))
+        self.pool=_MySQLPool(int(os.environ.get("MYSQL_POOL_SIZE","4")))
+        self.thread=threading.Thread(target=self._run, name="mysql-log", daemon=True)
+        self.thread.start()
+
+    def log(self, kind, row):
+        with self.lock:
+            if self.thread is None:
+                self._start()
+        try:
+            # 队列满时短暂阻塞施加背压，仍满则丢弃并计数
+            self.queue.put((kind, row), timeout=self.put_timeout)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def _count(self, name, n=1):
+        with self.lock:
+            self.counters[name]+=n
+
+    def _run(self):
+        stop=False
+        while not stop:
+            batch=[]
+            deadline=time.monotonic()+self.flush_interval
+            while len(batch)<self.batch_size:
+                timeout=deadline-time.monotonic()
+                if timeout<=0:
+                    break
+                try:
+                    item=self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _LOG_STOP:
+                    stop=True
+                    break
+                batch.append(item)
+            if stop:
+                # 关闭时排空队列中剩余的日志
+                while True:
+                    try:
+                        item=self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _LOG_STOP:
+                        batch.append(item)
+            if batch:
+                self._flush(batch)
+        self.pool.close()
+
+    def _flush(self, batch):
+        groups={}
+        for kind, row in batch:
+            groups.setdefault(kind, []).append(row)
+        conn=self.pool.acquire()
+        if not conn:
+            self._count("failed", len(batch))
+            return
+        broken=False
+        try:
+            with metrics.timed("mysql"), conn.cursor() as cursor:
+                for kind, rows in groups.items():
+                    cursor.executemany(_LOG_INSERTS[kind], rows)
+                conn.commit()
+            self._count("flushed", len(batch))
+            self._count("batches")
+        except Exception as e:
+            broken=True
+            self._count("failed", len(batch))
+            print(f"MySQL log error: {e}")
+        finally:
+            self.pool.release(conn, broken=broken)
+
+    def fetch(self, sql, args):
+        """Run a read query on the logger's pool; None when MySQL is unavailable."""
+        with self.lock:
+            if self.thread is None:
+                self._start()
+        conn=self.pool.acquire()
+        if not conn:
+            return None
+        broken=False
+        try:
+            with metrics.timed("mysql"), conn.cursor() as cursor:
+                cursor.execute(sql, args)
+                return list(cursor.fetchall())
+        except Exception as e:
+            broken=True
+            print(f"MySQL read error: {e}")
+            return None
+        finally:
+            self.pool.release(conn, broken=broken)
+
+    def stats(self):
+        with self.lock:
+            out=dict(self.counters)
+        out["queued"]=self.queue.qsize() if self.queue else 0
+        out["pool_idle"]=self.pool.idle.qsize() if self.pool else 0
+        out["pool_created"]=self.pool.created if self.pool else 0
+        return out
+
+    def close(self, timeout=10.0):
+        with self.lock:
+            thread=self.thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self.queue.put(_LOG_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+
+_mysql_logger=_WriteBehindLogger()
+atexit.register(_mysql_logger.close)
 
 def _log_dialogue(session_id, role, content, context=None):
     if not session_id: return
-    try:
-        conn = _get_mysql_conn()
-        if not conn: return
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO dialogue_logs (session_id, role, content, context) VALUES (%s, %s, %s, %s)",
-                (session_id, role, content, context or "")
-            )
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        print(f"MySQL log error: {e}")
+    _mysql_logger.log("dialogue", (session_id, role, content, context or ""))
+
+def _learner_key(session_id, database=None):
+    # 不同库的题目 qid / 概念 id 可能重复，掌握状态按 (库, 学习者) 分开
+    return (database or _neo4j_settings()[3] or "", session_id)
 
-def _log_learning(session_id, question_id, is_correct):
+def _log_learning(session_id, question_id, is_correct, database=None):
     if not session_id: return
+    _mysql_logger.log("learning", (session_id, question_id, is_correct, _learner_key(session_id, database)[0]))
+
+def _log_mastered(session_id, concept_ids, database=None):
+    for cid in concept_ids:
+        _log_learning(session_id, mastery_store.CONCEPT_PREFIX+cid, True, database)
+
+_learner_load_failed=[0.0]
+
+def _load_learner(key):
+    # 学习者状态被淘汰或重启后，从 learning_logs 按写入顺序重放；MySQL 不可用时 30 秒内不再重试
+    # 没有 db_name 的旧记录属于默认库
+    database, session_id=key
+    if time.time()-_learner_load_failed[0]<30:
+        metrics.degraded("mastery_load")
+        raise mastery_store.LoadUnavailable("learning log unavailable")
+    rows=_mysql_logger.fetch("SELECT question_id, is_correct FROM learning_logs WHERE session_id=%s "
+                             "AND (db_name=%s OR (db_name IS NULL AND %s)) ORDER BY id",
+                             (session_id, database, database==(_neo4j_settings()[3] or "")))
+    if rows is None:
+        _learner_load_failed[0]=time.time()
+        metrics.degraded("mastery_load")
+        raise mastery_store.LoadUnavailable("learning log unavailable")
+    return [(r["question_id"], bool(r["is_correct"])) for r in rows if r.get("question_id")]
+
+_mastery=mastery_store.MasteryStore(_load_learner)
+
+def _load_competency_graph():
+    # 一次性读取候选概念、素养根节点与路径关系，供 concept_index 在进程内构建字典和路径表
+    def run(session):
+        names={}
+        candidates=[]
+        for r in session.run(
+            "MATCH (n) WHERE (n:CoreLiteracy OR n:SubDimension OR n:ContentModule) AND size(n.name) > 1 "
+            "RETURN elementId(n) AS id, n.name AS name"
+        ):
+            names[r["id"]]=r["name"]
+            candidates.append(r["id"])
+        roots=[]
+        for r in session.run(
+            "MATCH (root:CoreLiteracy) WHERE root.level = '顶层' OR root.level = '核心素养' "
+            "RETURN elementId(root) AS id, root.name AS name"
+        ):
+            names[r["id"]]=r["name"]
+            roots.append(r["id"])
+        edges=[]
+        for r in session.run(
+            "MATCH (a)-[:INCLUDES|HAS_DIMENSION|DEVELOPED_BY]->(b) "
+            "RETURN elementId(a) AS src, a.name AS src_name, elementId(b) AS dst, b.name AS dst_name"
+        ):
+            names.setdefault(r["src"], r["src_name"])
+            names.setdefault(r["dst"], r["dst_name"])
+            edges.append((r["src"], r["dst"]))
+        return names, candidates, edges, roots
+    res=_query_neo4j(run)
+    if res is None:
+        raise RuntimeError("neo4j unavailable")
+    return res
+
+_competency_index=concept_index.CompetencyIndex(_load_competency_graph)
+
+def _on_indexed(db_name):
+    # LightRAG 把实体写入 db_name 库；概念索引读的是默认库，只有它被索引时才提前重建
+    if db_name==(_neo4j_settings()[3] or "neo4j"):
+        _competency_index.invalidate()
+
+if lightrag_wrapper:
+    lightrag_wrapper.on_indexed(_on_indexed)
+
+def _browser_evidence_text(evidence):
+    # 浏览器端检索到的图谱证据（焦点节点、邻居、关系等）转成提示词文本
+    parts=[]
+    for e in evidence:
+        a=[]
+        f=str((e or {}).get("focus") or "").strip()
+        if f:
+            a.append("主题: "+f)
+        ns=e.get("neighbors") or []
+        if ns:
+            a.append("关联节点: "+", ".join([str(x) for x in ns if str(x).strip()]))
+        rs=e.get("relations") or []
+        if rs:
+            a.append("关联关系: "+", ".join([str(x) for x in rs if str(x).strip()]))
+        ls=e.get("links") or []
+        if ls:
+            parts_links=[]
+            for link in ls:
+                nn=str((link or {}).get("neighborName") or "").strip()
+                nid=str((link or {}).get("neighborId") or "").strip()
+                tp=str((link or {}).get("type") or "").strip()
+                dr=str((link or {}).get("dir") or "").strip()
+                if nn or nid or tp or dr:
+                    s=f"{tp}:{dr} → {nn} [{nid}]"
+                    parts_links.append(s)
+            if parts_links:
+                a.append("关联链接: "+" | ".join(parts_links))
+        cs=e.get("concepts") or []
+        if cs:
+            a.append("相关知识: "+", ".join([str(x) for x in cs if str(x).strip()]))
+        ss=e.get("skills") or []
+        if ss:
+            a.append("关联能力: "+", ".join([str(x) for x in ss if str(x).strip()]))
+        ts=e.get("tasks") or []
+        if ts:
+            a.append("训练任务: "+", ".join([str(x) for x in ts if str(x).strip()]))
+        ps=e.get("competencies") or []
+        if ps:
+            a.append("涉及素养: "+", ".join([str(x) for x in ps if str(x).strip()]))
+        if a:
+            parts.append("\n".join(a))
+    return "\n\n".join(parts)
+
+_retriever=hybrid_retrieval.Retriever(lightrag_wrapper.submit_query, lightrag_wrapper.index_generation) if lightrag_wrapper else None
+
+def _retrieval_options(payload, has_key):
+    """LightRAG retrieval settings of one /llm request, or None to use the graph paths only.
+
+    payload may set modes (list or "a,b"; [] or "none" disables), db_name, top_k, max_tokens.
+    """
+    if _retriever is None or not payload.get("question"):
+        return None
+    modes=payload.get("modes")
+    if modes is None:
+        # naive 只做向量检索；local/global/hybrid 每次还要调用一次 LLM 抽取关键词，需显式开启
+        modes=os.environ.get("RAG_MODES","naive")
+    if isinstance(modes, str):
+        modes=modes.split(",")
+    modes=[m for m in dict.fromkeys(str(m).strip().lower() for m in modes) if m in hybrid_retrieval.MODES]
+    if not has_key:
+        # local/global/hybrid 需要 LLM 抽取关键词，没有密钥时只保留向量检索
+        modes=[m for m in modes if m=="naive"]
+    if not modes:
+        return None
     try:
-        conn = _get_mysql_conn()
-        if not conn: return
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO learning_logs (session_id, question_id, is_correct) VALUES (%s, %s, %s)",
-                (session_id, question_id, is_correct)
-            )
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        print(f"MySQL log error: {e}")
+        top_k=int(payload.get("top_k") or os.environ.get("RAG_TOP_K","10"))
+        max_tokens=int(payload.get("max_tokens") or os.environ.get("RAG_MAX_TOKENS","3000"))
+    except (TypeError, ValueError):
+        return None
+    return {"modes":modes, "db":str(payload.get("db_name") or "neo4j"),
+            "top_k":max(1, min(top_k, 60)), "max_tokens":max(200, min(max_tokens, 16000))}
+
+def _retrieval_signature(opts):
+    """Part of the answer-cache key standing in for the retrieved context: db, its index generation and the query settings."""
+    if not opts:
+        return ""
+    return "rag:%s#%s:%s:%d:%d" % (opts["db"], lightrag_wrapper.index_generation(opts["db"]), ",".join(opts["modes"]),
+                                   opts["top_k"], opts["max_tokens"])
+
+def _graph_context_text(graph_paths):
+    if not graph_paths:
+        return ""
+    return "【图谱背景知识】\n本问题关联的学科素养路径：\n" + "\n".join([f"- {p}" for p in graph_paths])
 
 def _search_competency_path(question):
     """
     基于图谱的上下文检索：查找问题中提到的概念，并追溯其所属的核心素养路径。
     这实现了'图谱引导'的生成。
+    概念匹配与路径查询在进程内完成（concept_index），索引不可用时回退到 Cypher 查询。
     """
     if not question: return []
+    if neo4j is None: return []
+    try:
+        paths=_competency_index.lookup(question)
+        if paths is not None:
+            return paths
+    except Exception as e:
+        print(f"Concept index lookup error: {e}")
+    metrics.degraded("concept_index")
+    return _search_competency_path_cypher(question)
+
+def _search_competency_path_cypher(question):
+    if not question: return []
     
     def run(session):
         # 查找名称出现在问题中的节点（反向匹配），并向上追溯路径
@@ -176,167 +612,468 @@ def _search_competency_path(question):
         print(f"Graph search error: {e}")
         return []
 
+def _parse_llm_answer(ct, data, question, evidence_text):
+    answer=""
+    if "json" in ct:
+        try:
+            j=json.loads(data.decode("utf-8"))
+        except Exception:
+            j={}
+        if isinstance(j, dict) and j.get("error"):
+            msg=str(j.get("error",{}).get("message") or "invalid request")
+            answer = msg or ("模型不可用，基于已有信息给出简述。\n\n问题："+question+"\n\n证据：\n"+(evidence_text or "(无)"))
+        else:
+            answer=str((j.get("choices") or [{}])[0].get("message",{}).get("content") or j.get("answer") or j.get("data") or json.dumps(j))
+    else:
+        answer=data.decode("utf-8",errors="ignore")
+    return answer
+
+def _iter_sse_deltas(resp):
+    # 逐行解析 OpenAI 兼容的 SSE 流，产出每个增量文本片段
+    for raw in resp:
+        line=raw.decode("utf-8", errors="ignore").strip()
+        if not line.startswith("data:"):
+            continue
+        data=line[5:].strip()
+        if data=="[DONE]":
+            break
+        try:
+            j=json.loads(data)
+        except Exception:
+            continue
+        delta=((j.get("choices") or [{}])[0].get("delta") or {}).get("content")
+        if delta:
+            yield delta
+
+# Question Helpers
+def _qs_list(qs, *names):
+    # 支持重复参数和逗号分隔两种写法
+    out=[]
+    for name in names:
+        for v in qs.get(name) or []:
+            out.extend(x.strip() for x in v.split(",") if x.strip())
+    return out
+
+def _encode_cursor(ts, qid):
+    return base64.urlsafe_b64encode(json.dumps([ts, qid]).encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_cursor(raw):
+    if not raw:
+        return None
+    try:
+        ts, qid=json.loads(base64.urlsafe_b64decode(raw+"="*(-len(raw)%4)).decode("utf-8"))
+    except Exception:
+        raise ValueError("invalid cursor")
+    return str(ts), str(qid)
+
+# 题目的键集分页排序键：created_at 可能是 neo4j datetime，也可能是前端写入的 ISO 字符串，
+# 字符串比较时小数位数不同会排错，统一转成毫秒时间戳；没有 created_at 的排在最后
+_QUESTION_TS="coalesce(datetime(toString(q.created_at)).epochMillis, 0) AS ts"
+
+def _question_cursor(raw):
+    cursor=_decode_cursor(raw)
+    return (int(cursor[0]), cursor[1]) if cursor else None
+
+_TASK_STATUSES=("queued", "running", "cancelling", "completed", "failed", "cancelled")
+_QUESTION_FIELDS=("id","qid","content","type","options","difficulty","user_result","concept","created_at")
+_QUESTION_PRIVATE_FIELDS=("answer","analysis")   # 仅在显式请求时返回
+
+def _jsonable(props):
+    # created_at 可能是 neo4j DateTime
+    return {k: (v if v is None or isinstance(v, (str, int, float, bool, list)) else str(v)) for k, v in props.items()}
+
+def _question_out(q, include_answer=False):
+    props=q._properties if hasattr(q,"_properties") else getattr(q,"properties",{})
+    out={
+        "id": getattr(q,"element_id", None) or getattr(q,"elementId", None),
+        "qid": props.get("qid"),
+        "content": props.get("content"),
+        "type": props.get("type"),
+        "options": props.get("options"),
+        "difficulty": props.get("difficulty"),
+    }
+    if include_answer:
+        out["answer"]=props.get("answer")
+        out["analysis"]=props.get("analysis")
+    return out
+
+# 统计按难度分组一次聚合完成，合计在 Python 端求和
+_STATS_COLS=("coalesce(q.difficulty,'') AS d, count(q) AS c, "
+             "count(CASE WHEN q.user_result='true' THEN 1 END) AS m, "
+             "collect([elementId(q), q.qid]) AS qs ")   # 成对收集：collect(q.qid) 会跳过 null，与 id 错位
+
+def _stats_from_rows(rows, correct=None):
+    # correct 为学习者答对的题目集合时按个人掌握情况计数，否则用全局 user_result
+    total=mastered=0
+    by_diff={}
+    for r in rows or []:
+        c=int(r.get("c") or 0)
+        if not c:
+            continue
+        by_diff[str(r.get("d") or "")]=c
+        total+=c
+        if correct is None:
+            mastered+=int(r.get("m") or 0)
+        else:
+            mastered+=sum(1 for i, k in r.get("qs") or [] if i in correct or (k and k in correct))
+    return {"total":total,"mastered":mastered,"pending":max(0,total-mastered),"by_difficulty":by_diff}
+
+class _StatsCache:
+    """In-memory /question_stats results keyed by (database, concept).
+
+    /submit_answer drops the entries of the concepts its question TESTS; the
+    TTL covers questions added or edited directly from the browser.
+    """
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.entries={}
+        self.counters={"hits":0, "misses":0, "invalidations":0}
+
+    def _ttl(self):
+        return float(os.environ.get("QUESTION_STATS_TTL","300"))
+
+    def get(self, key):
+        with self.lock:
+            hit=self.entries.get(key)
+            if hit and time.time()-hit[0]<self._ttl():
+                self.counters["hits"]+=1
+                return hit[1]
+            self.counters["misses"]+=1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key]=(time.time(), value)
+
+    def invalidate(self, database, concept_ids=(), concept_names=()):
+        drop={(database, "all")}
+        drop.update((database, "id", i) for i in concept_ids if i)
+        drop.update((database, "name", n) for n in concept_names if n)
+        with self.lock:
+            for key in drop:
+                if self.entries.pop(key, None) is not None:
+                    self.counters["invalidations"]+=1
+
+    def stats(self):
+        with self.lock:
+            out=dict(self.counters)
+            out["entries"]=len(self.entries)
+        return out
+
+_stats_cache=_StatsCache()
+
+# Answer / ZPD Helpers
+_ANSWER_TAIL=(" SET q.user_result=row.res WITH q OPTIONAL MATCH (q)-[:TESTS]->(cm) "
+              "RETURN count(DISTINCT q) AS n, collect(DISTINCT elementId(cm)) AS cids, collect(DISTINCT cm.name) AS cnames")
+
+def _apply_answers(session, rows):
+    """Write many answer results in one transaction; returns (updated, concept ids, concept names)."""
+    by_qid=[r for r in rows if r.get("qid")]
+    by_id=[r for r in rows if r.get("id") and not r.get("qid")]
+    updated, cids, cnames=0, set(), set()
+    with session.begin_transaction() as tx:
+        for cypher, batch in (("UNWIND $rows AS row MATCH (q:Question {qid:row.qid})"+_ANSWER_TAIL, by_qid),
+                              ("UNWIND $rows AS row MATCH (q) WHERE elementId(q)=row.id"+_ANSWER_TAIL, by_id)):
+            if not batch:
+                continue
+            rec=tx.run(cypher, {"rows":batch}).single()
+            updated+=int(rec.get("n") or 0)
+            cids.update(rec.get("cids") or [])
+            cnames.update(rec.get("cnames") or [])
+        tx.commit()
+    return updated, cids, cnames
+
+# 一次处理一组已掌握节点：只检查它们的直接后继，每个后继的前驱状态用模式推导式求一次
+_ZPD_PROPAGATE=(
+    "UNWIND $ids AS id MATCH (c) WHERE elementId(c)=id SET c.status=2 "
+    "WITH collect(DISTINCT c) AS done UNWIND done AS c "
+    "MATCH (c)-[:PREREQUISITE]->(next) WITH DISTINCT next "
+    "WHERE coalesce(next.status,0) <> 2 "
+    "AND ALL(s IN [(pre)-[:PREREQUISITE]->(next) | coalesce(pre.status,0)] WHERE s=2) "
+    "SET next.status=1 RETURN collect(elementId(next)) AS unlocked"
+)
+
+def _propagate_zpd(session, node_ids):
+    rec=session.run(_ZPD_PROPAGATE, {"ids":list(node_ids)}).single()
+    return list(rec.get("unlocked") or []) if rec else []
+
+class _ZPDCoalescer:
+    """Deferred /zpd_update: node ids are collected per database and propagated together after a short window."""
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.pending={}   # database -> set(node ids)
+        self.timer=None
+        self.counters={"requests":0, "nodes":0, "flushes":0, "unlocked":0, "errors":0}
+
+    def add(self, database, node_ids):
+        with self.lock:
+            bucket=self.pending.setdefault(database, set())
+            bucket.update(node_ids)
+            self.counters["requests"]+=1
+            if self.timer is None:
+                self.timer=threading.Timer(float(os.environ.get("ZPD_COALESCE_MS","200"))/1000.0, self.flush)
+                self.timer.daemon=True
+                self.timer.start()
+            return len(bucket)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending=self.pending, {}
+            self.timer=None
+        for database, ids in pending.items():
+            try:
+                unlocked=_query_neo4j(lambda session: _propagate_zpd(session, ids), database) or []
+            except Exception as e:
+                print(f"ZPD propagation error: {e}")
+                with self.lock:
+                    self.counters["errors"]+=1
+                continue
+            with self.lock:
+                self.counters["flushes"]+=1
+                self.counters["nodes"]+=len(ids)
+                self.counters["unlocked"]+=len(unlocked)
+
+    def stats(self):
+        with self.lock:
+            out=dict(self.counters)
+            out["pending"]=sum(len(v) for v in self.pending.values())
+        return out
+
+_zpd_coalescer=_ZPDCoalescer()
+
+# 按学习者的 ZPD：掌握状态在 _mastery 中，解锁由进程内 PREREQUISITE 图（prereq_dag）计算；
+# 图快照不可用时回退到只读 Cypher（取后继及其全部前驱）
+_LEARNER_ZPD=("UNWIND $ids AS id MATCH (c) WHERE elementId(c)=id "
+              "MATCH (c)-[:PREREQUISITE]->(next) WITH DISTINCT next "
+              "RETURN elementId(next) AS id, [(pre)-[:PREREQUISITE]->(next) | elementId(pre)] AS pres")
+
+def _load_prereq_graph(database=None):
+    def run(session):
+        names={}
+        edges=[]
+        for r in session.run(
+            "MATCH (a)-[:PREREQUISITE]->(b) "
+            "RETURN elementId(a) AS src, a.name AS src_name, elementId(b) AS dst, b.name AS dst_name"
+        ):
+            names.setdefault(r["src"], r["src_name"] or "")
+            names.setdefault(r["dst"], r["dst_name"] or "")
+            edges.append((r["src"], r["dst"]))
+        return names, edges
+    res=_query_neo4j(run, database)
+    if res is None:
+        raise RuntimeError("neo4j unavailable")
+    return res
+
+_prereq_engines={}
+_prereq_engines_lock=threading.Lock()
+
+def _prereq_engine(database=None):
+    database=database or _neo4j_settings()[3]
+    with _prereq_engines_lock:
+        engine=_prereq_engines.get(database)
+        if engine is None:
+            engine=_prereq_engines[database]=prereq_dag.PrereqEngine(
+                lambda: _load_prereq_graph(database), lambda session_id: _mastery.mastered(_learner_key(session_id, database)))
+        return engine
+
+def _learner_unlocks(session_id, node_ids, database=None):
+    key=_learner_key(session_id, database)
+    # 重复标记已掌握的概念不应再次报告它早已解锁的后继
+    before=_mastery.mastered(key)
+    _mastery.mark_mastered(key, node_ids)
+    _log_mastered(session_id, node_ids, database)
+    try:
+        unlocked=_prereq_engine(database).mark(session_id, node_ids, before)
+        if unlocked is not None:
+            return unlocked
+    except Exception as e:
+        print(f"Prerequisite DAG error: {e}")
+    metrics.degraded("prereq_dag")
+    new_ids=[i for i in node_ids if i not in before]
+    if not new_ids:
+        return []
+    rows=_query_neo4j(lambda session: session.run(_LEARNER_ZPD, {"ids":new_ids}).data(), database)
+    if rows is None:
+        return None
+    mastered=_mastery.mastered(key)
+    return [r["id"] for r in rows if r["id"] not in mastered and all(p in mastered for p in r["pres"] or [])]
+
+_SCHEMA_INDEXES=(
+    "CREATE INDEX question_qid IF NOT EXISTS FOR (q:Question) ON (q.qid)",
+    "CREATE INDEX question_created_at IF NOT EXISTS FOR (q:Question) ON (q.created_at)",
+    # /question 的 TESTS 遍历从 Concept 名称定位起点
+    "CREATE INDEX concept_name IF NOT EXISTS FOR (c:Concept) ON (c.name)",
+)
+
+def _ensure_indexes():
+    def run(session):
+        for stmt in _SCHEMA_INDEXES:
+            session.run(stmt).consume()
+        return True
+    try:
+        _query_neo4j(run)
+    except Exception as e:
+        print(f"Neo4j index setup error: {e}")
+
+def _upload_result(task_id, since):
+    # 相同文件重复上传到同一库时直接返回已有任务
+    task=lightrag_wrapper.get_task_status(task_id) or {}
+    if (task.get("created_at") or since)>=since:
+        return {"ok": True, "message": "Document queued for indexing", "task_id": task_id}
+    return {"ok": True, "message": "Document already uploaded", "task_id": task_id, "duplicate": True, "status": task.get("status")}
+
 class Handler(BaseHTTPRequestHandler):
     def _cors(self):
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Authorization, Content-Type")
+        self.send_header("Access-Control-Allow-Headers", "Authorization, Content-Type, X-Request-ID")
+        self.send_header("Access-Control-Expose-Headers", "X-Request-ID")
+        trace=tracing.current()
+        if trace is not None:
+            self.send_header("X-Request-ID", trace.request_id)
+            if trace.profile_path:
+                self.send_header("X-Profile", os.path.basename(trace.profile_path))
 
-    def do_OPTIONS(self):
-        self.send_response(200)
+    def _send(self, code, body=b"", content_type=None, headers=None):
+        # 所有响应都带 Content-Length，HTTP/1.1 keep-alive 才能复用连接
+        self.send_response(code)
         self._cors()
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
+        self.wfile.write(body)
+
+    def do_OPTIONS(self):
+        self._send(200)
+
+    def send_response(self, code, message=None):
+        self._status=code
+        super().send_response(code, message)
 
     def do_GET(self):
+        with _RequestScope(self), _RouteSlot(self.path) as ok:
+            if not ok:
+                self._send(503, b'{"error": "server busy"}', "application/json")
+                return
+            self._handle_get()
+
+    def do_POST(self):
+        with _RequestScope(self), _RouteSlot(self.path) as ok:
+            if not ok:
+                # 请求体未读取，不能继续复用该连接
+                self.close_connection=True
+                self._send(503, b'{"error": "server busy"}', "application/json")
+                return
+            self._handle_post()
+
+    def _handle_get(self):
         if self.path.startswith("/task_status"):
             query = urlparse(self.path).query
             params = parse_qs(query)
             task_id = params.get("task_id", [None])[0]
             
             if not task_id:
-                self.send_response(400)
-                self._cors()
-                self.end_headers()
-                self.wfile.write(b'{"error": "task_id required"}')
+                self._send(400, b'{"error": "task_id required"}')
                 return
             
             if lightrag_wrapper:
                 status = lightrag_wrapper.get_task_status(task_id)
                 if status:
-                    self.send_response(200)
-                    self._cors()
-                    self.send_header("Content-Type","application/json")
-                    self.end_headers()
-                    self.wfile.write(json.dumps(status).encode("utf-8"))
+                    self._send(200, json.dumps(status).encode("utf-8"), "application/json")
                 else:
-                    self.send_response(404)
-                    self._cors()
-                    self.end_headers()
-                    self.wfile.write(b'{"error": "Task not found"}')
+                    self._send(404, b'{"error": "Task not found"}')
             else:
-                self.send_response(503)
-                self._cors()
-                self.end_headers()
-                self.wfile.write(b'{"error": "LightRAG not available"}')
+                self._send(503, b'{"error": "LightRAG not available"}')
             return
 
-        if self.path.startswith("/question"):
+        route=urlparse(self.path).path
+        if route == "/task_events":
+            self._task_events()
+            return
+        if route == "/tasks":
+            self._tasks()
+            return
+        if route == "/question_stats":
+            self._question_stats()
+            return
+        if route == "/questions":
+            self._questions()
+            return
+        if route == "/recommend":
+            self._recommend()
+            return
+        if route == "/metrics":
+            self._send(200, metrics.render(), "text/plain; version=0.0.4; charset=utf-8")
+            return
+        if route == "/question":
             qs=parse_qs(urlparse(self.path).query)
             module_name=(qs.get("module_name") or ["\n"])[0].strip()
             module_id=(qs.get("module_id") or [""])[0].strip()
             include_answer=((qs.get("include_answer") or ["false"]) [0].lower() in ("1","true","yes"))
             qtype=(qs.get("type") or [""])[0].strip()
             difficulty=(qs.get("difficulty") or [""])[0].strip()
-            exclude_id=(qs.get("exclude_id") or [""])[0].strip()
-            exclude_qid=(qs.get("exclude_qid") or [""])[0].strip()
+            exclude_ids=_qs_list(qs, "exclude_id", "exclude_ids")
+            exclude_qids=_qs_list(qs, "exclude_qid", "exclude_qids")
+            session_id=(qs.get("session_id") or [""])[0].strip()
+            count=(qs.get("count") or [""])[0].strip()
+            try:
+                limit=max(1, min(int(count), int(os.environ.get("QUESTION_BATCH_MAX","50")))) if count else 1
+                cursor=_question_cursor((qs.get("cursor") or [""])[0].strip())
+            except ValueError:
+                self._send(400, b'{"error": "invalid count or cursor"}', "application/json")
+                return
             def run(session):
                 if module_name:
-                    cypher=("MATCH (cm:Concept {name:$name})<-[:TESTS]-(q:Question) "
-                            "WHERE coalesce(q.user_result,'') <> 'true' "
-                            + (" AND q.type = $qtype" if qtype else "")
-                            + (" AND q.difficulty = $difficulty" if difficulty else "")
-                            + (" AND elementId(q) <> $exclude_id" if exclude_id else "")
-                            + (" AND q.qid <> $exclude_qid" if exclude_qid else "")
-                            + " RETURN q ORDER BY q.created_at DESC LIMIT 1")
-                    params={"name":module_name}
-                    if qtype:
-                        params["qtype"]=qtype
-                    if difficulty:
-                        params["difficulty"]=difficulty
-                    if exclude_id:
-                        params["exclude_id"]=exclude_id
-                    if exclude_qid:
-                        params["exclude_qid"]=exclude_qid
-                    rec=session.run(cypher,params).single()
+                    anchor, params="MATCH (cm:Concept {name:$name})", {"name":module_name}
                 elif module_id:
-                    cypher=("MATCH (cm) WHERE elementId(cm)=$id MATCH (cm)<-[:TESTS]-(q:Question) "
-                            "WHERE coalesce(q.user_result,'') <> 'true' "
-                            + (" AND q.type = $qtype" if qtype else "")
-                            + (" AND q.difficulty = $difficulty" if difficulty else "")
-                            + (" AND elementId(q) <> $exclude_id" if exclude_id else "")
-                            + (" AND q.qid <> $exclude_qid" if exclude_qid else "")
-                            + " RETURN q ORDER BY q.created_at DESC LIMIT 1")
-                    params={"id":module_id}
-                    if qtype:
-                        params["qtype"]=qtype
-                    if difficulty:
-                        params["difficulty"]=difficulty
-                    if exclude_id:
-                        params["exclude_id"]=exclude_id
-                    if exclude_qid:
-                        params["exclude_qid"]=exclude_qid
-                    rec=session.run(cypher,params).single()
+                    anchor, params="MATCH (cm) WHERE elementId(cm)=$id", {"id":module_id}
                 else:
                     return {"error":"missing module_name or module_id"}
-                if not rec:
-                    return {"question":None}
-                q=rec.get("q")
-                props=q._properties if hasattr(q,"_properties") else getattr(q,"properties",{})
-                out={
-                    "id": getattr(q,"element_id", None) or getattr(q,"elementId", None),
-                    "qid": props.get("qid"),
-                    "content": props.get("content"),
-                    "type": props.get("type"),
-                    "options": props.get("options"),
-                    "difficulty": props.get("difficulty"),
-                }
-                if include_answer:
-                    out["answer"]=props.get("answer")
-                    out["analysis"]=props.get("analysis")
-                return {"question":out}
-            res=_query_neo4j(run)
-            self.send_response(200)
-            self._cors()
-            self.send_header("Content-Type","application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(res or {"error":"neo4j unavailable"}).encode("utf-8"))
-            return
-        if self.path.startswith("/question_stats"):
-            qs=parse_qs(urlparse(self.path).query)
-            module_name=(qs.get("module_name") or ["\n"])[0].strip()
-            module_id=(qs.get("module_id") or [""])[0].strip()
-            def run(session):
-                if module_name:
-                    rec=session.run("MATCH (cm:Concept {name:$name})<-[:TESTS]-(q:Question) RETURN count(q) AS total, count(CASE WHEN q.user_result='true' THEN 1 END) AS mastered", {"name":module_name}).single()
-                    rows=session.run("MATCH (cm:Concept {name:$name})<-[:TESTS]-(q:Question) RETURN coalesce(q.difficulty,'') AS d, count(q) AS c", {"name":module_name}).data()
-                elif module_id:
-                    rec=session.run("MATCH (cm) WHERE elementId(cm)=$id MATCH (cm)<-[:TESTS]-(q:Question) RETURN count(q) AS total, count(CASE WHEN q.user_result='true' THEN 1 END) AS mastered", {"id":module_id}).single()
-                    rows=session.run("MATCH (cm) WHERE elementId(cm)=$id MATCH (cm)<-[:TESTS]-(q:Question) RETURN coalesce(q.difficulty,'') AS d, count(q) AS c", {"id":module_id}).data()
+                if session_id:
+                    # 按学习者过滤已答对的题，不读全局 user_result
+                    where=["NOT (elementId(q) IN $done OR coalesce(q.qid,'') IN $done)"]
+                    params["done"]=_mastery.correct_questions(_learner_key(session_id))
                 else:
-                    return {"error":"missing module_name or module_id"}
-                total=int(rec.get("total") or 0)
-                mastered=int(rec.get("mastered") or 0)
-                pending=max(0,total-mastered)
-                by_diff={}
-                for r in rows:
-                    d=str(r.get("d") or "")
-                    c=int(r.get("c") or 0)
-                    by_diff[d]=c
-                return {"total":total,"mastered":mastered,"pending":pending,"by_difficulty":by_diff}
-            out=_query_neo4j(run)
-            self.send_response(200)
-            self._cors()
-            self.send_header("Content-Type","application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(out or {"error":"neo4j unavailable"}).encode("utf-8"))
+                    where=["coalesce(q.user_result,'') <> 'true'"]
+                if qtype:
+                    where.append("q.type = $qtype")
+                    params["qtype"]=qtype
+                if difficulty:
+                    where.append("q.difficulty = $difficulty")
+                    params["difficulty"]=difficulty
+                if exclude_ids:
+                    where.append("NOT elementId(q) IN $exclude_ids")
+                    params["exclude_ids"]=exclude_ids
+                if exclude_qids:
+                    where.append("NOT q.qid IN $exclude_qids")
+                    params["exclude_qids"]=exclude_qids
+                # 批量模式：按 (created_at, elementId) 键集分页
+                if count and cursor:
+                    where.append("(ts < $cur_ts OR (ts = $cur_ts AND qid_ < $cur_id))")
+                    params["cur_ts"], params["cur_id"]=cursor
+                cypher=(anchor+" MATCH (cm)<-[:TESTS]-(q:Question) "
+                        "WITH q, "+_QUESTION_TS+", elementId(q) AS qid_ WHERE "+" AND ".join(where))
+                if not count:
+                    rec=session.run(cypher+" RETURN q ORDER BY ts DESC, qid_ DESC LIMIT 1",params).single()
+                    return {"question":_question_out(rec.get("q"), include_answer) if rec else None}
+                params["limit"]=limit
+                rows=list(session.run(cypher+" RETURN q, ts, qid_ ORDER BY ts DESC, qid_ DESC LIMIT $limit",params))
+                out={"questions":[_question_out(r.get("q"), include_answer) for r in rows], "next_cursor":None}
+                if len(rows)==limit:
+                    out["next_cursor"]=_encode_cursor(rows[-1].get("ts"), rows[-1].get("qid_"))
+                return out
+            res=_query_neo4j(run)
+            self._send(200, json.dumps(res or {"error":"neo4j unavailable"}).encode("utf-8"), "application/json")
             return
         if self.path.startswith("/health"):
-            _load_env()
-            base=os.environ.get("MS_BASE_URL","https://api-inference.modelscope.cn/v1").rstrip("/")
-            key=os.environ.get("MS_API_KEY","" ).strip()
-            model=os.environ.get("MS_MODEL","Qwen/Qwen3-32B").strip()
-            res={"ok": True, "ms_key_present": bool(key), "base": base, "model": model}
-            self.send_response(200)
-            self._cors()
-            self.send_header("Content-Type","application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(res).encode("utf-8"))
-            return
-        self.send_response(404)
-        self._cors()
-        self.end_headers()
+            self._health()
+            return
+        self._send(404)
 
-    def do_POST(self):
+    def _handle_post(self):
         if self.path == "/cancel_task":
             length=int(self.headers.get("Content-Length") or 0)
             body=self.rfile.read(length) if length>0 else b""
@@ -347,20 +1084,15 @@ class Handler(BaseHTTPRequestHandler):
                      raise ValueError("task_id required")
                 
                 if lightrag_wrapper and lightrag_wrapper.cancel_task(task_id):
-                    self.send_response(200)
-                    self._cors()
-                    self.end_headers()
-                    self.wfile.write(b'{"ok": true}')
+                    self._send(200, b'{"ok": true}')
                 else:
-                    self.send_response(400)
-                    self._cors()
-                    self.end_headers()
-                    self.wfile.write(b'{"error": "Task not found or cannot be cancelled"}')
+                    self._send(400, b'{"error": "Task not found or cannot be cancelled"}')
             except Exception as e:
-                self.send_response(400)
-                self._cors()
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": str(e)}).encode("utf-8"))
+                self._send(400, json.dumps({"error": str(e)}).encode("utf-8"))
+            return
+
+        if self.path == "/resume_task":
+            self._resume_task()
             return
 
         if self.path == "/upload_doc":
@@ -372,42 +1104,36 @@ class Handler(BaseHTTPRequestHandler):
                 file_base64 = payload.get("file_base64")
                 filename = payload.get("filename") or ""
                 db_name = payload.get("db_name") or "neo4j"
+                priority = int(payload.get("priority") or 0)
             except:
                 text = body.decode("utf-8", errors="ignore")
                 db_name = "neo4j"
                 file_base64 = None
                 filename = "raw_text"
+                priority = 0
             
             if not text and not file_base64:
-                self.send_response(400)
-                self._cors()
-                self.end_headers()
-                self.wfile.write(b'{"error": "empty text or unsupported file type"}')
+                self._send(400, b'{"error": "empty text or unsupported file type"}')
                 return
 
             if lightrag_wrapper:
                 try:
                     # Async insert
+                    since=time.time()
                     if file_base64:
-                        task_id = lightrag_wrapper.submit_indexing_task(file_base64, 'binary', filename, db_name)
+                        task_id = lightrag_wrapper.submit_indexing_task(file_base64, 'binary', filename, db_name, priority)
                     else:
-                        task_id = lightrag_wrapper.submit_indexing_task(text, 'text', filename, db_name)
+                        task_id = lightrag_wrapper.submit_indexing_task(text, 'text', filename, db_name, priority)
 
-                    self.send_response(200)
-                    self._cors()
-                    self.send_header("Content-Type","application/json")
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"ok": True, "message": "Document queued for indexing", "task_id": task_id}).encode("utf-8"))
+                    self._send(200, json.dumps(_upload_result(task_id, since)).encode("utf-8"), "application/json")
                 except Exception as e:
-                    self.send_response(500)
-                    self._cors()
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"error": str(e)}).encode("utf-8"))
+                    self._send(500, json.dumps({"error": str(e)}).encode("utf-8"))
             else:
-                self.send_response(503)
-                self._cors()
-                self.end_headers()
-                self.wfile.write(b'{"error": "LightRAG not available"}')
+                self._send(503, b'{"error": "LightRAG not available"}')
+            return
+
+        if urlparse(self.path).path == "/upload_file":
+            self._upload_file()
             return
 
         if self.path == "/submit_answer":
@@ -421,28 +1147,40 @@ class Handler(BaseHTTPRequestHandler):
             qid=str(payload.get("qid") or "").strip()
             is_correct=bool(payload.get("is_correct"))
             session_id=str(payload.get("session_id") or "").strip()
+            db=str(payload.get("db") or "").strip() or None
             
             # Log learning event
             if session_id:
-                _log_learning(session_id, question_id or qid, is_correct)
+                _log_learning(session_id, question_id or qid, is_correct, db)
+                if question_id or qid:
+                    _mastery.record_answers(_learner_key(session_id, db), [(question_id or qid, is_correct)])
 
+            # 全局 q.user_result 仍然写入：不带 session_id 的读取方与图谱浏览使用它
             def run(session):
+                # 顺带取回题目所属的 Concept，用于失效统计缓存
+                tail=(" SET q.user_result=$res WITH q OPTIONAL MATCH (q)-[:TESTS]->(cm) "
+                      "RETURN q, collect(elementId(cm)) AS cids, collect(cm.name) AS cnames")
                 if qid:
-                    cypher="MATCH (q:Question {qid:$qid}) SET q.user_result=$res RETURN q"
+                    cypher="MATCH (q:Question {qid:$qid})"+tail
                     rec=session.run(cypher,{"qid":qid,"res":"true" if is_correct else "false"}).single()
                 elif question_id:
-                    cypher="MATCH (q) WHERE elementId(q)=$id SET q.user_result=$res RETURN q"
+                    cypher="MATCH (q) WHERE elementId(q)=$id"+tail
                     rec=session.run(cypher,{"id":question_id,"res":"true" if is_correct else "false"}).single()
                 else:
                     return {"error":"missing question_id or qid"}
                 ok=bool(rec)
+                if ok:
+                    _stats_cache.invalidate(db or _neo4j_settings()[3], rec.get("cids") or [], rec.get("cnames") or [])
                 return {"ok":ok}
-            res=_query_neo4j(run)
-            self.send_response(200)
-            self._cors()
-            self.send_header("Content-Type","application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(res or {"error":"neo4j unavailable"}).encode("utf-8"))
+            res=_query_neo4j(run, db)
+            if session_id and (question_id or qid) and (res is None or not res.get("ok")):
+                # 个人状态已记录；全局聚合写入失败不影响本次作答
+                metrics.degraded("user_result_write")
+                res={"ok":True}
+            self._send(200, json.dumps(res or {"error":"neo4j unavailable"}).encode("utf-8"), "application/json")
+            return
+        if self.path == "/submit_answers":
+            self._submit_answers()
             return
         if self.path == "/zpd_update":
             length=int(self.headers.get("Content-Length") or 0)
@@ -451,32 +1189,34 @@ class Handler(BaseHTTPRequestHandler):
                 payload=json.loads(body.decode("utf-8") or "{}")
             except Exception:
                 payload={}
+            node_ids=[str(x).strip() for x in (payload.get("node_ids") or []) if str(x).strip()]
             node_id=str(payload.get("node_id") or "").strip()
-            def run(session):
-                if not node_id:
-                    return {"error":"missing node_id"}
-                cypher=(
-                    "MATCH (c) WHERE elementId(c)=$id SET c.status=2 "
-                    "WITH c MATCH (c)-[:PREREQUISITE]->(next) "
-                    "OPTIONAL MATCH (pre)-[:PREREQUISITE]->(next) "
-                    "WITH next, collect(coalesce(pre.status,0)) AS sts "
-                    "WHERE size(sts)>0 AND ALL(s IN sts WHERE s=2) "
-                    "SET next.status=1 RETURN collect(elementId(next)) AS unlocked"
-                )
-                rec=session.run(cypher,{"id":node_id}).single()
-                unlocked=list(rec.get("unlocked") or [])
-                return {"ok":True, "unlocked":unlocked}
-            res=_query_neo4j(run)
-            self.send_response(200)
-            self._cors()
-            self.send_header("Content-Type","application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(res or {"error":"neo4j unavailable"}).encode("utf-8"))
+            if node_id:
+                node_ids.append(node_id)
+            if not node_ids:
+                self._send(200, b'{"error": "missing node_id"}', "application/json")
+                return
+            db=str(payload.get("db") or "").strip() or None
+            session_id=str(payload.get("session_id") or "").strip()
+            if session_id:
+                unlocked=_learner_unlocks(session_id, node_ids, db)
+                # 全局 c.status 交给合并器稍后批量传播，请求不等待写图
+                _zpd_coalescer.add(db, node_ids)
+                res={"ok":True, "unlocked":unlocked} if unlocked is not None else {"error":"neo4j unavailable"}
+                self._send(200, json.dumps(res).encode("utf-8"), "application/json")
+                return
+            if payload.get("defer"):
+                pending=_zpd_coalescer.add(db, node_ids)
+                self._send(202, json.dumps({"ok":True, "deferred":True, "pending":pending}).encode("utf-8"), "application/json")
+                return
+            unlocked=_query_neo4j(lambda session: _propagate_zpd(session, node_ids), db)
+            res={"ok":True, "unlocked":unlocked} if unlocked is not None else None
+            self._send(200, json.dumps(res or {"error":"neo4j unavailable"}).encode("utf-8"), "application/json")
             return
-        if self.path != "/llm":
-            self.send_response(404)
-            self._cors()
-            self.end_headers()
+        route=urlparse(self.path)
+        if route.path != "/llm":
+            self.close_connection=True
+            self._send(404)
             return
         length=int(self.headers.get("Content-Length") or 0)
         body=b""
@@ -489,155 +1229,776 @@ class Handler(BaseHTTPRequestHandler):
         question=str(payload.get("question") or "").strip()
         evidence=list(payload.get("evidence") or [])
         session_id=str(payload.get("session_id") or "").strip()
+        # /llm?stream=1：以 SSE 逐段转发上游生成的内容
+        stream=((parse_qs(route.query).get("stream") or [""])[0].lower() in ("1","true","yes")) or payload.get("stream") is True
+
+        tracing.annotate(stream=bool(stream), session=bool(session_id), evidence=len(evidence))
 
         # Log User Question
         if session_id and question:
-            _log_dialogue(session_id, "user", question)
-        
-        # 1. Graph-Guided Retrieval (New Feature for Paper)
-        # 主动从 Neo4j 检索素养路径，作为高层指导
-        graph_paths = _search_competency_path(question)
-        graph_context_text = ""
-        if graph_paths:
-            graph_context_text = "【图谱背景知识】\n本问题关联的学科素养路径：\n" + "\n".join([f"- {p}" for p in graph_paths])
+            with tracing.span("log_dialogue.user"):
+                _log_dialogue(session_id, "user", question)
         
         _load_env()
         base=os.environ.get("MS_BASE_URL","https://api-inference.modelscope.cn/v1").rstrip("/")
         key=os.environ.get("MS_API_KEY","" ).strip()
         model=os.environ.get("MS_MODEL","Qwen/Qwen3-32B").strip()
 
+        with tracing.span("evidence_text") as sp:
+            browser_text=_browser_evidence_text(evidence)
+            sp.set(chars=len(browser_text))
+
+        info={}
+        def reply(obj):
+            # 检索报告与各阶段耗时随回答一起返回
+            return dict(obj, timings=tracing.timings(), **info)
+        opts=_retrieval_options(payload, bool(key))
+
+        # 1. Graph-Guided Retrieval (New Feature for Paper)
+        # 主动从 Neo4j 检索素养路径，作为高层指导（进程内概念索引，开销很小）
+        with tracing.span("graph_retrieval") as sp:
+            graph_paths = _search_competency_path(question)
+            sp.set(paths=len(graph_paths or []))
+        graph_context_text = _graph_context_text(graph_paths)
+
+        # 回答缓存以 问题 + 图谱路径 + 浏览器证据 + 检索配置（库、索引版本）为键，
+        # 在知识库检索之前查找：命中时不再查询 LightRAG，近似问题层也不受检索结果随问题变化的影响
+        cache=answer_cache.get_cache() if key else None
+        cache_context="\n".join((graph_context_text, browser_text, _retrieval_signature(opts)))
+        with tracing.span("cache_lookup") as sp:
+            hit=cache.get(model, question, cache_context) if cache is not None else None
+            sp.set(hit=hit["tier"] if hit else None)
+        if hit:
+            answer=hit["answer"]
+            if session_id:
+                with tracing.span("log_dialogue.assistant"):
+                    _log_dialogue(session_id, "assistant", answer, context=graph_context_text or None)
+            if stream:
+                self._sse_start()
+                self._sse_event({"delta": answer})
+                self._sse_event(reply({"answer": answer, "context_path": graph_paths, "cached": True, "cache": hit["tier"]}), event="done")
+            else:
+                self._send(200, json.dumps(reply({"answer":answer, "context_path": graph_paths, "cached": True, "cache": hit["tier"]})).encode("utf-8"), "application/json")
+            return
+
+        # 2. LightRAG 索引检索（见 hybrid_retrieval）
+        rag_text=""
+        if opts:
+            res=_retriever.retrieve(question, opts["db"], opts["modes"], opts["top_k"], opts["max_tokens"],
+                                    seen_text=browser_text)
+            if res["context"]:
+                rag_text="【知识库检索】\n"+res["context"]
+            info["retrieval"]={"db_name": opts["db"], "modes": res["modes"], "merge": res["merge"]}
+
         if not key:
+            metrics.degraded("llm_missing_key")
             fallback = "模型不可用，基于已有信息给出简述.\n\n问题:"+question+"\n\n证据:\n"+("\n\n".join(["主题:"+str((e or {}).get("focus") or "") for e in evidence]) or "(无)")
-            self.send_response(200)
-            self._cors()
-            self.send_header("Content-Type","application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"answer": fallback, "degraded": True, "error": "missing MS_API_KEY", "context_path": graph_paths}).encode("utf-8"))
-            return
-
-        parts=[]
-        # Add Graph Context first if available
-        if graph_context_text:
-            parts.append(graph_context_text)
-
-        for e in evidence:
-            a=[]
-            f=str((e or {}).get("focus") or "").strip()
-            if f:
-                a.append("主题: "+f)
-            ns=e.get("neighbors") or []
-            if ns:
-                a.append("关联节点: "+", ".join([str(x) for x in ns if str(x).strip()]))
-            rs=e.get("relations") or []
-            if rs:
-                a.append("关联关系: "+", ".join([str(x) for x in rs if str(x).strip()]))
-            ls=e.get("links") or []
-            if ls:
-                parts_links=[]
-                for link in ls:
-                    nn=str((link or {}).get("neighborName") or "").strip()
-                    nid=str((link or {}).get("neighborId") or "").strip()
-                    tp=str((link or {}).get("type") or "").strip()
-                    dr=str((link or {}).get("dir") or "").strip()
-                    if nn or nid or tp or dr:
-                        s=f"{tp}:{dr} → {nn} [{nid}]"
-                        parts_links.append(s)
-                if parts_links:
-                    a.append("关联链接: "+" | ".join(parts_links))
-            cs=e.get("concepts") or []
-            if cs:
-                a.append("相关知识: "+", ".join([str(x) for x in cs if str(x).strip()]))
-            ss=e.get("skills") or []
-            if ss:
-                a.append("关联能力: "+", ".join([str(x) for x in ss if str(x).strip()]))
-            ts=e.get("tasks") or []
-            if ts:
-                a.append("训练任务: "+", ".join([str(x) for x in ts if str(x).strip()]))
-            ps=e.get("competencies") or []
-            if ps:
-                a.append("涉及素养: "+", ".join([str(x) for x in ps if str(x).strip()]))
-            if a:
-                parts.append("\n".join(a))
-        evidence_text="\n\n".join(parts)
-
-        url=base+"/chat/completions"
-        headers={
-            "Content-Type":"application/json",
-            "Accept":"application/json",
-            "Authorization":"Bearer "+key,
-            "Connection":"close",
-            "User-Agent":"simple-neo4j/1.0"
-        }
-        body=json.dumps({
-            "model": model,
-            "messages": [
-                {"role":"system","content":"你是一名精通素养图谱、能力图谱与知识图谱的智能问答导师。根据提供的图谱数据与其相连的节点作为证据回答问题，不要臆造。输出简洁并包含建议。当证据为空时，给出常识解释。"},
-                {"role":"user","content": f"问题：{question}\n\n证据：\n{evidence_text}"}
-            ],
-            "temperature": 0.3,
-            "top_p": 0.9,
-            "enable_thinking": False
-        }).encode("utf-8")
-        ctx=ssl.create_default_context()
-        opener=build_opener(HTTPSHandler(context=ctx))
-        install_opener(opener)
-        req=Request(url, data=body, headers=headers, method="POST")
-        attempt=0
-        while True:
-            try:
-                with urlopen(req, timeout=60) as resp:
-                    ct=(resp.headers.get("Content-Type") or "").lower()
-                    data=resp.read()
-                break
-            except HTTPError as he:
-                ct=(he.headers.get("Content-Type") or "").lower()
-                data=he.read()
-                break
-            except URLError as ue:
-                if attempt<2:
-                    attempt+=1
-                    time.sleep(0.3)
-                    continue
-                fallback = "模型不可用，基于已有信息给出简述。\n\n问题："+question+"\n\n证据：\n"+(evidence_text or "(无)")
-                self.send_response(200)
-                self._cors()
-                self.send_header("Content-Type","application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({"answer": fallback, "degraded": True, "error": str(ue)}).encode("utf-8"))
+            if stream:
+                self._sse_start()
+                self._sse_event({"delta": fallback})
+                self._sse_event(reply({"answer": fallback, "degraded": True, "error": "missing MS_API_KEY", "context_path": graph_paths}), event="done")
                 return
+            self._send(200, json.dumps(reply({"answer": fallback, "degraded": True, "error": "missing MS_API_KEY", "context_path": graph_paths})).encode("utf-8"), "application/json")
+            return
 
-        answer=""
-        if "json" in ct:
-            try:
-                j=json.loads(data.decode("utf-8"))
-            except Exception:
-                j={}
-            if isinstance(j, dict) and j.get("error"):
-                msg=str(j.get("error",{}).get("message") or "invalid request")
-                answer = msg or ("模型不可用，基于已有信息给出简述。\n\n问题："+question+"\n\n证据：\n"+(evidence_text or "(无)"))
-            else:
-                answer=str((j.get("choices") or [{}])[0].get("message",{}).get("content") or j.get("answer") or j.get("data") or json.dumps(j))
-        else:
-            answer=data.decode("utf-8",errors="ignore")
+        evidence_text="\n\n".join(p for p in (graph_context_text, browser_text, rag_text) if p)
+        tracing.annotate(evidence_chars=len(evidence_text))
+
+        messages=[
+            {"role":"system","content":"你是一名精通素养图谱、能力图谱与知识图谱的智能问答导师。根据提供的图谱数据与其相连的节点作为证据回答问题，不要臆造。输出简洁并包含建议。当证据为空时，给出常识解释。"},
+            {"role":"user","content": f"问题：{question}\n\n证据：\n{evidence_text}"}
+        ]
+        def remember(answer):
+            if cache is not None:
+                cache.put(model, question, cache_context, answer, graph_paths)
+
+        # 复用到上游的长连接池，重试与退避由 llm_client 处理
+        client=llm_client.get_client()
+        def open_upstream():
+            return client.chat_completion(messages, model, base, key, stream=stream, temperature=0.3, top_p=0.9)
+        if stream:
+            self._llm_stream(open_upstream, question, evidence_text, graph_paths, graph_context_text, session_id, remember, reply)
+            return
+        try:
+            with tracing.span("upstream", model=model), open_upstream() as resp:
+                ct=resp.content_type
+                status=resp.status
+                data=resp.read()
+        except llm_client.LLMUnavailable as ue:
+            metrics.degraded("llm_unavailable")
+            fallback = "模型不可用，基于已有信息给出简述。\n\n问题："+question+"\n\n证据：\n"+(evidence_text or "(无)")
+            self._send(200, json.dumps(reply({"answer": fallback, "degraded": True, "error": str(ue)})).encode("utf-8"), "application/json")
+            return
+
+        with tracing.span("parse_answer"):
+            answer=_parse_llm_answer(ct, data, question, evidence_text)
+            if status<300 and "json" in ct:
+                remember(answer)
 
         # Log AI Answer
         if session_id and answer:
-            _log_dialogue(session_id, "assistant", answer, context=graph_context_text if graph_paths else None)
+            with tracing.span("log_dialogue.assistant"):
+                _log_dialogue(session_id, "assistant", answer, context=graph_context_text if graph_paths else None)
+
+        self._send(200, json.dumps(reply({"answer":answer, "context_path": graph_paths})).encode("utf-8"), "application/json")
+
+    def _questions(self):
+        # 题库分页列表：键集分页 + 字段投影 + 过滤，ETag 命中时返回 304
+        qs=parse_qs(urlparse(self.path).query)
+        arg=lambda name: (qs.get(name) or [""])[0].strip()
+        fields=_qs_list(qs, "fields") or list(_QUESTION_FIELDS)
+        if arg("include_answer").lower() in ("1","true","yes"):
+            fields+=["answer","analysis"]
+        unknown=[f for f in fields if f not in _QUESTION_FIELDS and f not in _QUESTION_PRIVATE_FIELDS]
+        try:
+            if unknown:
+                raise ValueError("unknown fields: "+",".join(unknown))
+            limit=max(1, min(int(arg("limit") or 50), int(os.environ.get("QUESTION_PAGE_MAX","200"))))
+            cursor=_question_cursor(arg("cursor"))
+            result=arg("result").lower()
+            if result not in ("", "true", "false", "none"):
+                raise ValueError("result must be true, false or none")
+        except ValueError as e:
+            self._send(400, json.dumps({"error": str(e)}).encode("utf-8"), "application/json")
+            return
+        params={"limit":limit}
+        where=[]
+        if arg("concept"):
+            match="MATCH (:Concept {name:$concept})<-[:TESTS]-(q:Question)"
+            params["concept"]=arg("concept")
+        elif arg("concept_id"):
+            match="MATCH (cm) WHERE elementId(cm)=$concept_id MATCH (cm)<-[:TESTS]-(q:Question)"
+            params["concept_id"]=arg("concept_id")
+        else:
+            match="MATCH (q:Question)"
+        ids=_qs_list(qs, "ids")
+        if ids:
+            where.append("qid_ IN $ids")
+            params["ids"]=ids
+        for name in ("type", "difficulty"):
+            if arg(name):
+                where.append(f"q.{name} = ${name}")
+                params[name]=arg(name)
+        session_id=arg("session_id")
+        if session_id:
+            key=_learner_key(session_id, arg("db") or None)
+            correct=set(_mastery.correct_questions(key))
+            answered=set(_mastery.answered_questions(key))
+            seen="(qid_ IN $answered OR coalesce(q.qid,'') IN $answered)"
+            right="(qid_ IN $correct OR coalesce(q.qid,'') IN $correct)"
+            if result=="none":
+                where.append("NOT "+seen)
+            elif result=="true":
+                where.append(right)
+            elif result=="false":
+                where.append(seen+" AND NOT "+right)
+            if result:
+                params["answered"], params["correct"]=list(answered), list(correct)
+        elif result=="none":
+            where.append("q.user_result IS NULL")
+        elif result:
+            where.append("q.user_result = $result")
+            params["result"]=result
+        if cursor:
+            where.append("(ts < $cur_ts OR (ts = $cur_ts AND qid_ < $cur_id))")
+            params["cur_ts"], params["cur_id"]=cursor
+        props=[f for f in fields if f not in ("id","concept")]
+        cypher=(match+" WITH DISTINCT q WITH q, "+_QUESTION_TS+", elementId(q) AS qid_"
+                +(" WHERE "+" AND ".join(where) if where else "")
+                +" WITH q, ts, qid_ ORDER BY ts DESC, qid_ DESC LIMIT $limit"
+                +" OPTIONAL MATCH (q)-[:TESTS]->(m:Concept) WITH q, ts, qid_, collect(m.name) AS concepts"
+                +" RETURN "+("q{"+", ".join("."+f for f in props)+"}" if props else "{}")+" AS q, ts, qid_, q.qid AS qkey, concepts ORDER BY ts DESC, qid_ DESC")
+        def run(session):
+            return list(session.run(cypher, params))
+        rows=_query_neo4j(run, arg("db") or None)
+        if rows is None:
+            self._send(200, b'{"error": "neo4j unavailable"}', "application/json")
+            return
+        items=[]
+        for r in rows:
+            item={"id": r.get("qid_")} if "id" in fields else {}
+            item.update(_jsonable(r.get("q") or {}))
+            if session_id and "user_result" in fields:
+                # 个人作答结果覆盖全局 user_result
+                keys=(r.get("qid_"), r.get("qkey"))
+                item["user_result"]="true" if any(k in correct for k in keys) else ("false" if any(k in answered for k in keys) else None)
+            if "concept" in fields:
+                concepts=r.get("concepts") or []
+                item["concept"]=concepts[0] if concepts else None
+                item["concepts"]=concepts
+            items.append(item)
+        out={"questions":items, "next_cursor":None}
+        if len(rows)==limit:
+            out["next_cursor"]=_encode_cursor(rows[-1].get("ts"), rows[-1].get("qid_"))
+        body=json.dumps(out, ensure_ascii=False).encode("utf-8")
+        # ETag 取自查询后的完整响应体：浏览器会直接写 Neo4j 新增题目，服务端没有能覆盖这类改动的廉价版本号，
+        # 所以 304 只省下传输与前端重新渲染，查询本身照常执行
+        etag='W/"'+hashlib.sha1(body).hexdigest()+'"'
+        headers={"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in (self.headers.get("If-None-Match") or ""):
+            self._send(304, headers=headers)
+            return
+        self._send(200, body, "application/json; charset=utf-8", headers)
+
+    def _submit_answers(self):
+        # 批量提交：一个 UNWIND 事务写入全部结果，掌握节点的 ZPD 解锁只计算一次
+        length=int(self.headers.get("Content-Length") or 0)
+        body=self.rfile.read(length) if length>0 else b""
+        try:
+            payload=json.loads(body.decode("utf-8") or "{}")
+            results=payload.get("results") or []
+            if not isinstance(results, list):
+                raise ValueError("results must be a list")
+        except Exception as e:
+            self._send(400, json.dumps({"error": str(e)}).encode("utf-8"), "application/json")
+            return
+        session_id=str(payload.get("session_id") or "").strip()
+        db=str(payload.get("db") or "").strip() or None
+        mastered=[str(x).strip() for x in (payload.get("mastered") or []) if str(x).strip()]
+        rows=[]
+        for r in results:
+            if not isinstance(r, dict):
+                continue
+            row={"qid":str(r.get("qid") or "").strip(), "id":str(r.get("question_id") or "").strip(),
+                 "res":"true" if r.get("is_correct") else "false"}
+            if row["qid"] or row["id"]:
+                rows.append(row)
+                if session_id:
+                    _log_learning(session_id, row["id"] or row["qid"], bool(r.get("is_correct")), db)
+        if not rows and not mastered:
+            self._send(200, b'{"error": "missing results"}', "application/json")
+            return
+        if session_id:
+            _mastery.record_answers(_learner_key(session_id, db), [(row["id"] or row["qid"], row["res"]=="true") for row in rows])
+        # 全局 q.user_result / c.status 仍然写图；有学习者身份时 ZPD 的全局传播总是延后，响应返回个人解锁结果
+        deferred=bool(mastered) and (bool(payload.get("defer")) or bool(session_id))
+        def run(session):
+            updated, cids, cnames=_apply_answers(session, rows) if rows else (0, set(), set())
+            out={"ok":True, "updated":updated, "received":len(rows)}
+            if cids or cnames:
+                _stats_cache.invalidate(db or _neo4j_settings()[3], cids, cnames)
+            if mastered and not deferred:
+                out["unlocked"]=_propagate_zpd(session, mastered)
+            return out
+        res=_query_neo4j(run, db)
+        if session_id:
+            if res is None:
+                metrics.degraded("user_result_write")
+            elif mastered:
+                _zpd_coalescer.add(db, mastered)
+            res={"ok":True, "updated":len(rows), "received":len(rows)}
+            if mastered:
+                res["unlocked"]=_learner_unlocks(session_id, mastered, db)
+        elif res and deferred:
+            res["deferred"]=True
+            res["pending"]=_zpd_coalescer.add(db, mastered)
+        self._send(200, json.dumps(res or {"error":"neo4j unavailable"}).encode("utf-8"), "application/json")
+
+    def _recommend(self):
+        # 下一步推荐：前驱已全部掌握、尚未掌握的概念，按拓扑序取前 k 个
+        qs=parse_qs(urlparse(self.path).query)
+        session_id=(qs.get("session_id") or [""])[0].strip()
+        db=(qs.get("db") or [""])[0].strip() or None
+        try:
+            k=max(1, min(int((qs.get("k") or ["5"])[0]), 50))
+        except ValueError:
+            k=5
+        try:
+            concepts=_prereq_engine(db).recommend(session_id, k)
+        except Exception as e:
+            print(f"Prerequisite DAG error: {e}")
+            concepts=None
+        res={"ok":True, "concepts":concepts} if concepts is not None else {"error":"neo4j unavailable"}
+        self._send(200, json.dumps(res).encode("utf-8"), "application/json")
+
+    def _question_stats(self):
+        qs=parse_qs(urlparse(self.path).query)
+        module_name=(qs.get("module_name") or ["\n"])[0].strip()
+        module_id=(qs.get("module_id") or [""])[0].strip()
+        bulk=(qs.get("all") or ["false"])[0].lower() in ("1","true","yes")
+        db=(qs.get("db") or [""])[0].strip() or None
+        database=db or _neo4j_settings()[3]
+        if bulk:
+            key=(database, "all")
+        elif module_name:
+            key=(database, "name", module_name)
+        elif module_id:
+            key=(database, "id", module_id)
+        else:
+            self._send(200, b'{"error": "missing module_name or module_id"}', "application/json")
+            return
+        raw=_stats_cache.get(key)
+        if raw is None:
+            def run(session):
+                if bulk:
+                    # 所有 Concept 一次返回，前端不再逐个请求
+                    return session.run("MATCH (cm:Concept) OPTIONAL MATCH (cm)<-[:TESTS]-(q:Question) "
+                                       "WITH cm, "+_STATS_COLS+"WITH cm, collect({d:d, c:c, m:m, qs:qs}) AS rows "
+                                       "RETURN elementId(cm) AS id, cm.name AS name, rows ORDER BY name").data()
+                if module_name:
+                    anchor, params="MATCH (cm:Concept {name:$name})", {"name":module_name}
+                else:
+                    anchor, params="MATCH (cm) WHERE elementId(cm)=$id", {"id":module_id}
+                return session.run(anchor+" MATCH (cm)<-[:TESTS]-(q:Question) WITH "+_STATS_COLS+"RETURN d, c, m, qs", params).data()
+            raw=_query_neo4j(run, db)
+            if raw is None:
+                self._send(200, b'{"error": "neo4j unavailable"}', "application/json")
+                return
+            _stats_cache.put(key, raw)
+        session_id=(qs.get("session_id") or [""])[0].strip()
+        correct=set(_mastery.correct_questions(_learner_key(session_id, db))) if session_id else None
+        if bulk:
+            out={"concepts":[dict(id=r["id"], name=r["name"], **_stats_from_rows(r["rows"], correct)) for r in raw]}
+        else:
+            out=_stats_from_rows(raw, correct)
+        self._send(200, json.dumps(out).encode("utf-8"), "application/json")
+
+    def _upload_file(self):
+        # 流式上传：multipart/form-data 或原始二进制（参数放在查询串），边读边写临时文件并计算哈希
+        if not lightrag_wrapper:
+            self.close_connection=True
+            self._send(503, b'{"error": "LightRAG not available"}', "application/json")
+            return
+        params={k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        max_bytes=int(float(os.environ.get("UPLOAD_MAX_MB","50"))*1024*1024)
+        try:
+            up=upload_stream.receive(self.rfile, self.headers, lightrag_wrapper.JOBS_DIR, max_bytes)
+        except upload_stream.UploadError as e:
+            # 请求体可能未读完，不能复用该连接
+            self.close_connection=True
+            self._send(e.status, json.dumps({"error": str(e)}).encode("utf-8"), "application/json")
+            return
+        fields=dict(params, **up["fields"])
+        filename=fields.get("filename") or up["filename"] or "upload"
+        db_name=fields.get("db_name") or "neo4j"
+        try:
+            priority=int(fields.get("priority") or 0)
+            since=time.time()
+            task_id=lightrag_wrapper.submit_indexing_file(up["path"], filename, db_name, priority, up["sha256"], up["size"])
+        except Exception as e:
+            try:
+                os.remove(up["path"])
+            except OSError:
+                pass
+            self._send(500, json.dumps({"error": str(e)}).encode("utf-8"), "application/json")
+            return
+        res=_upload_result(task_id, since)
+        res.update(size=up["size"], sha256=up["sha256"])
+        self._send(200, json.dumps(res).encode("utf-8"), "application/json")
 
+    def _sse_start(self):
+        # SSE 响应没有 Content-Length，发送完毕后关闭连接
+        self.close_connection=True
         self.send_response(200)
         self._cors()
-        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Type","text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control","no-cache")
+        self.send_header("X-Accel-Buffering","no")
+        self.send_header("Connection","close")
         self.end_headers()
-        self.wfile.write(json.dumps({"answer":answer, "context_path": graph_paths}).encode("utf-8"))
+
+    def _sse_event(self, obj, event=None, id=None):
+        msg=(f"id: {id}\n" if id is not None else "")+(f"event: {event}\n" if event else "")+"data: "+json.dumps(obj, ensure_ascii=False)+"\n\n"
+        self.wfile.write(msg.encode("utf-8"))
+        self.wfile.flush()
+
+    def _resume_task(self):
+        # 失败/取消的任务从最后一个检查点继续，已完成的分块不再重复抽取
+        length=int(self.headers.get("Content-Length") or 0)
+        body=self.rfile.read(length) if length>0 else b""
+        try:
+            payload=json.loads(body.decode("utf-8"))
+            task_id=payload.get("task_id")
+            if not task_id:
+                raise ValueError("task_id required")
+            if lightrag_wrapper and lightrag_wrapper.resume_task(task_id):
+                self._send(200, b'{"ok": true}')
+            else:
+                self._send(400, b'{"error": "Task not found or cannot be resumed"}')
+        except Exception as e:
+            self._send(400, json.dumps({"error": str(e)}).encode("utf-8"))
+
+    def _health(self):
+        _load_env()
+        res={
+            "ok": True,
+            "ms_key_present": bool(os.environ.get("MS_API_KEY","").strip()),
+            "base": os.environ.get("MS_BASE_URL","https://api-inference.modelscope.cn/v1").rstrip("/"),
+            "model": os.environ.get("MS_MODEL","Qwen/Qwen3-32B").strip(),
+        }
+        for name, stats in _HEALTH_STATS:
+            # 单个子系统出错不影响其余状态的返回
+            try:
+                res[name]=stats()
+            except Exception as e:
+                res[name]={"error": str(e)}
+        self._send(200, json.dumps(res).encode("utf-8"), "application/json")
+
+    def _tasks(self):
+        # 任务列表：按创建时间倒序的键集分页，可按状态和库过滤
+        if not lightrag_wrapper:
+            self._send(503, b'{"error": "LightRAG not available"}', "application/json")
+            return
+        qs=parse_qs(urlparse(self.path).query)
+        arg=lambda name: (qs.get(name) or [""])[0].strip()
+        statuses=_qs_list(qs, "status")
+        try:
+            unknown=[x for x in statuses if x not in _TASK_STATUSES]
+            if unknown:
+                raise ValueError("unknown status: "+",".join(unknown))
+            limit=max(1, min(int(arg("limit") or 50), 200))
+            cursor=_decode_cursor(arg("cursor"))
+            before=(float(cursor[0]), cursor[1]) if cursor else None
+        except ValueError as e:
+            self._send(400, json.dumps({"error": str(e)}).encode("utf-8"), "application/json")
+            return
+        rows=lightrag_wrapper.list_tasks(statuses or None, arg("db_name") or None, before, limit+1)
+        out={"tasks":rows[:limit], "next_cursor":None}
+        if len(rows)>limit:
+            last=rows[limit-1]
+            out["next_cursor"]=_encode_cursor(last.get("created_at") or 0, last["id"])
+        self._send(200, json.dumps(out).encode("utf-8"), "application/json")
+
+    def _task_events(self):
+        """Status and progress of several indexing tasks over one connection.
+
+        GET /task_events?task_ids=a,b[&since=<version>]
+        With Accept: text/event-stream (or stream=1) every change is pushed as an
+        SSE "task" event whose id is the version, so EventSource resumes through
+        Last-Event-ID; ids the store does not know get one "missing" event, and
+        "end" follows once all known tasks are finished. Otherwise it is a
+        long-poll: the reply {"version", "tasks"} comes as soon as a task changes
+        after `since`, or with an empty list after `timeout` seconds.
+        """
+        if not lightrag_wrapper:
+            self._send(503, b'{"error": "LightRAG not available"}', "application/json")
+            return
+        qs=parse_qs(urlparse(self.path).query)
+        ids=list(dict.fromkeys(t.strip() for t in ",".join(qs.get("task_ids") or qs.get("task_id") or []).split(",") if t.strip()))[:100]
+        if not ids:
+            self._send(400, b'{"error": "task_ids required"}', "application/json")
+            return
+        try:
+            since=int(self.headers.get("Last-Event-ID") or (qs.get("since") or qs.get("since_version") or ["0"])[0])
+            timeout=min(max(float((qs.get("timeout") or ["25"])[0]), 0.0), 30.0)
+        except ValueError:
+            self._send(400, b'{"error": "bad since/timeout"}', "application/json")
+            return
+        stream="text/event-stream" in (self.headers.get("Accept") or "") or (qs.get("stream") or [""])[0] in ("1","true")
+        if not stream:
+            version, changed=lightrag_wrapper.wait_task_events(ids, since, timeout)
+            self._send(200, json.dumps({"version": version, "tasks": changed}).encode("utf-8"), "application/json")
+            return
+
+        self._sse_start()
+        status={}
+        deadline=time.monotonic()+float(os.environ.get("TASK_EVENTS_MAX_SECONDS","600"))
+        try:
+            # 以当前快照确定各任务状态：重连时任务已结束也能立即收到 end；未知或已过期的 id 单独报告后不再等待
+            for task_id in ids:
+                task=lightrag_wrapper.get_task_status(task_id)
+                if task is None:
+                    self._sse_event({"id": task_id, "error": "task not found"}, event="missing")
+                else:
+                    status[task_id]=task["status"]
+            ids=[t for t in ids if t in status]
+            wait=0.0
+            while time.monotonic()<deadline:
+                if ids:
+                    since, changed=lightrag_wrapper.wait_task_events(ids, since, wait)
+                else:
+                    changed=[]
+                wait=15.0
+                for task in changed:
+                    status[task["id"]]=task["status"]
+                    self._sse_event(task, event="task", id=since)
+                if all(s in lightrag_wrapper.TERMINAL_STATUSES for s in status.values()):
+                    self._sse_event({"version": since}, event="end", id=since)
+                    return
+                if not changed:
+                    # 注释行作为心跳，及时发现断开的连接，也防止代理超时
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+            # 超过最长时长后关闭，EventSource 带 Last-Event-ID 自动重连
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _llm_stream(self, open_upstream, question, evidence_text, graph_paths, graph_context_text, session_id, remember, reply):
+        try:
+            with tracing.span("upstream.connect"):
+                resp=open_upstream()
+        except llm_client.LLMUnavailable as ue:
+            metrics.degraded("llm_unavailable")
+            fallback = "模型不可用，基于已有信息给出简述。\n\n问题："+question+"\n\n证据：\n"+(evidence_text or "(无)")
+            self._sse_start()
+            self._sse_event({"delta": fallback})
+            self._sse_event(reply({"answer": fallback, "degraded": True, "error": str(ue), "context_path": graph_paths}), event="done")
+            return
+
+        self._sse_start()
+        chunks=[]
+        sp=tracing.span("upstream.stream")
+        try:
+            with sp, resp:
+                ct=resp.content_type
+                if "event-stream" in ct:
+                    for delta in _iter_sse_deltas(resp):
+                        chunks.append(delta)
+                        self._sse_event({"delta": delta})
+                    remember("".join(chunks))
+                else:
+                    # 上游未按流式返回（如错误 JSON），整体作为一个分片发送
+                    answer=_parse_llm_answer(ct, resp.read(), question, evidence_text)
+                    chunks.append(answer)
+                    self._sse_event({"delta": answer})
+                sp.set(chunks=len(chunks))
+            self._sse_event(reply({"answer": "".join(chunks), "context_path": graph_paths}), event="done")
+        except (BrokenPipeError, ConnectionResetError):
+            print("LLM stream: client disconnected")
+        except Exception as e:
+            print(f"LLM stream error: {e}")
+            try:
+                self._sse_event(reply({"answer": "".join(chunks), "error": str(e), "context_path": graph_paths}), event="done")
+            except Exception:
+                pass
+        finally:
+            # 流结束（含中断）后记录已生成的完整回答
+            answer="".join(chunks)
+            if session_id and answer:
+                with tracing.span("log_dialogue.assistant"):
+                    _log_dialogue(session_id, "assistant", answer, context=graph_context_text if graph_paths else None)
+
+# Concurrent Serving
+# 慢路由（LLM 上游/文档索引）与快路由（图查询）各自限流，互不阻塞
+_LLM_ROUTES=("/llm", "/upload_doc", "/upload_file")
+_EVENT_ROUTES=("/task_events",)  # 长连接，单独限流，满了立即返回 503，前端退回轮询
+_GRAPH_ROUTES=("/question", "/submit_answer", "/zpd_update", "/recommend")  # 前缀匹配，/submit_answers 也在内
+_route_limits={}
+
+def _init_route_limits():
+    _route_limits["llm"]=threading.BoundedSemaphore(int(os.environ.get("LLM_CONCURRENCY","8")))
+    _route_limits["graph"]=threading.BoundedSemaphore(int(os.environ.get("GRAPH_CONCURRENCY","32")))
+    _route_limits["events"]=threading.BoundedSemaphore(int(os.environ.get("TASK_EVENTS_CONCURRENCY","16")))
+
+def _route_class(path):
+    route=urlparse(path).path
+    if route in _LLM_ROUTES:
+        return "llm"
+    if route.startswith(_GRAPH_ROUTES):
+        return "graph"
+    if route in _EVENT_ROUTES:
+        return "events"
+    return None
+
+class _RouteSlot:
+    def __init__(self, path):
+        self.path=path
+        self.sem=_route_limits.get(_route_class(path))
+        self.acquired=False
+
+    def __enter__(self):
+        if self.sem is None:
+            return True
+        t0=time.perf_counter()
+        if _route_class(self.path)=="events":
+            self.acquired=self.sem.acquire(blocking=False)
+        else:
+            self.acquired=self.sem.acquire(timeout=float(os.environ.get("ROUTE_QUEUE_TIMEOUT","30")))
+        _route_wait.observe(time.perf_counter()-t0, _route_class(self.path))
+        if not self.acquired:
+            metrics.degraded("route_busy")
+        return self.acquired
+
+    def __exit__(self, *exc):
+        if self.acquired:
+            self.sem.release()
+        return False
+
+# Metrics
+_METRIC_ROUTES=("/llm", "/question", "/questions", "/question_stats", "/submit_answer", "/submit_answers", "/zpd_update",
+                "/recommend", "/upload_doc", "/upload_file", "/task_status", "/task_events", "/tasks", "/cancel_task", "/resume_task", "/health", "/metrics")
+_request_seconds=metrics.histogram("http_request_duration_seconds", "Request latency including route queueing", ("route", "method", "status"))
+_request_dependency_seconds=metrics.histogram("http_request_dependency_seconds", "Time a request spent waiting on each dependency", ("route", "dependency"))
+_route_wait=metrics.histogram("route_queue_wait_seconds", "Time spent waiting for an LLM/graph route slot", ("route_class",))
+
+class _RequestScope:
+    """Metrics and trace of one request."""
+    # 路由标签只取已知路径，避免查询参数或扫描请求产生无限多的时间序列
+    def __init__(self, handler):
+        self.handler=handler
+
+    def __enter__(self):
+        h=self.handler
+        h._status=None
+        url=urlparse(h.path)
+        self.route=url.path if url.path in _METRIC_ROUTES else "other"
+        profile=(parse_qs(url.query).get("profile") or [""])[0].lower() in ("1","true","yes")
+        tracing.start(tracing.new_request_id(h.headers.get("X-Request-ID")), h.command, self.route, profile)
+        metrics.begin_request()
+        self.t0=time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed=time.perf_counter()-self.t0
+        deps=metrics.end_request()
+        status=self.handler._status or (500 if exc_type else 0)
+        _request_seconds.observe(elapsed, self.route, self.handler.command, str(status))
+        for dep, seconds in deps.items():
+            _request_dependency_seconds.observe(seconds, self.route, dep)
+        tracing.finish(status)
+        return False
+
+def _family(name, kind, help, stats, keys, label=None):
+    samples=[]
+    for key in keys:
+        value=(stats or {}).get(key)
+        if isinstance(value, (int, float)):
+            samples.append(({label: key} if label else {}, value))
+    return (name, kind, help, samples)
+
+def _collect():
+    # 已在各组件中统计的计数在抓取时读取，不在请求路径上重复计数
+    out=[]
+    llm=llm_client.get_client().stats()
+    out.append(_family("llm_upstream_events_total", "counter", "LLM upstream requests, retries and failures", llm, ("requests", "retries", "failures"), "event"))
+    log=_mysql_logger.stats()
+    out.append(_family("mysql_log_rows_total", "counter", "Write-behind log rows by outcome", log, ("flushed", "failed", "dropped"), "outcome"))
+    out.append(_family("mysql_log_queued", "gauge", "Log rows waiting to be flushed", log, ("queued",)))
+    pools=_neo4j_pool_stats()
+    for name, kind, key, help in (("neo4j_sessions_active", "gauge", "active", "Neo4j sessions currently open"),
+                                  ("neo4j_sessions_total", "counter", "sessions", "Neo4j sessions opened"),
+                                  ("neo4j_session_errors_total", "counter", "errors", "Neo4j sessions that raised")):
+        out.append((name, kind, help, [({"database": str(p["database"] or "")}, p[key]) for p in pools]))
+    cache=answer_cache.get_cache()
+    if cache:
+        out.append(_family("llm_cache_events_total", "counter", "Answer cache lookups by outcome", cache.stats(), ("hits_exact", "hits_semantic", "misses"), "event"))
+    out.append(_family("concept_index_events_total", "counter", "Concept index lookups and builds", _competency_index.stats(), ("lookups", "builds", "build_errors"), "event"))
+    out.append(_family("question_stats_cache_events_total", "counter", "/question_stats cache events", _stats_cache.stats(), ("hits", "misses", "invalidations"), "event"))
+    out.append(_family("zpd_coalescer_events_total", "counter", "Deferred ZPD propagation events", _zpd_coalescer.stats(), ("requests", "flushes", "errors"), "event"))
+    out.append(_family("mastery_learners", "gauge", "Learners held in the mastery store", _mastery.stats(), ("learners",)))
+    if lightrag_wrapper:
+        idx=lightrag_wrapper.indexing_stats()
+        out.append(_family("indexing_queue", "gauge", "Indexing jobs by queue state", idx, ("queued", "deferred", "running"), "state"))
+        out.append(("indexing_tasks", "gauge", "Indexing tasks held in memory by status",
+                    [({"status": k}, v) for k, v in sorted(idx.get("by_status", {}).items())]))
+        out.append(_family("indexing_task_evictions_total", "counter", "Finished tasks dropped from memory (still in jobs.db)", idx.get("tasks"), ("evictions",)))
+        out.append(_family("embedding_events_total", "counter", "Embedding batcher requests, cache hits and embedded texts", idx.get("embedding"),
+                           ("requests", "texts", "cache_hits", "embedded", "batches", "errors"), "event"))
+    return out
+
+metrics.add_collector(_collect)
+
+# Health
+def _llm_cache_stats():
+    cache=answer_cache.get_cache()
+    return cache.stats() if cache else None
+
+# /health 返回的各子系统状态：(字段名, 读取函数)，同 metrics collector 在请求时读取
+_HEALTH_STATS=(
+    ("neo4j_pools", lambda: _neo4j_pool_stats()),
+    ("mysql_log", lambda: _mysql_logger.stats()),
+    ("llm_upstream", lambda: llm_client.get_client().stats()),
+    ("llm_cache", _llm_cache_stats),
+    ("concept_index", lambda: _competency_index.stats()),
+    ("question_stats_cache", lambda: _stats_cache.stats()),
+    ("zpd_coalescer", lambda: _zpd_coalescer.stats()),
+    ("mastery", lambda: _mastery.stats()),
+    ("prereq_dag", lambda: {db: e.stats() for db, e in list(_prereq_engines.items())}),
+    ("lightrag", lambda: lightrag_wrapper.rag_stats() if lightrag_wrapper else None),
+    ("retrieval_cache", lambda: _retriever.cache.stats() if _retriever else None),
+)
+
+_BUSY_RESPONSE=(b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\nContent-Length: 24\r\n"
+                b"Retry-After: 1\r\nConnection: close\r\n\r\n{\"error\": \"server busy\"}")
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that hands each connection to a bounded thread pool.
+
+    At most max_workers+max_pending connections are held (running or waiting
+    for a worker); beyond that a connection gets an immediate 503 instead of
+    piling up in the executor's unbounded queue.
+    """
+    request_queue_size=128
+
+    def __init__(self, server_address, handler_class, max_workers=64, max_pending=None):
+        super().__init__(server_address, handler_class)
+        self._pool=ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http")
+        self._slots=threading.BoundedSemaphore(max_workers+(max_workers if max_pending is None else max_pending))
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            metrics.degraded("http_overload")
+            self._reject(request)
+            return
+        try:
+            self._pool.submit(self._process_request_worker, request, client_address)
+        except RuntimeError:
+            # 线程池已关闭
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _reject(self, request):
+        # 在接受线程上直接回 503，不读请求、不占工作线程
+        try:
+            request.settimeout(1.0)
+            request.sendall(_BUSY_RESPONSE)
+            # 读掉已到达的请求数据，避免关闭时发 RST 导致客户端收不到响应
+            request.setblocking(False)
+            while request.recv(65536):
+                pass
+        except OSError:
+            pass
+        finally:
+            self.shutdown_request(request)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+def make_server(host="127.0.0.1", port=8001):
+    _init_route_limits()
+    mode=os.environ.get("LLM_SERVER_MODE","threaded").strip().lower()
+    if mode=="single":
+        Handler.protocol_version="HTTP/1.0"
+        return HTTPServer((host, port), Handler)
+    # keep-alive：空闲连接超时后释放工作线程；关闭 Nagle，避免响应头与响应体分两次发送时的延迟确认等待
+    Handler.protocol_version="HTTP/1.1"
+    Handler.disable_nagle_algorithm=True
+    Handler.timeout=float(os.environ.get("KEEPALIVE_TIMEOUT","15"))
+    workers=int(os.environ.get("HTTP_WORKERS","64"))
+    return PooledHTTPServer((host, port), Handler, max_workers=workers, max_pending=int(os.environ.get("HTTP_MAX_PENDING", str(workers))))
 
 def main():
     _load_env()
     port=int(os.environ.get("LLM_PORT","8001"))
-    srv=HTTPServer(("127.0.0.1", port), Handler)
+    srv=make_server("127.0.0.1", port)
+    # 建索引不阻塞启动，Neo4j 不可用时只打印错误
+    threading.Thread(target=_ensure_indexes, name="neo4j-indexes", daemon=True).start()
+    if lightrag_wrapper:
+        # 启动索引工作池，并恢复上次退出时未完成的任务
+        lightrag_wrapper.start_workers()
+        # 后台预建常用库的 LightRAG 实例，首个上传不再等待初始化
+        warm=[d.strip() for d in os.environ.get("LIGHTRAG_WARMUP","").split(",") if d.strip()]
+        if warm:
+            lightrag_wrapper.warm_up(warm)
     try:
         srv.serve_forever()
     except KeyboardInterrupt:
         pass
+    finally:
+        srv.server_close()
+        _zpd_coalescer.flush()
+        _mysql_logger.close()
+        _close_neo4j_drivers()
 
 if __name__=="__main__":
     main()
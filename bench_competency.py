@@ -0,0 +1,144 @@
+"""
+Benchmark for graph-guided retrieval (_search_competency_path).
+
+Compares the old approach (scan every candidate name with CONTAINS, then
+expand INCLUDES/HAS_DIMENSION/DEVELOPED_BY paths up to 4 hops per question)
+with concept_index (Aho–Corasick match + precomputed path table) on
+synthetic graphs the size of data.cypher and 100x larger.
+
+    python bench_competency.py --queries 2000
+    python bench_competency.py --live     # also time both paths against the configured Neo4j
+"""
+import time
+import random
+import argparse
+
+from concept_index import GraphSnapshot
+
+_CHARS="信息数据算法编码网络安全隐私计算思维模型程序设计智能学习创新社会责任感知评估应用系统结构过程控制问题解决方案"
+
+def _name(rng, used):
+    while True:
+        s="".join(rng.choice(_CHARS) for _ in range(rng.randint(3, 6)))
+        if s not in used:
+            used.add(s)
+            return s
+
+def synthetic_graph(scale, seed=7):
+    """Roots → core literacies → sub-dimensions → content modules, ~50 nodes per unit of scale."""
+    rng=random.Random(seed)
+    used=set()
+    names={}
+    edges=[]
+    nid=0
+    def new():
+        nonlocal nid
+        nid+=1
+        names[nid]=_name(rng, used)
+        return nid
+    roots=[]
+    candidates=[]
+    for _ in range(scale):
+        top=new()
+        roots.append(top)
+        candidates.append(top)
+        for _ in range(4):
+            core=new()
+            roots.append(core)
+            candidates.append(core)
+            edges.append((top, core))
+            for _ in range(3):
+                sub=new()
+                candidates.append(sub)
+                edges.append((core, sub))
+                for _ in range(3):
+                    mod=new()
+                    candidates.append(mod)
+                    edges.append((sub, mod))
+    # 少量跨分支关系，制造多条路径
+    ids=list(names)
+    for _ in range(len(ids)//10):
+        a, b=rng.sample(ids, 2)
+        if a<b:
+            edges.append((a, b))
+    return names, candidates, edges, roots
+
+def questions(names, n, seed=11):
+    rng=random.Random(seed)
+    pool=list(names.values())
+    out=[]
+    for _ in range(n):
+        picked=rng.sample(pool, rng.randint(0, 2))
+        out.append("请问"+"和".join(picked)+"之间有什么关系，如何在课堂中培养？")
+    return out
+
+class FullScan:
+    """The pre-index behaviour: CONTAINS over every candidate, then bounded path expansion."""
+    def __init__(self, names, candidates, edges, roots):
+        self.names=names
+        self.candidates=[(c, names[c]) for c in candidates if len(names.get(c) or "")>1]
+        self.rev={}
+        for a, b in edges:
+            self.rev.setdefault(b, []).append(a)
+        self.roots=set(roots)
+
+    def lookup(self, question, limit=3):
+        matched=[nid for nid, name in self.candidates if name in question][:limit]
+        found=[]
+        for nid in matched:
+            stack=[(nid,)]
+            while stack:
+                path=stack.pop()
+                if len(path)>1 and path[-1] in self.roots:
+                    found.append(tuple(reversed(path)))
+                if len(path)>4:
+                    continue
+                for pre in self.rev.get(path[-1], ()):
+                    if pre not in path:
+                        stack.append(path+(pre,))
+        found.sort(key=len)
+        return list({" -> ".join(self.names[n] for n in p) for p in found[:limit]})
+
+def _time(fn, qs):
+    t0=time.perf_counter()
+    for q in qs:
+        fn(q)
+    return (time.perf_counter()-t0)/len(qs)*1e6
+
+def run_synthetic(args):
+    print(f"{'graph':>10} {'nodes':>7} {'edges':>7} {'build_ms':>9} {'scan_us':>9} {'index_us':>9} {'speedup':>8}")
+    for label, scale in (("data.cypher", 1), ("100x", 100)):
+        names, candidates, edges, roots=synthetic_graph(scale)
+        qs=questions(names, args.queries)
+        t0=time.perf_counter()
+        snap=GraphSnapshot(names, candidates, edges, roots)
+        build_ms=(time.perf_counter()-t0)*1000
+        scan=FullScan(names, candidates, edges, roots)
+        scan_us=_time(scan.lookup, qs)
+        index_us=_time(snap.lookup, qs)
+        print(f"{label:>10} {len(names):>7} {len(edges):>7} {build_ms:>9.1f} {scan_us:>9.1f} {index_us:>9.1f} {scan_us/index_us:>7.1f}x")
+
+def run_live(args):
+    import api_llm
+    api_llm._load_env()
+    names, candidates, edges, roots=api_llm._load_competency_graph()
+    if not names:
+        print("live: no candidate nodes found")
+        return
+    qs=questions({c: names[c] for c in candidates}, min(args.queries, 200))
+    api_llm._competency_index.get()
+    cypher_us=_time(api_llm._search_competency_path_cypher, qs)
+    index_us=_time(api_llm._search_competency_path, qs)
+    print(f"live Neo4j ({len(candidates)} candidates): cypher {cypher_us/1000:.2f} ms/query, index {index_us/1000:.3f} ms/query")
+
+def main():
+    ap=argparse.ArgumentParser(description="Benchmark competency-path lookup")
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--live", action="store_true", help="also benchmark against the configured Neo4j")
+    args=ap.parse_args()
+    run_synthetic(args)
+    if args.live:
+        run_live(args)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+In-process concept dictionary for graph-guided retrieval.
+
+An Aho–Corasick automaton over every candidate node name finds the concepts
+mentioned in a question in one linear pass, and the root→concept paths over
+INCLUDES/HAS_DIMENSION/DEVELOPED_BY edges are precomputed once per graph
+snapshot. Snapshots are rebuilt in the background after a TTL or on explicit
+invalidation, so a chat turn normally makes no Neo4j round trip. The server
+itself only changes the graph by indexing documents into it, so api_llm
+invalidates the index when an indexing job for its database completes; edits
+made directly in Neo4j are picked up by the TTL (CONCEPT_INDEX_TTL).
+"""
+import os
+import time
+import threading
+from collections import deque
+
+class AhoCorasick:
+    def __init__(self, words):
+        self.goto=[{}]
+        self.fail=[0]
+        self.out=[()]
+        for w in words:
+            self._add(w)
+        self._build()
+
+    def _add(self, word):
+        state=0
+        for ch in word:
+            nxt=self.goto[state].get(ch)
+            if nxt is None:
+                nxt=len(self.goto)
+                self.goto[state][ch]=nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+            state=nxt
+        if word not in self.out[state]:
+            self.out[state]=self.out[state]+(word,)
+
+    def _build(self):
+        q=deque(self.goto[0].values())
+        while q:
+            state=q.popleft()
+            for ch, nxt in self.goto[state].items():
+                q.append(nxt)
+                f=self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f=self.fail[f]
+                self.fail[nxt]=self.goto[f].get(ch, 0) if state else 0
+                self.out[nxt]=self.out[nxt]+self.out[self.fail[nxt]]
+
+    def find(self, text):
+        """Yield (start, word) for every occurrence, overlaps included."""
+        state=0
+        for i, ch in enumerate(text):
+            while state and ch not in self.goto[state]:
+                state=self.fail[state]
+            state=self.goto[state].get(ch, 0)
+            for w in self.out[state]:
+                yield i-len(w)+1, w
+
+class GraphSnapshot:
+    """Immutable dictionary + path table built from one load of the graph."""
+    def __init__(self, names, candidates, edges, roots, max_depth=4, k=3):
+        self.names=names
+        self.by_name={}
+        for nid in candidates:
+            name=names.get(nid)
+            if name and len(name)>1:
+                self.by_name.setdefault(name, []).append(nid)
+        self.automaton=AhoCorasick(self.by_name.keys())
+        self.paths=self._paths(edges, roots, max_depth, k)
+        self.built_at=time.time()
+
+    @staticmethod
+    def _paths(edges, roots, max_depth, k):
+        # 按路径长度逐层扩展，每个节点最多保留 k 条最短路径
+        adj={}
+        for src, dst in edges:
+            adj.setdefault(src, []).append(dst)
+        paths={}
+        frontier=[(r,) for r in roots]
+        for _ in range(max_depth):
+            nxt=[]
+            for path in frontier:
+                for dst in adj.get(path[-1], ()):
+                    if dst in path:
+                        continue
+                    kept=paths.setdefault(dst, [])
+                    if len(kept)>=k:
+                        continue
+                    p=path+(dst,)
+                    kept.append(p)
+                    nxt.append(p)
+            frontier=nxt
+        return paths
+
+    def match(self, question, limit=3):
+        # 优先更长（更具体）的概念名，其次按出现位置
+        hits={}
+        for start, word in self.automaton.find(question):
+            if word not in hits:
+                hits[word]=start
+        ordered=sorted(hits, key=lambda w: (-len(w), hits[w]))
+        out=[]
+        for word in ordered:
+            for nid in self.by_name[word]:
+                if len(out)>=limit:
+                    return out
+                out.append(nid)
+        return out
+
+    def lookup(self, question, limit=3):
+        found=[]
+        for nid in self.match(question, limit):
+            found.extend(self.paths.get(nid, ()))
+        found.sort(key=len)
+        out=[]
+        for p in found[:limit]:
+            s=" -> ".join(self.names.get(n, "") for n in p)
+            if s not in out:
+                out.append(s)
+        return out
+
+class CompetencyIndex:
+    """Holds the current GraphSnapshot and refreshes it off the request path."""
+    def __init__(self, loader, ttl=None):
+        self.loader=loader
+        self.ttl=float(os.environ.get("CONCEPT_INDEX_TTL","60")) if ttl is None else ttl
+        self.snapshot=None
+        self.lock=threading.Lock()
+        self.build_lock=threading.Lock()
+        self.refreshing=False
+        self.stale=False
+        self.counters={"lookups":0, "builds":0, "build_errors":0}
+        self.last_build_ms=0.0
+        self.failed_at=0.0
+
+    def _build(self):
+        t0=time.perf_counter()
+        try:
+            names, candidates, edges, roots=self.loader()
+            snap=GraphSnapshot(names, candidates, edges, roots)
+        except Exception as e:
+            with self.lock:
+                self.counters["build_errors"]+=1
+                self.refreshing=False
+                self.failed_at=time.time()
+            print(f"Concept index build error: {e}")
+            return None
+        with self.lock:
+            self.snapshot=snap
+            self.stale=False
+            self.refreshing=False
+            self.counters["builds"]+=1
+            self.last_build_ms=round((time.perf_counter()-t0)*1000, 1)
+        return snap
+
+    def _refresh_async(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing=True
+        threading.Thread(target=self._build, name="concept-index", daemon=True).start()
+
+    def get(self):
+        """Current snapshot; builds synchronously only on first use."""
+        snap=self.snapshot
+        if snap is None:
+            # 首次构建失败后短时间内不再同步重试，由调用方走回退路径
+            if time.time()-self.failed_at<30:
+                return None
+            with self.build_lock:
+                if self.snapshot is None:
+                    self._build()
+            return self.snapshot
+        if self.stale or time.time()-snap.built_at>self.ttl:
+            self._refresh_async()
+        return snap
+
+    def lookup(self, question, limit=3):
+        snap=self.get()
+        if snap is None:
+            return None
+        with self.lock:
+            self.counters["lookups"]+=1
+        return snap.lookup(question, limit)
+
+    def invalidate(self):
+        """Mark the snapshot stale; the next lookup triggers a background rebuild."""
+        with self.lock:
+            self.stale=True
+
+    def stats(self):
+        snap=self.snapshot
+        with self.lock:
+            out=dict(self.counters)
+        out["last_build_ms"]=self.last_build_ms
+        out["concepts"]=len(snap.by_name) if snap else 0
+        out["age"]=round(time.time()-snap.built_at, 1) if snap else None
+        return out
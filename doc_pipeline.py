@@ -0,0 +1,168 @@
+"""
+Document extraction stage for LightRAG indexing.
+
+Uploads are decoded from base64 to a file in fixed-size blocks, then text is
+pulled out page by page (PDF) or paragraph by paragraph (DOCX) and cut into
+chunks incrementally, so neither the decoded document nor its base64 copy is
+held in memory as a whole. The decode/extract functions are plain
+module-level functions so they can run in a ProcessPoolExecutor; this module
+deliberately imports nothing heavy. pypdf and python-docx (which pulls in
+lxml) are imported by the functions that need them, in the parse processes.
+"""
+import os
+import re
+import base64
+import binascii
+import hashlib
+
+B64_BLOCK = 4 * 64 * 1024   # base64 characters decoded per step (multiple of 4)
+TEXT_BLOCK = 64 * 1024      # characters read per step from plain-text files
+_B64_STRIP = re.compile(r"[^A-Za-z0-9+/=]")
+_INLINE_WS = re.compile(r"[ \t\r\f\v\u3000]+")
+_BLANK_LINES = re.compile(r" ?\n(?: ?\n)+ ?")
+
+def _base64_blocks(read):
+    """Decoded bytes of a (data-URL or bare) base64 stream, block by block; read(n) returns str."""
+    head = read(256)
+    # data:application/pdf;base64,....
+    if head.startswith("data:") and "," in head:
+        head = head.split(",", 1)[1]
+    pending = _B64_STRIP.sub("", head)
+    while True:
+        block = read(B64_BLOCK)
+        pending += _B64_STRIP.sub("", block)
+        cut = len(pending) if not block else len(pending) - len(pending) % 4
+        if cut:
+            try:
+                data = base64.b64decode(pending[:cut])
+            except binascii.Error:
+                # tolerate missing trailing padding
+                data = base64.b64decode(pending[:cut] + "=" * (-cut % 4))
+            yield data
+            pending = pending[cut:]
+        if not block:
+            break
+
+def decode_base64_file(src, dst):
+    """Decode a (data-URL or bare) base64 file into dst; returns the decoded size."""
+    size = 0
+    with open(src, "r", encoding="utf-8", errors="ignore") as fin, open(dst, "wb") as fout:
+        for data in _base64_blocks(fin.read):
+            fout.write(data)
+            size += len(data)
+    return size
+
+def base64_sha256(content):
+    """(sha256 hex, size) of the bytes a base64 string decodes to, the same digest /upload_file takes of the raw file."""
+    sha = hashlib.sha256()
+    size = 0
+    pos = 0
+    def read(n):
+        nonlocal pos
+        part = content[pos:pos + n]
+        pos += len(part)
+        return part
+    for data in _base64_blocks(read):
+        sha.update(data)
+        size += len(data)
+    return sha.hexdigest(), size
+
+def detect_kind(path, filename=""):
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".pdf":
+        return "pdf"
+    if ext == ".docx":
+        return "docx"
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if magic.startswith(b"%PDF"):
+        return "pdf"
+    if magic.startswith(b"PK") and ext not in (".txt", ".md", ".csv"):
+        return "docx"
+    return "text"
+
+def _pdf_reader(path):
+    try:
+        import pypdf
+    except ImportError:
+        raise RuntimeError("pypdf is not installed") from None
+    return pypdf.PdfReader(path)
+
+def pdf_page_count(path):
+    return len(_pdf_reader(path).pages)
+
+def pdf_pages(path, start, end):
+    """Text of pages [start, end); run in the process pool one batch at a time."""
+    reader = _pdf_reader(path)
+    out = []
+    for i in range(start, min(end, len(reader.pages))):
+        try:
+            out.append(reader.pages[i].extract_text() or "")
+        except Exception as e:
+            out.append("")
+            print(f"PDF page {i + 1} extraction failed: {e}")
+    return out
+
+def docx_paragraphs(path):
+    try:
+        import docx
+    except ImportError:
+        raise RuntimeError("python-docx is not installed") from None
+    doc = docx.Document(path)
+    paras = [p.text for p in doc.paragraphs if p.text.strip()]
+    # Table cells are not part of doc.paragraphs
+    for table in doc.tables:
+        for row in table.rows:
+            cells = [c.text.strip() for c in row.cells if c.text.strip()]
+            if cells:
+                paras.append(" | ".join(cells))
+    return paras
+
+def iter_text_file(path):
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        while True:
+            block = f.read(TEXT_BLOCK)
+            if not block:
+                return
+            yield block
+
+def clean_text(text):
+    """Collapse runs of spaces and blank lines so re-exports chunk identically."""
+    text = _INLINE_WS.sub(" ", text)
+    return _BLANK_LINES.sub("\n\n", text).replace(" \n", "\n").replace("\n ", "\n")
+
+class Chunker:
+    """Incremental chunker: feed text as it is extracted, get finished chunks back.
+
+    Chunks are cut at paragraph or sentence boundaries when one falls in the
+    second half of the window, and consecutive chunks overlap by `overlap`
+    characters.
+    """
+    _BREAKS = ("\n\n", "\n", "。", "！", "？", ". ", "! ", "? ")
+
+    def __init__(self, size=2000, overlap=100):
+        self.size = size
+        self.overlap = min(overlap, size // 2)
+        self.buf = ""
+
+    def feed(self, text):
+        self.buf += text
+        out = []
+        while len(self.buf) >= self.size:
+            window = self.buf[:self.size]
+            cut = self.size
+            for sep in self._BREAKS:
+                pos = window.rfind(sep, self.size // 2)
+                if pos != -1:
+                    cut = pos + len(sep)
+                    break
+            chunk = self.buf[:cut].strip()
+            if chunk:
+                out.append(chunk)
+            self.buf = self.buf[max(cut - self.overlap, 1):]
+        return out
+
+    def flush(self):
+        chunk = self.buf.strip()
+        self.buf = ""
+        return [chunk] if chunk else []
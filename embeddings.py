@@ -0,0 +1,266 @@
+"""
+Embedding backends for LightRAG indexing and retrieval.
+
+EMBED_BACKEND selects the vectors behind LightRAG's vector stores:
+
+    remote  OpenAI-compatible /embeddings on MS_BASE_URL (EMBED_MODEL)
+    local   sentence-transformers on CPU (EMBED_LOCAL_MODEL; EMBED_ST_BACKEND=onnx
+            uses its ONNX runtime path when installed)
+    hash    hashed character n-gram embedder; deterministic and offline, for
+            tests and air-gapped installs
+    auto    local when sentence-transformers is importable, else remote when
+            MS_API_KEY is set, else hash
+
+A backend that fails raises, so the indexing job fails visibly and can be
+retried. It never falls back to random vectors. Vectors from different
+backends or dimensions cannot share a LightRAG working directory.
+
+Requests from every indexing job and query go through one Batcher thread,
+which coalesces them into backend calls of up to EMBED_BATCH_SIZE texts. It
+first looks each text up in a persistent SQLite cache keyed by
+sha256(backend id, text), so re-indexing an unchanged chunk never embeds it
+again.
+"""
+import os
+import time
+import queue
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import concurrent.futures
+
+import numpy as np
+
+import llm_client
+import metrics
+
+_STOP = object()
+
+def _text_key(model_id, text):
+    return hashlib.sha256((model_id + "\x1f" + text).encode("utf-8")).hexdigest()
+
+class HashBackend:
+    """Signed feature hashing of character 1-3 grams, L2-normalised."""
+    def __init__(self, dim=None):
+        self.dim = int(dim or os.environ.get("EMBED_DIM", "1024"))
+        self.model_id = f"hash-{self.dim}"
+
+    def _vector(self, text):
+        vec = np.zeros(self.dim, dtype=np.float32)
+        text = " ".join(str(text).lower().split())
+        for n in (1, 2, 3):
+            for i in range(max(0, len(text) - n + 1)):
+                h = int.from_bytes(hashlib.blake2b(text[i:i + n].encode("utf-8"), digest_size=8).digest(), "little")
+                vec[h % self.dim] += 1.0 if (h >> 63) else -1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def embed(self, texts):
+        return np.stack([self._vector(t) for t in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+
+class LocalBackend:
+    """sentence-transformers model on CPU; imported lazily because it pulls in torch."""
+    def __init__(self, model=None):
+        from sentence_transformers import SentenceTransformer
+        name = model or os.environ.get("EMBED_LOCAL_MODEL", "BAAI/bge-small-zh-v1.5")
+        kwargs = {"device": os.environ.get("EMBED_DEVICE", "cpu")}
+        if os.environ.get("EMBED_ST_BACKEND"):
+            kwargs["backend"] = os.environ["EMBED_ST_BACKEND"]
+        self.model = SentenceTransformer(name, **kwargs)
+        self.dim = int(self.model.get_sentence_embedding_dimension())
+        self.model_id = f"local-{name}"
+
+    def embed(self, texts):
+        return np.asarray(self.model.encode(list(texts), batch_size=len(texts) or 1, normalize_embeddings=True,
+                                            convert_to_numpy=True, show_progress_bar=False), dtype=np.float32)
+
+class RemoteBackend:
+    """OpenAI-compatible /embeddings over the shared keep-alive client."""
+    def __init__(self, base_url=None, api_key=None, model=None, dim=None):
+        self.base_url = (base_url or os.environ.get("MS_BASE_URL", "https://api-inference.modelscope.cn/v1")).rstrip("/")
+        self.api_key = api_key if api_key is not None else os.environ.get("MS_API_KEY", "")
+        self.model = model or os.environ.get("EMBED_MODEL", "text-embedding-v1")
+        self.dim = int(dim or os.environ.get("EMBED_DIM", "1536"))
+        self.model_id = f"remote-{self.model}"
+
+    def embed(self, texts):
+        vectors = np.asarray(llm_client.get_client().embed(texts, self.model, self.base_url, self.api_key), dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim:
+            raise ValueError(f"embedding dimension {vectors.shape[-1]} does not match EMBED_DIM={self.dim}")
+        return vectors
+
+def make_backend(name=None):
+    name = (name or os.environ.get("EMBED_BACKEND", "auto")).strip().lower()
+    if name == "auto":
+        try:
+            import sentence_transformers  # noqa: F401
+            name = "local"
+        except ImportError:
+            name = "remote" if os.environ.get("MS_API_KEY") else "hash"
+    if name == "local":
+        return LocalBackend()
+    if name == "remote":
+        return RemoteBackend()
+    if name == "hash":
+        return HashBackend()
+    raise ValueError(f"unknown EMBED_BACKEND {name!r}")
+
+class EmbeddingCache:
+    """text hash -> float32 vector in SQLite; only touched from the batcher thread."""
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dim INTEGER, vec BLOB, created REAL)")
+        self.db.commit()
+
+    def get_many(self, keys, dim):
+        out = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            rows = self.db.execute(
+                f"SELECT key, dim, vec FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part).fetchall()
+            for key, d, blob in rows:
+                if d == dim:
+                    out[key] = np.frombuffer(blob, dtype=np.float32)
+        return out
+
+    def put_many(self, items, dim):
+        now = time.time()
+        self.db.executemany("INSERT OR REPLACE INTO embeddings (key, dim, vec, created) VALUES (?, ?, ?, ?)",
+                            [(k, dim, np.asarray(v, dtype=np.float32).tobytes(), now) for k, v in items])
+        self.db.commit()
+
+    def count(self):
+        return self.db.execute("SELECT count(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+class Batcher:
+    """Coalesces embed() calls from all indexing jobs into cached, batched backend calls."""
+    def __init__(self, backend, cache_path=None, batch_size=None, wait_ms=None):
+        self.backend = backend
+        self.dim = backend.dim
+        self.cache_path = cache_path
+        self.batch_size = int(batch_size or os.environ.get("EMBED_BATCH_SIZE", "64"))
+        self.wait = float(wait_ms if wait_ms is not None else os.environ.get("EMBED_BATCH_WAIT_MS", "20")) / 1000.0
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.cache = None
+        self.counters = {"requests": 0, "texts": 0, "cache_hits": 0, "embedded": 0, "batches": 0, "errors": 0}
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self.thread.start()
+
+    def submit(self, texts):
+        """Queue texts; returns a concurrent.futures.Future of an (n, dim) float32 array."""
+        self._start()
+        fut = concurrent.futures.Future()
+        self.queue.put((list(texts), fut))
+        return fut
+
+    async def embed(self, texts):
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _run(self):
+        if self.cache_path:
+            try:
+                self.cache = EmbeddingCache(self.cache_path)
+            except sqlite3.Error as e:
+                print(f"Embedding cache unavailable: {e}")
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            size = len(item[0])
+            deadline = time.monotonic() + self.wait
+            # 在短窗口内合并其他任务的请求，直到凑满一批
+            while size < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    nxt = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    self.queue.put(_STOP)
+                    break
+                batch.append(nxt)
+                size += len(nxt[0])
+            self._process(batch)
+        if self.cache is not None:
+            self.cache.close()
+
+    def _process(self, batch):
+        model_id = self.backend.model_id
+        keys = {}
+        for texts, _ in batch:
+            for t in texts:
+                keys.setdefault(t, _text_key(model_id, t))
+        found = {}
+        if self.cache is not None:
+            try:
+                found = self.cache.get_many(set(keys.values()), self.dim)
+            except sqlite3.Error as e:
+                print(f"Embedding cache read error: {e}")
+        missing = [t for t, k in keys.items() if k not in found]
+        try:
+            for i in range(0, len(missing), self.batch_size):
+                part = missing[i:i + self.batch_size]
+                with metrics.timed("embedding"):
+                    vectors = self.backend.embed(part)
+                for t, v in zip(part, vectors):
+                    found[keys[t]] = np.asarray(v, dtype=np.float32)
+                if self.cache is not None:
+                    try:
+                        self.cache.put_many([(keys[t], found[keys[t]]) for t in part], self.dim)
+                    except sqlite3.Error as e:
+                        print(f"Embedding cache write error: {e}")
+                self._count("batches")
+        except Exception as e:
+            self._count("errors")
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        with self.lock:
+            self.counters["requests"] += len(batch)
+            self.counters["texts"] += sum(len(texts) for texts, _ in batch)
+            self.counters["cache_hits"] += len(keys) - len(missing)
+            self.counters["embedded"] += len(missing)
+        for texts, fut in batch:
+            if fut.done():
+                continue
+            if texts:
+                fut.set_result(np.stack([found[keys[t]] for t in texts]))
+            else:
+                fut.set_result(np.zeros((0, self.dim), dtype=np.float32))
+
+    def _count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def stats(self):
+        with self.lock:
+            out = dict(self.counters)
+        out["backend"] = self.backend.model_id
+        out["dim"] = self.dim
+        out["pending"] = self.queue.qsize()
+        return out
+
+    def close(self, timeout=5.0):
+        with self.lock:
+            thread = self.thread
+        if thread is None:
+            return
+        self.queue.put(_STOP)
+        thread.join(timeout)
@@ -0,0 +1,118 @@
+"""
+Local fake OpenAI-compatible LLM server.
+
+Answers POST /v1/chat/completions with a canned reply, either as one JSON
+completion or, when the request body has "stream": true, as server-sent
+events with one token per chunk. POST /v1/embeddings returns deterministic
+hash-derived vectors (EMBED_BACKEND=remote against this server). Used by loadtest.py and for exercising
+/llm?stream=1 without a ModelScope key:
+
+    python fake_llm_server.py --port 9001 --token-delay 0.05
+    MS_BASE_URL=http://127.0.0.1:9001/v1 MS_API_KEY=fake python api_llm.py
+"""
+import json
+import time
+import hashlib
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_REPLY="这是一个用于测试的回答。算法是解决问题的一系列明确步骤。"
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version="HTTP/1.1"
+    reply=DEFAULT_REPLY
+    delay=0.0          # latency before the first byte
+    token_delay=0.0    # latency between streamed chunks
+    embed_dim=1536
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length=int(self.headers.get("Content-Length") or 0)
+        try:
+            payload=json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+        except Exception:
+            payload={}
+        if self.path.rstrip("/").endswith("/embeddings"):
+            self._embeddings(payload)
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._json(404, {"error":{"message":"not found"}})
+            return
+        if self.delay:
+            time.sleep(self.delay)
+        model=payload.get("model") or "fake"
+        if payload.get("stream"):
+            self._stream(model)
+        else:
+            self._json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index":0, "message":{"role":"assistant","content":self.reply}, "finish_reason":"stop"}],
+            })
+
+    def _embeddings(self, payload):
+        texts=payload.get("input") or []
+        if isinstance(texts, str):
+            texts=[texts]
+        dim=int(payload.get("dimensions") or self.embed_dim)
+        data=[]
+        for i, text in enumerate(texts):
+            seed=hashlib.sha256(str(text).encode("utf-8")).digest()
+            vec=[(seed[j%32]-127.5)/127.5 for j in range(dim)]
+            data.append({"object":"embedding", "index":i, "embedding":vec})
+        self._json(200, {"object":"list", "data":data, "model":payload.get("model") or "fake"})
+
+    def _json(self, code, obj):
+        body=json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii")+data+b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, model):
+        self.send_response(200)
+        self.send_header("Content-Type","text/event-stream")
+        self.send_header("Transfer-Encoding","chunked")
+        self.end_headers()
+        for i, token in enumerate(self.reply):
+            if i and self.token_delay:
+                time.sleep(self.token_delay)
+            event={"id":"chatcmpl-fake", "object":"chat.completion.chunk", "model":model,
+                   "choices":[{"index":0, "delta":{"content":token}, "finish_reason":None}]}
+            self._chunk(("data: "+json.dumps(event, ensure_ascii=False)+"\n\n").encode("utf-8"))
+        self._chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def make_server(host="127.0.0.1", port=0, reply=None, delay=0.0, token_delay=0.0):
+    handler=type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {
+        "reply": reply or DEFAULT_REPLY,
+        "delay": delay,
+        "token_delay": token_delay,
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+def main():
+    ap=argparse.ArgumentParser(description="Fake OpenAI-compatible chat completion server")
+    ap.add_argument("--port", type=int, default=9001)
+    ap.add_argument("--delay", type=float, default=0.0, help="seconds before the first byte")
+    ap.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    ap.add_argument("--reply", default=DEFAULT_REPLY)
+    args=ap.parse_args()
+    srv=make_server("127.0.0.1", args.port, args.reply, args.delay, args.token_delay)
+    print(f"Fake LLM listening on http://127.0.0.1:{args.port}/v1")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__=="__main__":
+    main()
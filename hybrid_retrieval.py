@@ -0,0 +1,192 @@
+"""
+Server-side context retrieval for /llm.
+
+Each request runs two kinds of lookup side by side:
+- LightRAG context-only queries (naive: chunk vectors; local: entities;
+  global: relations; hybrid: local+global) on the indexing loop. naive makes
+  no LLM call. local, global and hybrid first ask the LLM for keywords, so
+  each of them costs one upstream call per cache miss.
+- Optionally, the competency-path lookup (graph_lookup) on the request
+  thread. /llm does that lookup itself before retrieving, because the paths
+  are part of its answer-cache key.
+
+The LightRAG contexts are merged line by line in mode order. A line already
+present in an earlier mode or in the browser's evidence is dropped. The
+merge stops at RAG_MAX_TOKENS (approximate tokens: one per CJK character,
+one per four other characters).
+
+Query results are cached per (db_name, index generation, mode, top_k,
+max_tokens, normalised question). The index generation changes whenever an indexing job
+for that database completes, so new documents are seen at once. Each
+stage's time is recorded as a span of the request trace.
+"""
+import os
+import re
+import time
+import threading
+import concurrent.futures
+from collections import OrderedDict
+
+import metrics
+import tracing
+
+MODES=("naive", "local", "global", "hybrid")
+_WS=re.compile(r"\s+")
+_CJK=re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+_HEADER=re.compile(r"^(-{3,}.*-{3,}|#+ .*|```.*)$")   # LightRAG 上下文中的分节标题与代码围栏
+
+_query_seconds=metrics.histogram("retrieval_query_seconds", "LightRAG context query time by mode (cache misses)", ("mode",))
+_cache_events=metrics.counter("retrieval_cache_total", "Retrieval cache lookups", ("result",))
+
+def approx_tokens(text):
+    cjk=len(_CJK.findall(text))
+    return cjk+(len(text)-cjk+3)//4
+
+def _norm(line):
+    return _WS.sub(" ", line).strip().lower()
+
+def seen_lines(text):
+    return {_norm(line) for line in (text or "").splitlines() if _norm(line)}
+
+def merge(blocks, max_tokens, seen=()):
+    """blocks: [(mode, context text)] in priority order -> (merged text, stats).
+
+    Lines seen before (in `seen` or an earlier block) are skipped; section
+    headers are kept only when a line of their section survives.
+    """
+    seen=set(seen)
+    out=[]
+    used=0
+    stats={"lines":0, "duplicates":0, "truncated":False}
+    for mode, text in blocks:
+        header=None
+        block=[]
+        for raw in (text or "").splitlines():
+            line=raw.strip()
+            if not line:
+                continue
+            if _HEADER.match(line):
+                header=line
+                continue
+            key=_norm(line)
+            if key in seen:
+                stats["duplicates"]+=1
+                continue
+            cost=approx_tokens(line)+(approx_tokens(header) if header else 0)
+            if used+cost>max_tokens:
+                stats["truncated"]=True
+                break
+            seen.add(key)
+            if header:
+                block.append(header)
+                header=None
+            block.append(line)
+            used+=cost
+            stats["lines"]+=1
+        if block:
+            out.append(f"[{mode}]\n"+"\n".join(block))
+        if stats["truncated"]:
+            break
+    stats["tokens"]=used
+    return "\n\n".join(out), stats
+
+class RetrievalCache:
+    """LRU of LightRAG query contexts with a TTL."""
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries=max_entries or int(os.environ.get("RAG_CACHE_SIZE","512"))
+        self.ttl=float(os.environ.get("RAG_CACHE_TTL","600")) if ttl is None else ttl
+        self.lock=threading.Lock()
+        self.entries=OrderedDict()
+        self.counters={"hits":0, "misses":0, "evictions":0}
+
+    def get(self, key):
+        with self.lock:
+            hit=self.entries.get(key)
+            if hit and time.time()-hit[0]<self.ttl:
+                self.entries.move_to_end(key)
+                self.counters["hits"]+=1
+                _cache_events.inc("hit")
+                return hit[1]
+            self.counters["misses"]+=1
+            _cache_events.inc("miss")
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key]=(time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries)>self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evictions"]+=1
+
+    def stats(self):
+        with self.lock:
+            out=dict(self.counters)
+            out["entries"]=len(self.entries)
+        return out
+
+class Retriever:
+    """Hybrid retrieval over one LightRAG backend.
+
+    submit(db, question, mode, top_k, max_tokens) -> concurrent Future of the context text
+    generation(db) -> value that changes whenever db's index does
+    """
+    def __init__(self, submit, generation, cache=None):
+        self.submit=submit
+        self.generation=generation
+        self.cache=cache or RetrievalCache()
+
+    def retrieve(self, question, db, modes, top_k, max_tokens, graph_lookup=None, seen_text="", timeout=None):
+        """Returns {"graph_paths", "context", "modes", "merge"}; failed or timed-out modes are reported, not raised."""
+        timeout=float(os.environ.get("RAG_TIMEOUT","10")) if timeout is None else timeout
+        qkey=_norm(question)
+        gen=self.generation(db)
+        report={}
+        results={}
+        pending={}
+        for mode in modes:
+            key=(db, gen, mode, top_k, max_tokens, qkey)
+            hit=self.cache.get(key)
+            if hit is not None:
+                results[mode]=hit
+                report[mode]={"cached":True, "tokens":approx_tokens(hit)}
+                continue
+            t0=time.perf_counter()
+            fut=self.submit(db, question, mode, top_k, max_tokens)
+            # 完成时间在回调里记下，不受收集顺序影响
+            done_at={}
+            fut.add_done_callback(lambda f, d=done_at: d.setdefault("t", time.perf_counter()))
+            pending[mode]=(key, t0, fut, done_at)
+
+        graph_paths=[]
+        if graph_lookup is not None:
+            with tracing.span("graph_retrieval") as sp:
+                graph_paths=graph_lookup(question) or []
+                sp.set(paths=len(graph_paths))
+
+        deadline=time.monotonic()+timeout
+        for mode, (key, t0, fut, done_at) in pending.items():
+            try:
+                text=fut.result(max(0.0, deadline-time.monotonic())) or ""
+            except concurrent.futures.TimeoutError:
+                fut.cancel()
+                report[mode]={"error":"timeout"}
+                tracing.add_span("rag."+mode, t0, time.perf_counter()-t0, error="timeout")
+                metrics.degraded("rag_timeout")
+                continue
+            except Exception as e:
+                report[mode]={"error":str(e)}
+                tracing.add_span("rag."+mode, t0, time.perf_counter()-t0, error=type(e).__name__)
+                metrics.degraded("rag_error")
+                continue
+            seconds=done_at.get("t", time.perf_counter())-t0
+            _query_seconds.observe(seconds, mode)
+            tracing.add_span("rag."+mode, t0, seconds)
+            self.cache.put(key, text)
+            results[mode]=text
+            report[mode]={"cached":False, "ms":round(seconds*1000, 1), "tokens":approx_tokens(text)}
+
+        with tracing.span("rag.merge") as sp:
+            context, stats=merge([(m, results[m]) for m in modes if m in results], max_tokens, seen_lines(seen_text))
+            sp.set(**stats)
+        return {"graph_paths":graph_paths, "context":context, "modes":report, "merge":stats}
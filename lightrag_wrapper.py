@@ -1,11 +1,18 @@
 import os
 import json
 import asyncio
-import numpy as np
-from lightrag import LightRAG, QueryParam
-from lightrag.llm.openai import openai_complete_if_cache, openai_embed
-from lightrag.utils import EmbeddingFunc
 import logging
+import threading
+import importlib.util
+import llm_client
+import metrics
+
+# lightrag (and with it numpy, the OpenAI client, tokenizers) and the embedding
+# backends are imported on first use in get_rag/get_embedder, so importing this
+# module for the task queue stays cheap. Without lightrag installed the module
+# is unavailable, as before.
+if importlib.util.find_spec("lightrag") is None:
+    raise ImportError("lightrag is not installed")
 
 # Configure logging
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
@@ -33,8 +40,15 @@ MS_API_KEY = os.environ.get("MS_API_KEY", "")
 MS_MODEL = os.environ.get("MS_MODEL", "Qwen/Qwen3-32B")
 
 # Define ModelScope LLM Function
-async def modelscope_llm(prompt, system_prompt=None, history_messages=[], **kwargs) -> str:
-    # Adapt to LightRAG's expected signature
+async def modelscope_llm(prompt, system_prompt=None, history_messages=[], keyword_extraction=False, **kwargs) -> str:
+    """LightRAG model function over llm_client's keep-alive pool (replaces openai_complete_if_cache).
+
+    LightRAG reads and writes its LLM response cache itself, around this call,
+    so hashing_kv and its other bookkeeping kwargs are dropped rather than sent
+    upstream. Keyword extraction (query keywords for local/global/hybrid) still
+    asks for a JSON object reply, as openai_complete_if_cache did; a caller's
+    own response_format wins.
+    """
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
@@ -42,30 +56,35 @@ async def modelscope_llm(prompt, system_prompt=None, history_messages=[], **kwar
         messages.extend(history_messages)
     messages.append({"role": "user", "content": prompt})
 
-    return await openai_complete_if_cache(
-        model=MS_MODEL,
-        messages=messages,
-        base_url=MS_BASE_URL,
-        api_key=MS_API_KEY,
+    # LightRAG internal kwargs are not part of the chat completion API
+    for k in ("hashing_kv", "token_tracker", "enable_cot", "stream", "_priority"):
+        kwargs.pop(k, None)
+    if keyword_extraction:
+        kwargs.setdefault("response_format", {"type": "json_object"})
+
+    # Share the keep-alive connection pool with api_llm's /llm route
+    return await asyncio.to_thread(
+        llm_client.get_client().complete,
+        messages, MS_MODEL, MS_BASE_URL, MS_API_KEY,
         **kwargs
     )
 
-# Define ModelScope Embedding Function
-# Note: If ModelScope doesn't support embeddings, we might need a fallback or local model.
-# For now, we assume it supports the standard /embeddings endpoint or we use a dummy one if it fails.
-async def modelscope_embedding(texts: list[str]) -> np.ndarray:
-    try:
-        return await openai_embed(
-            texts,
-            model="text-embedding-v1", # Adjust based on ModelScope availability
-            base_url=MS_BASE_URL,
-            api_key=MS_API_KEY
-        )
-    except Exception as e:
-        print(f"Embedding failed: {e}")
-        # Fallback: Return random vectors if embedding fails (just to keep it running for graph extraction)
-        # In production, use a real local model like SentenceTransformer
-        return np.random.rand(len(texts), 1536)
+# Embedding backend (see embeddings.py): remote /embeddings, local CPU model or
+# hashed n-grams, behind one batching thread and a persistent per-text cache
+_embedder = None
+_embedder_lock = threading.Lock()
+
+def get_embedder():
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            import embeddings
+            _embedder = embeddings.Batcher(embeddings.make_backend(),
+                                           cache_path=os.path.join(WORKING_DIR, "embeddings.db"))
+        return _embedder
+
+async def modelscope_embedding(texts: list[str]):
+    return await get_embedder().embed(texts)
 
 # Initialize LightRAG
 # We use Neo4j for storage as requested
@@ -90,124 +109,797 @@ WORKING_DIR = "./lightrag_data"
 if not os.path.exists(WORKING_DIR):
     os.makedirs(WORKING_DIR)
 
-import threading
 import uuid
 import time
 import io
 import base64
+import binascii
+import sqlite3
+import itertools
+import hashlib
+import re
+from concurrent.futures import ProcessPoolExecutor
 
-# PDF/Docx Extraction
-try:
-    import pypdf
-except ImportError:
-    pypdf = None
-
-try:
-    import docx
-except ImportError:
-    docx = None
+# PDF/Docx Extraction (runs in a process pool, see doc_pipeline)
+import doc_pipeline
+import task_store
 
 # ... imports ...
 
-# Global LightRAG Instance
+def _rag_concurrency(rag_cls):
+    """Per-chunk parallelism inside LightRAG, passing only the knobs this LightRAG version has."""
+    fields = getattr(rag_cls, "__dataclass_fields__", {})
+    wanted = {
+        "llm_model_max_async": os.environ.get("INDEX_LLM_CONCURRENCY"),
+        "embedding_func_max_async": os.environ.get("INDEX_EMBED_CONCURRENCY"),
+        "max_parallel_insert": os.environ.get("INDEX_PARALLEL_INSERT"),
+    }
+    return {k: int(v) for k, v in wanted.items() if v and k in fields}
+
+# LightRAG instances, one per db_name. get_rag runs on the indexing loop; each
+# db has its own lock and the constructor (which loads the KV/vector files of
+# the working dir) runs in a thread, so building one db never stalls another.
 rag_instances = {}
-rag_lock = asyncio.Lock()
+_rag_locks = {}    # db_name -> asyncio.Lock
+_rag_state = {}    # db_name -> {"state", "build_ms", "error"}
+
+def _build_rag(db_name):
+    from lightrag import LightRAG
+    from lightrag.utils import EmbeddingFunc
+
+    db_working_dir = os.path.join(WORKING_DIR, db_name)
+    os.makedirs(db_working_dir, exist_ok=True)
+    embedder = get_embedder()
+    return LightRAG(
+        working_dir=db_working_dir,
+        llm_model_func=modelscope_llm,
+        embedding_func=EmbeddingFunc(
+            embedding_dim=embedder.dim,
+            max_token_size=8192,
+            func=modelscope_embedding
+        ),
+        kg_store_type="Neo4JStorage",
+        kg_store_kwargs={
+            "url": NEO4J_URI,
+            "username": NEO4J_USER,
+            "password": NEO4J_PASSWORD,
+            "database": db_name
+        },
+        log_level="INFO",
+        **_rag_concurrency(LightRAG)
+    )
 
 async def get_rag(db_name="neo4j"):
-    global rag_instances
-    async with rag_lock:
+    rag = rag_instances.get(db_name)
+    if rag is not None:
+        return rag
+    lock = _rag_locks.setdefault(db_name, asyncio.Lock())
+    async with lock:
         if db_name in rag_instances:
             return rag_instances[db_name]
-        
-        db_working_dir = os.path.join(WORKING_DIR, db_name)
-        if not os.path.exists(db_working_dir):
-            os.makedirs(db_working_dir)
-
+        t0 = time.perf_counter()
+        _rag_state[db_name] = {"state": "building"}
         try:
             print(f"Initializing LightRAG for {db_name}...")
-            rag = LightRAG(
-                working_dir=db_working_dir,
-                llm_model_func=modelscope_llm,
-                embedding_func=EmbeddingFunc(
-                    embedding_dim=1536,
-                    max_token_size=8192,
-                    func=modelscope_embedding
-                ),
-                kg_store_type="Neo4JStorage",
-                kg_store_kwargs={
-                    "url": NEO4J_URI,
-                    "username": NEO4J_USER,
-                    "password": NEO4J_PASSWORD,
-                    "database": db_name
-                },
-                log_level="INFO"
-            )
+            rag = await asyncio.to_thread(_build_rag, db_name)
+            # Newer LightRAG versions open their storages asynchronously
+            if hasattr(rag, "initialize_storages"):
+                await rag.initialize_storages()
             rag_instances[db_name] = rag
+            _rag_state[db_name] = {"state": "ready", "build_ms": round((time.perf_counter() - t0) * 1000, 1)}
             print(f"LightRAG Initialized Successfully for {db_name}")
             return rag
         except Exception as e:
+            _rag_state[db_name] = {"state": "failed", "error": str(e)}
             print(f"Failed to initialize LightRAG: {e}")
             return None
 
-# Task Queue System
-tasks = {} # id -> {status, result, error, filename, type}
+# Retrieval (hybrid_retrieval): context-only LightRAG queries on the indexing loop,
+# where the instances and their storage connections live
+def index_generation(db_name):
+    """Completed indexing jobs of db_name; part of the retrieval and answer cache keys."""
+    return _generations.get(db_name)
+
+_index_listeners = []
 
-def background_indexing_task(task_id, content, type, filename, db_name):
-    # This runs in a separate thread
-    async def _run():
+def on_indexed(fn):
+    """Call fn(db_name) on the indexing loop whenever an indexing job for db_name completes."""
+    _index_listeners.append(fn)
+
+def _notify_indexed(db_name):
+    for fn in list(_index_listeners):
         try:
-            tasks[task_id]['status'] = 'running'
-            rag = await get_rag(db_name)
-            if not rag:
-                raise Exception("LightRAG initialization failed")
-            
-            print(f"Starting indexing for {filename}...")
-            await rag.ainsert(content)
-            
-            tasks[task_id]['status'] = 'completed'
-            tasks[task_id]['message'] = 'Indexing completed successfully'
-            print(f"Indexing completed for {filename}")
+            fn(db_name)
         except Exception as e:
-            tasks[task_id]['status'] = 'failed'
-            tasks[task_id]['error'] = str(e)
-            print(f"Indexing failed for {filename}: {e}")
+            print(f"Index listener error: {e}")
+
+def _query_param(mode, top_k, max_tokens):
+    from lightrag import QueryParam
+
+    fields = getattr(QueryParam, "__dataclass_fields__", {})
+    wanted = {
+        "mode": mode,
+        "only_need_context": True,
+        "top_k": top_k,
+        "chunk_top_k": top_k,
+        # token budgets (older and newer LightRAG names)
+        "max_token_for_text_unit": max_tokens,
+        "max_token_for_local_context": max_tokens,
+        "max_token_for_global_context": max_tokens,
+        "max_total_tokens": max_tokens,
+    }
+    return QueryParam(**{k: v for k, v in wanted.items() if k in fields or not fields})
 
-    # Create new event loop for the thread if needed, or use run
+async def _query_context(db_name, query, mode, top_k, max_tokens):
+    # A db that was never indexed has nothing to retrieve; don't build an instance for it
+    if db_name not in rag_instances and not os.path.isdir(os.path.join(WORKING_DIR, db_name)):
+        return ""
+    rag = await get_rag(db_name)
+    if rag is None:
+        raise RuntimeError("LightRAG unavailable")
+    with metrics.timed("lightrag"):
+        context = await rag.aquery(query, param=_query_param(mode, top_k, max_tokens))
+    if not context:
+        return ""
+    if not isinstance(context, str):
+        context = json.dumps(context, ensure_ascii=False)
     try:
-        asyncio.run(_run())
+        from lightrag.prompt import PROMPTS
+        # "no context" answer some versions return instead of an empty string
+        if context.strip() == PROMPTS.get("fail_response", "").strip():
+            return ""
+    except ImportError:
+        pass
+    return context
+
+def submit_query(db_name, query, mode, top_k=10, max_tokens=2000):
+    """Context-only LightRAG query; returns a concurrent.futures.Future of the context text."""
+    _pool.start()
+    return asyncio.run_coroutine_threadsafe(_query_context(db_name, query, mode, top_k, max_tokens), _pool.loop)
+
+def warm_up(db_names):
+    """Build the LightRAG instances of db_names in the background on the indexing loop."""
+    _pool.start()
+    for db_name in db_names:
+        asyncio.run_coroutine_threadsafe(get_rag(db_name), _pool.loop)
+
+def rag_stats():
+    return {db: dict(state) for db, state in list(_rag_state.items())}
+
+# Task Queue System
+INDEX_WORKERS = int(os.environ.get("INDEX_WORKERS", "2"))
+INDEX_PER_DB = int(os.environ.get("INDEX_PER_DB", "1"))
+JOBS_DB = os.path.join(WORKING_DIR, "jobs.db")
+JOBS_DIR = os.path.join(WORKING_DIR, "jobs")
+TERMINAL_STATUSES = task_store.TERMINAL_STATUSES
+
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", "2"))
+PARSE_PAGE_BATCH = int(os.environ.get("PARSE_PAGE_BATCH", "8"))
+INDEX_CHUNK_SIZE = int(os.environ.get("INDEX_CHUNK_SIZE", "2000"))
+INDEX_CHUNK_OVERLAP = int(os.environ.get("INDEX_CHUNK_OVERLAP", "100"))
+INDEX_CHUNK_BATCH = int(os.environ.get("INDEX_CHUNK_BATCH", "16"))
+INDEX_DEDUP = os.environ.get("INDEX_DEDUP", "1").lower() not in ("0", "false", "no")
+INDEX_RESUME_HOURS = float(os.environ.get("INDEX_RESUME_HOURS", "72"))
+
+_WS_RE = re.compile(r"\s+")
+
+def _content_hash(text):
+    # 归一化空白后再哈希，重新导出/换行差异不影响去重
+    return hashlib.sha256(_WS_RE.sub(" ", text).strip().encode("utf-8")).hexdigest()
+
+class _JobsTable:
+    """Tables in jobs.db; the file is opened (and created) on first use, not at import."""
+    SCHEMA = ()
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def conn(self):
+        # 调用方持有 self.lock
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            for ddl in self.SCHEMA:
+                conn.execute(ddl)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+class _ContentRegistry(_JobsTable):
+    """Per-db hashes of uploaded files, extracted documents and indexed chunks.
+
+    kind 'file' is the raw upload, 'text' the normalized extracted text.
+    Chunk hashes are recorded only after rag.ainsert succeeded for them.
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS doc_hashes (db_name TEXT, kind TEXT, hash TEXT, task_id TEXT, "
+        "created_at REAL, PRIMARY KEY (db_name, kind, hash))",
+        "CREATE TABLE IF NOT EXISTS chunk_hashes (db_name TEXT, hash TEXT, task_id TEXT, "
+        "created_at REAL, PRIMARY KEY (db_name, hash))",
+    )
+
+    def find_doc(self, db_name, kind, h):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT task_id FROM doc_hashes WHERE db_name = ? AND kind = ? AND hash = ?", (db_name, kind, h)
+            ).fetchone()
+        return row[0] if row else None
+
+    def add_doc(self, db_name, kind, h, task_id, replace=False):
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        with self.lock:
+            self.conn.execute(f"{verb} INTO doc_hashes VALUES (?, ?, ?, ?, ?)", (db_name, kind, h, task_id, time.time()))
+            self.conn.commit()
+
+    def known_chunks(self, db_name, hashes):
+        if not hashes:
+            return set()
+        marks = ",".join("?" * len(hashes))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT hash FROM chunk_hashes WHERE db_name = ? AND hash IN ({marks})", (db_name, *hashes)
+            ).fetchall()
+        return {r[0] for r in rows}
+
+    def add_chunks(self, db_name, hashes, task_id):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO chunk_hashes VALUES (?, ?, ?, ?)", [(db_name, h, task_id, now) for h in hashes]
+            )
+            self.conn.commit()
+
+class _CheckpointStore(_JobsTable):
+    """Indexes of the chunks of a job that LightRAG has finished, so a rerun skips them."""
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS chunk_checkpoints (task_id TEXT, idx INTEGER, PRIMARY KEY (task_id, idx))",)
+
+    def done(self, task_id):
+        with self.lock:
+            rows = self.conn.execute("SELECT idx FROM chunk_checkpoints WHERE task_id = ?", (task_id,)).fetchall()
+        return {r[0] for r in rows}
+
+    def mark(self, task_id, indexes):
+        with self.lock:
+            self.conn.executemany("INSERT OR IGNORE INTO chunk_checkpoints VALUES (?, ?)", [(task_id, i) for i in indexes])
+            self.conn.commit()
+
+    def clear(self, task_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM chunk_checkpoints WHERE task_id = ?", (task_id,))
+            self.conn.commit()
+
+class _GenerationStore(_JobsTable):
+    """Per-db count of completed indexing jobs, kept in jobs.db so it survives a restart.
+
+    The answer cache persists across restarts too; a counter that started
+    from 0 again would make answers cached before later indexing match again.
+    """
+    SCHEMA = ("CREATE TABLE IF NOT EXISTS index_generations (db_name TEXT PRIMARY KEY, generation INTEGER)",)
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.cache = {}   # db_name -> generation; read on every /llm request
+
+    def get(self, db_name):
+        with self.lock:
+            if db_name not in self.cache:
+                row = self.conn.execute("SELECT generation FROM index_generations WHERE db_name = ?", (db_name,)).fetchone()
+                self.cache[db_name] = row[0] if row else 0
+            return self.cache[db_name]
+
+    def bump(self, db_name):
+        with self.lock:
+            self.conn.execute("INSERT INTO index_generations VALUES (?, 1) ON CONFLICT(db_name) "
+                              "DO UPDATE SET generation = generation + 1", (db_name,))
+            self.conn.commit()
+            row = self.conn.execute("SELECT generation FROM index_generations WHERE db_name = ?", (db_name,)).fetchone()
+            self.cache[db_name] = row[0]
+            return row[0]
+
+def _payload_path(task_id):
+    return os.path.join(JOBS_DIR, f"{task_id}.payload")
+
+def _write_payload(task_id, content):
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    with open(_payload_path(task_id), "w", encoding="utf-8") as f:
+        f.write(content)
+
+def _binary_path(task_id):
+    return os.path.join(JOBS_DIR, f"{task_id}.bin")
+
+def _chunks_path(task_id):
+    return os.path.join(JOBS_DIR, f"{task_id}.chunks")
+
+def _has_payload(task):
+    # 'file' uploads are streamed straight to <id>.bin; the others keep <id>.payload.
+    # Once extraction finished, the chunk spool alone is enough to resume.
+    if os.path.exists(_chunks_path(task['id'])):
+        return True
+    path = _binary_path(task['id']) if task.get('type') == 'file' else _payload_path(task['id'])
+    return os.path.exists(path)
+
+def _drop_payload(task_id):
+    for path in (_payload_path(task_id), _binary_path(task_id), _chunks_path(task_id), _chunks_path(task_id) + ".tmp"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+# The task backend is attached by start_workers(), so importing this module creates no files.
+# TASK_STORE=memory keeps no task records on disk: nothing is resumed after a restart
+tasks = task_store.TaskStore()
+_registry = _ContentRegistry(JOBS_DB)
+_checkpoints = _CheckpointStore(JOBS_DB)
+_generations = _GenerationStore(JOBS_DB)
+_dedup_lock = threading.Lock()
+
+_JOB_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+_job_seconds = metrics.histogram("indexing_job_seconds", "Indexing job run time by final status", ("status",), _JOB_BUCKETS)
+_job_wait_seconds = metrics.histogram("indexing_queue_wait_seconds", "Time from submission to a worker picking the job up", (), _JOB_BUCKETS)
+
+def _update_task(task_id, expect=None, **fields):
+    """Apply fields to a task; with `expect`, only while its status is one of those. Returns whether it applied."""
+    before, task = tasks.update(task_id, fields, expect)
+    if task is None:
+        return False
+    if 'started_at' in fields and task.get('created_at'):
+        _job_wait_seconds.observe(max(0.0, fields['started_at'] - task['created_at']))
+    if task['status'] in TERMINAL_STATUSES and before not in TERMINAL_STATUSES and task.get('started_at'):
+        _job_seconds.observe(max(0.0, (task.get('finished_at') or time.time()) - task['started_at']), task['status'])
+    # Failed/cancelled jobs keep their payload, chunk spool and checkpoints so they can be resumed
+    if task['status'] == 'completed':
+        _drop_payload(task_id)
+        _checkpoints.clear(task_id)
+    return True
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def _get_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+        return _parse_pool
+
+async def _extract_text(task_id, type, filename):
+    """Yield document text piece by piece, reporting page progress on the task."""
+    loop = asyncio.get_running_loop()
+    src = _payload_path(task_id)
+    if type == 'text':
+        _update_task(task_id, stage='extracting', pages_total=1, pages_done=0)
+        for block in doc_pipeline.iter_text_file(src):
+            yield block
+        _update_task(task_id, pages_done=1)
+        return
+
+    pool = _get_parse_pool()
+    path = _binary_path(task_id)
+    if type == 'binary':
+        _update_task(task_id, stage='decoding', message='Decoding upload')
+        await loop.run_in_executor(pool, doc_pipeline.decode_base64_file, src, path)
+    kind = doc_pipeline.detect_kind(path, filename)
+    if kind == 'pdf':
+        total = await loop.run_in_executor(pool, doc_pipeline.pdf_page_count, path)
+        _update_task(task_id, stage='extracting', pages_total=total, pages_done=0)
+        for start in range(0, total, PARSE_PAGE_BATCH):
+            pages = await loop.run_in_executor(pool, doc_pipeline.pdf_pages, path, start, start + PARSE_PAGE_BATCH)
+            for i, text in enumerate(pages):
+                yield text + "\n\n"
+                _update_task(task_id, pages_done=start + i + 1, message=f'Parsed page {start + i + 1}/{total}')
+    elif kind == 'docx':
+        paragraphs = await loop.run_in_executor(pool, doc_pipeline.docx_paragraphs, path)
+        total = len(paragraphs)
+        _update_task(task_id, stage='extracting', pages_total=total, pages_done=0, page_unit='paragraph')
+        for i, text in enumerate(paragraphs):
+            yield text + "\n\n"
+            if (i + 1) % 50 == 0 or i + 1 == total:
+                _update_task(task_id, pages_done=i + 1, message=f'Parsed paragraph {i + 1}/{total}')
+    else:
+        _update_task(task_id, stage='extracting', pages_total=1, pages_done=0)
+        for block in doc_pipeline.iter_text_file(path):
+            yield block
+        _update_task(task_id, pages_done=1)
+
+async def _spool_chunks(task_id, type, filename):
+    """Extract and chunk the document into <id>.chunks (one JSON string per line).
+
+    Returns (chunk count, hash of the cleaned text). A spool left by an earlier
+    run of the same job is reused, so chunk indexes stay stable across resumes.
+    """
+    path = _chunks_path(task_id)
+    task = tasks.get(task_id) or {}
+    if os.path.exists(path) and task.get('chunks_total') is not None and task.get('text_sha256'):
+        return task['chunks_total'], task['text_sha256']
+    chunker = doc_pipeline.Chunker(INDEX_CHUNK_SIZE, INDEX_CHUNK_OVERLAP)
+    text_sha = hashlib.sha256()
+    count = 0
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        async for text in _extract_text(task_id, type, filename):
+            text = doc_pipeline.clean_text(text)
+            text_sha.update(text.encode("utf-8"))
+            for chunk in chunker.feed(text):
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                count += 1
+        for chunk in chunker.flush():
+            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(path + ".tmp", path)
+    _update_task(task_id, chunks_total=count, text_sha256=text_sha.hexdigest())
+    return count, text_sha.hexdigest()
+
+def _pending_groups(task_id, done, size):
+    """Yield (indexes, chunks) groups of up to `size` spooled chunks not yet checkpointed."""
+    idxs, chunks = [], []
+    with open(_chunks_path(task_id), "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if i in done:
+                continue
+            idxs.append(i)
+            chunks.append(json.loads(line))
+            if len(chunks) >= size:
+                yield idxs, chunks
+                idxs, chunks = [], []
+    if chunks:
+        yield idxs, chunks
+
+async def background_indexing_task(task_id, type, filename, db_name):
+    # Runs on the shared indexing event loop; the worker has already moved the task to 'running'
+    try:
+        rag = await get_rag(db_name)
+        if not rag:
+            raise Exception("LightRAG initialization failed")
+
+        print(f"Starting indexing for {filename}...")
+        total, text_hash = await _spool_chunks(task_id, type, filename)
+        if not total:
+            raise Exception("No text could be extracted from the document")
+
+        # Resume: chunks checkpointed by an earlier (crashed, failed or cancelled) run are skipped
+        done = _checkpoints.done(task_id)
+        task = tasks.get(task_id) or {}
+        counts = {'chunks_done': len(done), 'chunks_total': total,
+                  'dedup_hits': task.get('dedup_hits', 0) if done else 0,
+                  'dedup_misses': task.get('dedup_misses', 0) if done else 0}
+        if done:
+            print(f"Resuming {filename} at chunk {len(done)}/{total}")
+        _update_task(task_id, stage='indexing', resumed_from=len(done) or None, throughput=None, eta_seconds=None,
+                     message=f'Indexing chunk {len(done)}/{total}', **counts)
+
+        async def insert(chunks):
+            # 只把库里还没有的分块交给 LightRAG，未改动的部分直接跳过
+            if INDEX_DEDUP:
+                hashes = [_content_hash(c) for c in chunks]
+                seen = _registry.known_chunks(db_name, list(set(hashes)))
+                fresh = {}
+                for c, h in zip(chunks, hashes):
+                    if h not in seen and h not in fresh:
+                        fresh[h] = c
+                if fresh:
+                    await rag.ainsert(list(fresh.values()))
+                    _registry.add_chunks(db_name, list(fresh), task_id)
+                counts['dedup_misses'] += len(fresh)
+                counts['dedup_hits'] += len(chunks) - len(fresh)
+            else:
+                await rag.ainsert(chunks)
+
+        # Each group is one rag.ainsert call; LightRAG extracts and embeds the chunks of a group
+        # concurrently (INDEX_LLM_CONCURRENCY / INDEX_EMBED_CONCURRENCY), and the group is
+        # checkpointed as soon as it is stored.
+        t0 = time.monotonic()
+        processed = 0
+        for idxs, chunks in _pending_groups(task_id, done, INDEX_CHUNK_BATCH):
+            await insert(chunks)
+            _checkpoints.mark(task_id, idxs)
+            processed += len(chunks)
+            counts['chunks_done'] += len(chunks)
+            elapsed = max(time.monotonic() - t0, 1e-6)
+            rate = processed / elapsed
+            _update_task(task_id, throughput=round(rate, 3),
+                         eta_seconds=round((total - counts['chunks_done']) / rate, 1),
+                         message=f"Indexed chunk {counts['chunks_done']}/{total}", **counts)
+
+        message = 'Indexing completed successfully'
+        if INDEX_DEDUP:
+            if counts['dedup_hits'] and not counts['dedup_misses']:
+                message = 'No new content; all chunks already indexed'
+            original = _registry.find_doc(db_name, 'text', text_hash)
+            if original and original != task_id:
+                counts['duplicate_of'] = original
+                message = 'Document already indexed'
+            else:
+                _registry.add_doc(db_name, 'text', text_hash, task_id)
+        _generations.bump(db_name)
+        _update_task(task_id, status='completed', stage='done', message=message, finished_at=time.time(),
+                     eta_seconds=0, **counts)
+        _notify_indexed(db_name)
+        print(f"Indexing completed for {filename}")
+    except asyncio.CancelledError:
+        _update_task(task_id, status='cancelled', message='Cancelled while running', finished_at=time.time(), eta_seconds=None)
+        print(f"Indexing cancelled for {filename}")
+        raise
     except Exception as e:
-        tasks[task_id]['status'] = 'failed'
-        tasks[task_id]['error'] = str(e)
+        _update_task(task_id, status='failed', error=str(e), finished_at=time.time(), eta_seconds=None)
+        print(f"Indexing failed for {filename}: {e}")
+
+class _IndexingPool:
+    """Fixed number of workers on one long-lived event loop.
+
+    Jobs are taken highest priority first (FIFO within a priority), at most
+    `per_db` jobs run at once for the same db_name, and both queued and
+    running jobs can be cancelled.
+    """
+    def __init__(self, workers, per_db):
+        self.workers = workers
+        self.per_db = per_db
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+        self.queue = None
+        self.ready = None
+        self.seq = itertools.count()
+        self.running = {}        # task_id -> asyncio.Task
+        self.active_per_db = {}  # db_name -> running job count
+        self.deferred = {}       # db_name -> [queue entries waiting for a db slot]
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                first = False
+            else:
+                first = True
+                _attach_task_backend()
+                self.loop = asyncio.new_event_loop()
+                # Created before the loop thread so submit() never sees it missing
+                self.queue = asyncio.PriorityQueue()
+                self.ready = threading.Event()
+                self.thread = threading.Thread(target=self._run, name="indexing-loop", daemon=True)
+                self.thread.start()
+        # Every caller waits, including ones that raced the first start()
+        self.ready.wait()
+        if first:
+            self._restore()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        for _ in range(self.workers):
+            self.loop.create_task(self._worker())
+        self.loop.call_soon(self.ready.set)
+        self.loop.run_forever()
+
+    def _restore(self):
+        # Re-queue work persisted before a restart; interrupted jobs resume from their checkpoints
+        _sweep_stale_jobs()
+        for task in tasks.pending():
+            if task['id'] in tasks:
+                continue
+            tasks.add(task)
+            if task['status'] == 'cancelling' or not _has_payload(task):
+                _update_task(task['id'], status='cancelled' if task['status'] == 'cancelling' else 'failed',
+                             error=None if task['status'] == 'cancelling' else 'payload lost on restart')
+                continue
+            _update_task(task['id'], status='queued', message='Re-queued after restart; finished chunks are kept')
+            self.submit(task['id'], task.get('priority', 0))
+
+    def submit(self, task_id, priority=0):
+        self.start()
+        entry = (-priority, next(self.seq), task_id)
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, entry)
+
+    async def _worker(self):
+        while True:
+            entry = await self.queue.get()
+            task_id = entry[2]
+            task = tasks.get(task_id)
+            if not task or task['status'] != 'queued':
+                continue
+            db_name = task.get('db_name') or "neo4j"
+            if self.active_per_db.get(db_name, 0) >= self.per_db:
+                self.deferred.setdefault(db_name, []).append(entry)
+                continue
+            # queued -> running in one step under the store lock: a cancel() racing this
+            # either wins (the job is skipped) or sees 'running' and cancels the job.
+            # Nothing awaits between here and self.running, so _cancel_running finds it.
+            if not _update_task(task_id, expect=('queued',), status='running', started_at=time.time(), error=None):
+                continue
+            self.active_per_db[db_name] = self.active_per_db.get(db_name, 0) + 1
+            try:
+                job = self.loop.create_task(background_indexing_task(
+                    task_id, task.get('type'), task.get('filename'), db_name))
+                self.running[task_id] = job
+                try:
+                    await job
+                except asyncio.CancelledError:
+                    # Cancelled before the job got to run its own handler
+                    _update_task(task_id, expect=('running', 'cancelling'), status='cancelled',
+                                 message='Cancelled while running', finished_at=time.time())
+            except Exception as e:
+                _update_task(task_id, status='failed', error=str(e), finished_at=time.time())
+            finally:
+                self.running.pop(task_id, None)
+                self.active_per_db[db_name] -= 1
+                # Hand every job waiting on this db back to the priority queue
+                for waiting in self.deferred.pop(db_name, []):
+                    self.queue.put_nowait(waiting)
+
+    def cancel(self, task_id):
+        # Both transitions are compare-and-set, so a worker starting or finishing the job
+        # at the same moment is never overwritten
+        if _update_task(task_id, expect=('queued',), status='cancelled', message='Cancelled before start',
+                        finished_at=time.time()):
+            return True
+        if self.loop is not None and _update_task(task_id, expect=('running',), status='cancelling'):
+            self.loop.call_soon_threadsafe(self._cancel_running, task_id)
+            return True
+        return False
+
+    def _cancel_running(self, task_id):
+        job = self.running.get(task_id)
+        if job is not None:
+            job.cancel()
 
-def submit_indexing_task(content, type, filename, db_name="neo4j"):
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "per_db": self.per_db,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "deferred": sum(len(v) for v in self.deferred.values()),
+            "running": len(self.running),
+        }
+
+_pool = _IndexingPool(INDEX_WORKERS, INDEX_PER_DB)
+
+def indexing_stats():
+    """Queue depth of the indexing pool plus in-memory task counts by status."""
+    out = _pool.stats()
+    store = tasks.stats()
+    out["by_status"] = store.pop("by_status")
+    out["tasks"] = store
+    out["embedding"] = _embedder.stats() if _embedder is not None else None
+    return out
+
+def _attach_task_backend():
+    if tasks.backend is None and os.environ.get("TASK_STORE", "sqlite").lower() != "memory":
+        tasks.attach(task_store.SQLiteTaskBackend(JOBS_DB))
+
+def start_workers():
+    """Open jobs.db, start the indexing loop and resume persisted jobs."""
+    _pool.start()
+
+def _claim(task):
+    """Register a new task unless the same upload already has one in this db.
+
+    Returns the id of the existing task, or None after recording `task`.
+    """
+    db_name, file_hash = task['db_name'], task.get('sha256')
+    with _dedup_lock:
+        if INDEX_DEDUP and file_hash:
+            existing = _registry.find_doc(db_name, 'file', file_hash)
+            record = get_task_status(existing) if existing else None
+            if record and record['status'] not in ('failed', 'cancelled', 'cancelling'):
+                return existing
+            _registry.add_doc(db_name, 'file', file_hash, task['id'], replace=True)
+        tasks.add(task)
+    return None
+
+def submit_indexing_task(content, type, filename, db_name="neo4j", priority=0):
     task_id = str(uuid.uuid4())
-    tasks[task_id] = {
+    # Hash the document bytes, not their base64 form, so the same file matches across /upload_doc and /upload_file
+    size = None
+    if type == 'binary':
+        try:
+            file_hash, size = doc_pipeline.base64_sha256(content)
+        except (binascii.Error, ValueError):
+            file_hash = None   # 解码失败由任务本身报告，不参与去重
+    else:
+        file_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    existing = _claim({
         'id': task_id,
         'status': 'queued',
         'filename': filename,
+        'type': type,
+        'db_name': db_name,
+        'priority': priority,
+        'sha256': file_hash,
+        'size': size,
         'created_at': time.time()
-    }
-    
-    # Handle base64 decoding if needed
-    if type == 'binary' and pypdf:
-        # Decode base64 to bytes
-        # This part should be moved to inside the thread to avoid blocking
-        pass
+    })
+    if existing:
+        return existing
 
-    thread = threading.Thread(target=background_indexing_task, args=(task_id, content, type, filename, db_name))
-    thread.daemon = True
-    thread.start()
+    # Decoding and text extraction happen later in the parse process pool
+    _write_payload(task_id, content)
+    _update_task(task_id)
+    _pool.submit(task_id, priority)
     
     return task_id
 
+def submit_indexing_file(path, filename, db_name="neo4j", priority=0, sha256=None, size=None):
+    """Queue an already-written upload; the file is moved into the job directory.
+
+    Returns the existing task_id (and removes `path`) when the same file was
+    already uploaded to this db.
+    """
+    task_id = str(uuid.uuid4())
+    existing = _claim({
+        'id': task_id,
+        'status': 'queued',
+        'filename': filename,
+        'type': 'file',
+        'db_name': db_name,
+        'priority': priority,
+        'sha256': sha256,
+        'size': size,
+        'created_at': time.time()
+    })
+    if existing:
+        os.remove(path)
+        return existing
+
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    os.replace(path, _binary_path(task_id))
+    _update_task(task_id)
+    _pool.submit(task_id, priority)
+
+    return task_id
+
 def get_task_status(task_id):
-    return tasks.get(task_id)
+    # 已淘汰出内存或重启前结束的任务从 jobs.db 读取；返回副本，序列化时任务可能仍在更新
+    task = tasks.snapshot(task_id)
+    if task and task['status'] in ('failed', 'cancelled'):
+        task['resumable'] = _has_payload(task)
+    return task
 
-def cancel_task(task_id):
-    # Simple implementation: just mark as cancelled if not running
-    if task_id in tasks:
-        if tasks[task_id]['status'] == 'queued':
-            tasks[task_id]['status'] = 'cancelled'
-            return True
-    return False
+def wait_task_events(task_ids, since=0, timeout=25.0):
+    """Long-poll for changes to the given tasks.
+
+    Returns (version, changed) as soon as any of them has a version newer than
+    `since`, or after `timeout` seconds with an empty list. `version` is the
+    value to pass as `since` next time. since=0 returns the current state of
+    every known task immediately, including finished ones only kept in jobs.db.
+    """
+    task_ids = list(dict.fromkeys(task_ids))
+    if not since:
+        version = tasks.version
+        return version, [t for t in map(get_task_status, task_ids) if t]
+    version, changed = tasks.wait(task_ids, since, timeout)
+    for task in changed:
+        if task['status'] in ('failed', 'cancelled'):
+            task['resumable'] = _has_payload(task)
+    return version, changed
+
+def list_tasks(statuses=None, db_name=None, before=None, limit=50):
+    """Newest-first page of task records; `before` is the (created_at, id) of the last row of the previous page."""
+    return tasks.list(statuses, db_name, before, limit)
 
+def resume_task(task_id):
+    """Re-queue a failed or cancelled job; chunks it already indexed are skipped."""
+    task = tasks.load(task_id)
+    if not task or task['status'] not in ('failed', 'cancelled') or not _has_payload(task):
+        return False
+    _update_task(task_id, status='queued', error=None, finished_at=None, message='Queued to resume')
+    _pool.submit(task_id, task.get('priority', 0))
+    return True
+
+def _sweep_stale_jobs():
+    """Drop payloads/spools of failed or cancelled jobs not resumed within INDEX_RESUME_HOURS."""
+    if not os.path.isdir(JOBS_DIR):
+        return
+    cutoff = time.time() - INDEX_RESUME_HOURS * 3600
+    for name in os.listdir(JOBS_DIR):
+        task_id = name.split(".", 1)[0]
+        if task_id in tasks:
+            continue
+        record = tasks.snapshot(task_id)
+        # Without a persistent task store nothing on disk can be resumed
+        if (record is None and tasks.backend is None) or (
+                record and record['status'] in ('failed', 'cancelled') and (record.get('updated_at') or 0) < cutoff):
+            _drop_payload(task_id)
+            _checkpoints.clear(task_id)
+
+def cancel_task(task_id):
+    return _pool.cancel(task_id)
@@ -0,0 +1,273 @@
+"""
+Shared keep-alive HTTP client for the OpenAI-compatible LLM upstream (ModelScope).
+
+One bounded pool of persistent connections per (scheme, host, port), split
+connect/read timeouts and retries with jittered exponential backoff. Used by
+api_llm.py for /llm, by lightrag_wrapper.modelscope_llm for indexing and by
+embeddings.RemoteBackend.
+"""
+import os
+import json
+import ssl
+import time
+import queue
+import random
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+import metrics
+
+RETRY_STATUSES={429, 500, 502, 503, 504}
+
+class LLMUnavailable(Exception):
+    """Raised when the upstream cannot be reached after all retries."""
+
+class LLMResponse:
+    """Upstream response; returns its connection to the pool on close."""
+    def __init__(self, pool, conn, resp):
+        self._pool=pool
+        self._conn=conn
+        self._resp=resp
+        self.status=resp.status
+        self.headers=resp.headers
+        self.content_type=(resp.headers.get("Content-Type") or "").lower()
+        self._t0=time.perf_counter()
+
+    def read(self):
+        try:
+            return self._resp.read()
+        finally:
+            self.close()
+
+    def __iter__(self):
+        # 逐行读取（SSE），chunked 编码由 http.client 处理
+        for line in self._resp:
+            yield line
+
+    def close(self):
+        if self._conn is None:
+            return
+        metrics.add_time("llm_body", time.perf_counter()-self._t0)
+        # 只有完整读完且上游未要求关闭的连接才放回连接池
+        reusable=self._resp.isclosed() and not self._resp.will_close
+        self._pool.release(self._conn, reusable)
+        self._conn=None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class _HostPool:
+    def __init__(self, scheme, host, port, size, connect_timeout, read_timeout):
+        self.scheme=scheme
+        self.host=host
+        self.port=port
+        self.connect_timeout=connect_timeout
+        self.read_timeout=read_timeout
+        self.size=size
+        self.idle=queue.LifoQueue()
+        self.slots=threading.BoundedSemaphore(size)
+        self.ssl_context=ssl.create_default_context() if scheme=="https" else None
+        self.lock=threading.Lock()
+        self.created=0
+        self.in_use=0
+
+    def _connect(self):
+        if self.scheme=="https":
+            conn=http.client.HTTPSConnection(self.host, self.port, timeout=self.connect_timeout, context=self.ssl_context)
+        else:
+            conn=http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        # 建连后切换为读超时
+        conn.sock.settimeout(self.read_timeout)
+        with self.lock:
+            self.created+=1
+        return conn
+
+    def acquire(self, timeout):
+        if not self.slots.acquire(timeout=timeout):
+            raise LLMUnavailable(f"connection pool to {self.host} exhausted")
+        with self.lock:
+            self.in_use+=1
+        try:
+            return self.idle.get_nowait(), True
+        except queue.Empty:
+            pass
+        try:
+            return self._connect(), False
+        except Exception:
+            self._release_slot()
+            raise
+
+    def release(self, conn, reusable):
+        if reusable:
+            self.idle.put(conn)
+        else:
+            conn.close()
+        self._release_slot()
+
+    def _release_slot(self):
+        with self.lock:
+            self.in_use-=1
+        self.slots.release()
+
+    def stats(self):
+        with self.lock:
+            return {"host": self.host, "port": self.port, "size": self.size,
+                    "in_use": self.in_use, "idle": self.idle.qsize(), "created": self.created}
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class LLMClient:
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, retries=None, backoff=None):
+        env=os.environ.get
+        self.pool_size=pool_size or int(env("LLM_POOL_SIZE","8"))
+        self.connect_timeout=connect_timeout or float(env("LLM_CONNECT_TIMEOUT","5"))
+        self.read_timeout=read_timeout or float(env("LLM_READ_TIMEOUT","60"))
+        self.retries=int(env("LLM_RETRIES","2")) if retries is None else retries
+        self.backoff=backoff or float(env("LLM_BACKOFF","0.3"))
+        self.pools={}
+        self.lock=threading.Lock()
+        self.counters={"requests":0, "retries":0, "failures":0}
+
+    def _pool(self, scheme, host, port):
+        key=(scheme, host, port)
+        with self.lock:
+            pool=self.pools.get(key)
+            if pool is None:
+                pool=_HostPool(scheme, host, port, self.pool_size, self.connect_timeout, self.read_timeout)
+                self.pools[key]=pool
+            return pool
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name]+=1
+
+    def _sleep(self, attempt):
+        # 指数退避 + 抖动，避免重试请求同时打到上游
+        time.sleep(self.backoff*(2**attempt)*random.uniform(0.5, 1.5))
+
+    def post(self, url, body, headers=None):
+        # 等待响应头（含重试）计入 llm，读取响应体（流式生成）由 LLMResponse.close 计入 llm_body
+        with metrics.timed("llm"):
+            return self._post(url, body, headers)
+
+    def _post(self, url, body, headers=None):
+        parts=urlsplit(url)
+        scheme=parts.scheme or "https"
+        port=parts.port or (443 if scheme=="https" else 80)
+        pool=self._pool(scheme, parts.hostname, port)
+        path=parts.path+("?"+parts.query if parts.query else "")
+        hdrs={"User-Agent":"simple-neo4j/1.0"}
+        hdrs.update(headers or {})
+        self._count("requests")
+        attempt=0
+        last=None
+        while True:
+            try:
+                conn, reused=pool.acquire(self.connect_timeout+self.read_timeout)
+            except LLMUnavailable:
+                self._count("failures")
+                raise
+            except OSError as e:
+                conn, reused, last=None, False, e
+            if conn is not None:
+                try:
+                    conn.request("POST", path, body=body, headers=hdrs)
+                    resp=conn.getresponse()
+                except (OSError, http.client.HTTPException) as e:
+                    pool.release(conn, False)
+                    last=e
+                    if reused:
+                        # 空闲连接可能已被上游关闭，立即换新连接重试，不计入重试次数
+                        continue
+                else:
+                    if resp.status not in RETRY_STATUSES or attempt>=self.retries:
+                        return LLMResponse(pool, conn, resp)
+                    resp.read()
+                    pool.release(conn, not resp.will_close)
+                    last=LLMUnavailable(f"upstream returned HTTP {resp.status}")
+            if attempt>=self.retries:
+                self._count("failures")
+                raise LLMUnavailable(str(last))
+            self._count("retries")
+            self._sleep(attempt)
+            attempt+=1
+
+    def chat_completion(self, messages, model, base_url, api_key, stream=False, **params):
+        payload={"model": model, "messages": messages, "enable_thinking": False}
+        payload.update(params)
+        payload["stream"]=stream
+        headers={
+            "Content-Type":"application/json",
+            "Accept":"text/event-stream" if stream else "application/json",
+            "Authorization":"Bearer "+api_key,
+        }
+        return self.post(base_url.rstrip("/")+"/chat/completions", json.dumps(payload).encode("utf-8"), headers)
+
+    def complete(self, messages, model, base_url, api_key, **params):
+        """Non-streaming chat completion; returns the message content or raises."""
+        with self.chat_completion(messages, model, base_url, api_key, **params) as resp:
+            data=resp.read()
+            status=resp.status
+        try:
+            j=json.loads(data.decode("utf-8"))
+        except Exception:
+            raise LLMUnavailable(f"invalid upstream response (HTTP {status})")
+        if status>=400 or (isinstance(j, dict) and j.get("error")):
+            err=j.get("error") if isinstance(j, dict) else None
+            msg=err.get("message") if isinstance(err, dict) else err
+            raise LLMUnavailable(str(msg or f"HTTP {status}"))
+        return str((j.get("choices") or [{}])[0].get("message",{}).get("content") or "")
+
+    def embed(self, texts, model, base_url, api_key):
+        """OpenAI-compatible /embeddings; returns one vector per text, in input order."""
+        payload={"model": model, "input": list(texts), "encoding_format": "float"}
+        headers={"Content-Type":"application/json", "Accept":"application/json", "Authorization":"Bearer "+api_key}
+        with self.post(base_url.rstrip("/")+"/embeddings", json.dumps(payload).encode("utf-8"), headers) as resp:
+            data=resp.read()
+            status=resp.status
+        try:
+            j=json.loads(data.decode("utf-8"))
+        except Exception:
+            raise LLMUnavailable(f"invalid upstream response (HTTP {status})")
+        if status>=400 or not isinstance(j, dict) or j.get("error") or not isinstance(j.get("data"), list):
+            err=j.get("error") if isinstance(j, dict) else None
+            msg=err.get("message") if isinstance(err, dict) else err
+            raise LLMUnavailable(str(msg or f"HTTP {status}"))
+        rows=sorted(j["data"], key=lambda d: d.get("index", 0))
+        if len(rows)!=len(texts):
+            raise LLMUnavailable(f"upstream returned {len(rows)} embeddings for {len(texts)} inputs")
+        return [r["embedding"] for r in rows]
+
+    def stats(self):
+        with self.lock:
+            out=dict(self.counters)
+            pools=list(self.pools.values())
+        out["pools"]=[p.stats() for p in pools]
+        return out
+
+    def close(self):
+        with self.lock:
+            pools=list(self.pools.values())
+        for p in pools:
+            p.close()
+
+_client=None
+_client_lock=threading.Lock()
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client=LLMClient()
+        return _client
@@ -0,0 +1,187 @@
+"""
+Load test for api_llm.py.
+
+Runs the backend in-process against a local stub LLM (OpenAI-compatible
+/chat/completions with a fixed delay) and a stub Neo4j driver (fixed query
+delay), then drives a mix of /question and /llm requests from concurrent
+clients and reports throughput and latency for each server mode.
+
+/llm questions are unique by default, so llm_p50/p95 measure the upstream
+path; --llm-questions N draws from N distinct questions instead, and answers
+served from the answer cache are reported separately (llm_cached).
+
+    python loadtest.py --clients 20 --duration 10 --llm-delay 2 --llm-ratio 0.2
+"""
+import os
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+import http.client
+from types import SimpleNamespace
+
+import api_llm
+import fake_llm_server
+
+# Stub Neo4j
+class _StubNode:
+    def __init__(self, i):
+        self.element_id=f"4:stub:{i}"
+        self._properties={"qid":f"q{i}","content":"stub question","type":"single","options":["A","B"],"difficulty":"easy"}
+
+# 素养 -> 子维度 -> 内容模块，供 concept_index 构建字典和路径表
+_STUB_GRAPH=[("计算思维", "抽象与建模"), ("计算思维", "算法设计"), ("抽象与建模", "数据结构"), ("算法设计", "算法"), ("算法设计", "程序设计")]
+
+class _StubResult:
+    def __init__(self, rows):
+        self.rows=rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def single(self):
+        return self.rows[0] if self.rows else None
+
+    def data(self):
+        return self.rows
+
+class _StubSession:
+    delay=0.005
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, cypher, params=None):
+        time.sleep(self.delay)
+        if "RETURN q" in cypher:
+            return _StubResult([{"q":_StubNode(random.randint(1,1000))}])
+        if "AS src_name" in cypher:
+            return _StubResult([{"src":f"n:{a}", "src_name":a, "dst":f"n:{b}", "dst_name":b} for a, b in _STUB_GRAPH])
+        if "MATCH (root:CoreLiteracy)" in cypher:
+            return _StubResult([{"id":"n:计算思维", "name":"计算思维"}])
+        if "n:CoreLiteracy OR" in cypher:
+            names=dict.fromkeys(n for edge in _STUB_GRAPH for n in edge)
+            return _StubResult([{"id":f"n:{n}", "name":n} for n in names])
+        return _StubResult([])
+
+class _StubDriver:
+    def session(self, **kwargs):
+        return _StubSession()
+
+    def close(self):
+        pass
+
+class _StubGraphDatabase:
+    @staticmethod
+    def driver(uri, auth=None, **kwargs):
+        return _StubDriver()
+
+def _serve(srv):
+    t=threading.Thread(target=srv.serve_forever, daemon=True)
+    t.start()
+    return t
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values=sorted(values)
+    return values[min(len(values)-1, int(len(values)*p))]
+
+def run_mode(mode, args):
+    os.environ["LLM_SERVER_MODE"]=mode
+    srv=api_llm.make_server("127.0.0.1", 0)
+    _serve(srv)
+    port=srv.server_address[1]
+    lat={"graph":[], "llm":[], "llm_cached":[]}
+    errors=[0]
+    seq=itertools.count()
+    lock=threading.Lock()
+    deadline=time.time()+args.duration
+
+    def client():
+        conn=http.client.HTTPConnection("127.0.0.1", port, timeout=args.llm_delay*20+30)
+        while time.time()<deadline:
+            kind="llm" if random.random()<args.llm_ratio else "graph"
+            t0=time.perf_counter()
+            try:
+                if kind=="llm":
+                    # 默认每个问题都不同，避免全部命中回答缓存
+                    n=random.randrange(args.llm_questions) if args.llm_questions else next(seq)
+                    body=json.dumps({"question":f"什么是算法（第{n}题）","evidence":[]})
+                    conn.request("POST","/llm",body=body,headers={"Content-Type":"application/json"})
+                else:
+                    conn.request("GET","/question?module_name=%E7%AE%97%E6%B3%95")
+                resp=conn.getresponse()
+                data=resp.read()
+                ok=resp.status==200
+                if ok and kind=="llm" and json.loads(data).get("cached"):
+                    kind="llm_cached"
+            except Exception:
+                conn.close()
+                ok=False
+            dt=time.perf_counter()-t0
+            with lock:
+                if ok:
+                    lat[kind].append(dt)
+                else:
+                    errors[0]+=1
+        conn.close()
+
+    threads=[threading.Thread(target=client) for _ in range(args.clients)]
+    t0=time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed=time.perf_counter()-t0
+    srv.shutdown()
+    srv.server_close()
+    total=sum(len(v) for v in lat.values())
+    return {
+        "mode": mode,
+        "requests": total,
+        "errors": errors[0],
+        "rps": round(total/elapsed, 1),
+        "graph_p50_ms": round(_percentile(lat["graph"],0.5)*1000, 1),
+        "graph_p95_ms": round(_percentile(lat["graph"],0.95)*1000, 1),
+        "llm_p50_ms": round(_percentile(lat["llm"],0.5)*1000, 1),
+        "llm_p95_ms": round(_percentile(lat["llm"],0.95)*1000, 1),
+        "llm_cached": len(lat["llm_cached"]),
+        "cached_p50_ms": round(_percentile(lat["llm_cached"],0.5)*1000, 1),
+    }
+
+def main():
+    ap=argparse.ArgumentParser(description="Load test api_llm against stub LLM and Neo4j backends")
+    ap.add_argument("--clients", type=int, default=20)
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--llm-delay", type=float, default=1.0, help="stub LLM latency in seconds")
+    ap.add_argument("--graph-delay", type=float, default=0.005, help="stub Neo4j query latency in seconds")
+    ap.add_argument("--llm-ratio", type=float, default=0.2, help="fraction of requests sent to /llm")
+    ap.add_argument("--llm-questions", type=int, default=0, help="distinct /llm questions (0: every question is new)")
+    ap.add_argument("--modes", default="single,threaded")
+    args=ap.parse_args()
+
+    _StubSession.delay=args.graph_delay
+    llm_srv=fake_llm_server.make_server("127.0.0.1", 0, delay=args.llm_delay)
+    _serve(llm_srv)
+    llm_port=llm_srv.server_address[1]
+
+    os.environ["MS_BASE_URL"]=f"http://127.0.0.1:{llm_port}/v1"
+    os.environ["MS_API_KEY"]="stub"
+    api_llm.neo4j=SimpleNamespace(GraphDatabase=_StubGraphDatabase)
+    api_llm.Handler.log_message=lambda self, *args: None
+
+    results=[run_mode(m.strip(), args) for m in args.modes.split(",") if m.strip()]
+    llm_srv.shutdown()
+    cols=["mode","requests","errors","rps","graph_p50_ms","graph_p95_ms","llm_p50_ms","llm_p95_ms","llm_cached","cached_p50_ms"]
+    print("  ".join(f"{c:>12}" for c in cols))
+    for r in results:
+        print("  ".join(f"{str(r[c]):>12}" for c in cols))
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Per-learner mastery state.
+
+Each learner holds three bitsets over dense ids: questions answered,
+questions answered correctly (last answer wins), and concepts mastered
+(ZPD). Question/concept keys are interned once in a process-wide registry,
+so a learner costs a few Python ints regardless of graph size. Learners are
+identified by any hashable key; api_llm uses (Neo4j database, session_id),
+because question and concept keys are only unique within one database.
+
+The store only lives in memory; api_llm writes every change write-behind to
+MySQL learning_logs (concept mastery as question_id "concept:<id>" rows), and
+a learner evicted from the LRU or lost on restart is rebuilt from those rows
+on next access through the `loader` callback. When the loader cannot read the
+log it raises; that request then works on an empty state that is not kept,
+so the learner is loaded again on a later access instead of being reset.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+CONCEPT_PREFIX="concept:"
+
+class LoadUnavailable(Exception):
+    """Raised by a loader when the learning log cannot be read right now."""
+
+class _Interner:
+    def __init__(self):
+        self.ids={}
+        self.keys=[]
+
+    def get(self, key):
+        i=self.ids.get(key)
+        if i is None:
+            i=self.ids[key]=len(self.keys)
+            self.keys.append(key)
+        return i
+
+    def find(self, key):
+        return self.ids.get(key)
+
+    def expand(self, bits):
+        out=[]
+        while bits:
+            low=bits & -bits
+            out.append(self.keys[low.bit_length() - 1])
+            bits^=low
+        return out
+
+class LearnerState:
+    __slots__=("answered", "correct", "mastered", "last_seen")
+
+    def __init__(self):
+        self.answered=0
+        self.correct=0
+        self.mastered=0
+        self.last_seen=time.time()
+
+class MasteryStore:
+    def __init__(self, loader=None, max_learners=None):
+        self.loader=loader
+        self.max_learners=max_learners or int(os.environ.get("MASTERY_MAX_LEARNERS","10000"))
+        self.questions=_Interner()
+        self.concepts=_Interner()
+        self.learners=OrderedDict()
+        self.lock=threading.Lock()
+        self.counters={"answers":0, "mastered":0, "loads":0, "load_errors":0, "evictions":0}
+
+    # Learner lifecycle
+    def _learner(self, session_id):
+        """State for session_id, loading it from the log on first use (call without the lock)."""
+        with self.lock:
+            state=self.learners.get(session_id)
+            if state is not None:
+                self.learners.move_to_end(session_id)
+                state.last_seen=time.time()
+                return state
+        rows=[]
+        if self.loader:
+            try:
+                rows=self.loader(session_id) or []
+                self._count("loads")
+            except Exception as e:
+                self._count("load_errors")
+                if not isinstance(e, LoadUnavailable):
+                    print(f"Mastery load error for {session_id}: {e}")
+                # 未加载成功的状态不缓存，下次访问重新加载
+                return LearnerState()
+        with self.lock:
+            state=self.learners.get(session_id)
+            if state is None:
+                state=LearnerState()
+                for key, ok in rows:
+                    self._apply(state, key, ok)
+                self.learners[session_id]=state
+                while len(self.learners) > self.max_learners:
+                    self.learners.popitem(last=False)
+                    self.counters["evictions"]+=1
+            return state
+
+    def _apply(self, state, key, ok):
+        key=str(key)
+        if key.startswith(CONCEPT_PREFIX):
+            bit=1 << self.concepts.get(key[len(CONCEPT_PREFIX):])
+            state.mastered=state.mastered | bit if ok else state.mastered & ~bit
+            return
+        bit=1 << self.questions.get(key)
+        state.answered|=bit
+        state.correct=state.correct | bit if ok else state.correct & ~bit
+
+    def _count(self, name, n=1):
+        with self.lock:
+            self.counters[name]+=n
+
+    # Writes
+    def record_answers(self, session_id, results):
+        """results: iterable of (question key, is_correct)."""
+        state=self._learner(session_id)
+        n=0
+        with self.lock:
+            for key, ok in results:
+                self._apply(state, key, bool(ok))
+                n+=1
+            self.counters["answers"]+=n
+
+    def mark_mastered(self, session_id, concept_ids):
+        state=self._learner(session_id)
+        with self.lock:
+            for cid in concept_ids:
+                state.mastered|=1 << self.concepts.get(str(cid))
+            self.counters["mastered"]+=len(concept_ids)
+
+    # Reads
+    def correct_questions(self, session_id):
+        state=self._learner(session_id)
+        with self.lock:
+            return self.questions.expand(state.correct)
+
+    def answered_questions(self, session_id):
+        state=self._learner(session_id)
+        with self.lock:
+            return self.questions.expand(state.answered)
+
+    def mastered(self, session_id):
+        state=self._learner(session_id)
+        with self.lock:
+            return set(self.concepts.expand(state.mastered))
+
+    def stats(self):
+        with self.lock:
+            out=dict(self.counters)
+            out["learners"]=len(self.learners)
+            out["questions"]=len(self.questions.keys)
+            out["concepts"]=len(self.concepts.keys)
+        return out
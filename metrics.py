@@ -0,0 +1,175 @@
+"""
+Process-wide metrics in the Prometheus text exposition format.
+
+Counters and histograms are plain dicts keyed by label values behind one
+lock; anything already tracked elsewhere (pool stats, cache counters, the
+indexing queue) is exported through collector callbacks at scrape time
+instead of being counted twice. Time spent in a dependency (Neo4j, MySQL,
+the upstream LLM) is recorded with `timed()`: every call feeds the global
+dependency histogram, and calls made on a request thread between
+`begin_request()` and `end_request()` are also summed per request so the
+handler can attribute them to its route. Timed calls also appear as spans
+in the request's trace (see tracing.py).
+"""
+import time
+import threading
+
+import tracing
+
+DEFAULT_BUCKETS=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock=threading.Lock()
+_metrics=[]
+_collectors=[]
+_local=threading.local()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=None):
+    pairs=list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{"+",".join(f'{k}="{_escape(v)}"' for k, v in pairs)+"}"
+
+def _num(v):
+    if v==float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+class Counter:
+    kind="counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name=name
+        self.help=help
+        self.labels=tuple(labels)
+        self.values={}
+
+    def inc(self, *labels, n=1):
+        with _lock:
+            self.values[labels]=self.values.get(labels, 0)+n
+
+    def render(self):
+        with _lock:
+            items=sorted(self.values.items())
+        return [f"{self.name}{_labels(self.labels, k)} {_num(v)}" for k, v in items]
+
+class Histogram:
+    kind="histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name=name
+        self.help=help
+        self.labels=tuple(labels)
+        self.buckets=tuple(sorted(buckets))
+        self.values={}   # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        with _lock:
+            row=self.values.get(labels)
+            if row is None:
+                row=self.values[labels]=[0]*(len(self.buckets)+2)
+            for i, bound in enumerate(self.buckets):
+                if value<=bound:
+                    row[i]+=1
+                    break
+            row[-2]+=value
+            row[-1]+=1
+
+    def render(self):
+        with _lock:
+            items=sorted((k, list(v)) for k, v in self.values.items())
+        out=[]
+        for k, row in items:
+            cum=0
+            for bound, n in zip(self.buckets, row):
+                cum+=n
+                out.append(f"{self.name}_bucket{_labels(self.labels, k, ('le', _num(float(bound))))} {cum}")
+            out.append(f"{self.name}_bucket{_labels(self.labels, k, ('le', '+Inf'))} {row[-1]}")
+            out.append(f"{self.name}_sum{_labels(self.labels, k)} {_num(round(row[-2], 6))}")
+            out.append(f"{self.name}_count{_labels(self.labels, k)} {row[-1]}")
+        return out
+
+def counter(name, help, labels=()):
+    m=Counter(name, help, labels)
+    with _lock:
+        _metrics.append(m)
+    return m
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    m=Histogram(name, help, labels, buckets)
+    with _lock:
+        _metrics.append(m)
+    return m
+
+def add_collector(fn):
+    """fn() -> [(name, kind, help, [(labels dict, value), ...]), ...], called on every scrape."""
+    with _lock:
+        _collectors.append(fn)
+
+DEPENDENCY_SECONDS=histogram("dependency_call_seconds", "Duration of individual calls to a backend dependency", ("dependency",))
+DEGRADED=counter("degraded_total", "Requests served by a fallback path", ("kind",))
+
+# Per-request dependency time
+def begin_request():
+    _local.deps={}
+
+def end_request():
+    deps=getattr(_local, "deps", None)
+    _local.deps=None
+    return deps or {}
+
+def add_time(dependency, seconds):
+    DEPENDENCY_SECONDS.observe(seconds, dependency)
+    deps=getattr(_local, "deps", None)
+    if deps is not None:
+        deps[dependency]=deps.get(dependency, 0.0)+seconds
+
+class timed:
+    """Time a dependency call; inside a traced request it is also recorded as a span."""
+    def __init__(self, dependency):
+        self.dependency=dependency
+        self.span=tracing.span(dependency)
+
+    def __enter__(self):
+        self.span.__enter__()
+        self.t0=time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        add_time(self.dependency, time.perf_counter()-self.t0)
+        self.span.__exit__(*exc)
+        return False
+
+def degraded(kind):
+    DEGRADED.inc(kind)
+    tracing.annotate(degraded=kind)
+
+def render():
+    with _lock:
+        metrics=list(_metrics)
+        collectors=list(_collectors)
+    lines=[]
+    for m in metrics:
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines.extend(m.render())
+    for fn in collectors:
+        try:
+            families=fn() or []
+        except Exception as e:
+            print(f"Metrics collector error: {e}")
+            continue
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_num(value)}")
+    return ("\n".join(lines)+"\n").encode("utf-8")
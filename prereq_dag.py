@@ -0,0 +1,255 @@
+"""
+In-process PREREQUISITE graph for ZPD unlocking and next-concept recommendation.
+
+The PREREQUISITE edges of one database are loaded into a CSR adjacency
+(offsets/targets arrays over dense integer node ids) with in-degrees and a
+precomputed topological rank. Each learner keeps sparse "prerequisites
+satisfied" counters plus the set of unlocked-but-unmastered nodes, so marking
+a concept mastered unlocks successors in O(out-degree) with no Neo4j round
+trip. Mastery itself stays in mastery_store; learner counters are rebuilt
+from it whenever the snapshot is replaced. Snapshots refresh in the
+background after a TTL, or sooner when a node missing from the snapshot is
+seen.
+"""
+import os
+import time
+import heapq
+import threading
+from array import array
+from collections import deque, OrderedDict
+
+class PrereqDAG:
+    """Immutable CSR snapshot of the PREREQUISITE graph."""
+    def __init__(self, names, edges):
+        self.keys=list(names)
+        self.ids={k: i for i, k in enumerate(self.keys)}
+        self.names=[names[k] for k in self.keys]
+        pairs=set()
+        for src, dst in edges:
+            for k in (src, dst):
+                if k not in self.ids:
+                    self.ids[k]=len(self.keys)
+                    self.keys.append(k)
+                    self.names.append("")
+            if src!=dst:
+                pairs.add((self.ids[src], self.ids[dst]))
+        n=len(self.keys)
+        self.offsets=array("I", bytes(4*(n+1)))
+        self.indeg=array("I", bytes(4*n))
+        for src, dst in pairs:
+            self.offsets[src+1]+=1
+            self.indeg[dst]+=1
+        for i in range(n):
+            self.offsets[i+1]+=self.offsets[i]
+        self.targets=array("I", bytes(4*len(pairs)))
+        fill=array("I", self.offsets[:n])
+        for src, dst in sorted(pairs):
+            self.targets[fill[src]]=dst
+            fill[src]+=1
+        self.rank=self._topo_rank(n)
+        self.roots=[i for i in range(n) if not self.indeg[i]]
+        self.built_at=time.time()
+
+    def _topo_rank(self, n):
+        # Kahn 拓扑排序；环上的节点无法排序，按 id 排在最后，不影响解锁计数
+        indeg=array("I", self.indeg)
+        q=deque(i for i in range(n) if not indeg[i])
+        rank=array("I", bytes(4*n))
+        seen=bytearray(n)
+        r=0
+        while q:
+            i=q.popleft()
+            rank[i]=r
+            seen[i]=1
+            r+=1
+            for j in self.successors(i):
+                indeg[j]-=1
+                if not indeg[j]:
+                    q.append(j)
+        for i in range(n):
+            if not seen[i]:
+                rank[i]=r
+                r+=1
+        return rank
+
+    def successors(self, i):
+        return self.targets[self.offsets[i]:self.offsets[i+1]]
+
+    def __len__(self):
+        return len(self.keys)
+
+class LearnerFrontier:
+    """Per-learner counters against one snapshot."""
+    __slots__=("dag", "satisfied", "mastered", "frontier")
+
+    def __init__(self, dag, mastered_keys=()):
+        self.dag=dag
+        self.satisfied={}   # node -> mastered prerequisites (only touched nodes)
+        self.mastered=set()
+        self.frontier=set(dag.roots)
+        for key in mastered_keys:
+            i=dag.ids.get(key)
+            if i is not None:
+                self.mark(i)
+
+    def mark(self, i):
+        """Mark node i mastered; returns the successors it unlocks."""
+        if i in self.mastered:
+            return []
+        dag=self.dag
+        self.mastered.add(i)
+        self.frontier.discard(i)
+        unlocked=[]
+        for j in dag.successors(i):
+            n=self.satisfied.get(j, 0)+1
+            self.satisfied[j]=n
+            if n==dag.indeg[j] and j not in self.mastered:
+                self.frontier.add(j)
+                unlocked.append(j)
+        return unlocked
+
+    def next(self, k):
+        rank=self.dag.rank
+        return heapq.nsmallest(k, self.frontier, key=rank.__getitem__)
+
+class PrereqEngine:
+    """Current PrereqDAG of one database plus learner frontiers; refreshed off the request path."""
+    def __init__(self, loader, mastered_source, ttl=None, max_learners=None):
+        self.loader=loader
+        self.mastered_source=mastered_source
+        self.ttl=float(os.environ.get("PREREQ_DAG_TTL","60")) if ttl is None else ttl
+        self.max_learners=max_learners or int(os.environ.get("MASTERY_MAX_LEARNERS","10000"))
+        self.dag=None
+        self.learners=OrderedDict()
+        self.lock=threading.Lock()
+        self.build_lock=threading.Lock()
+        self.refreshing=False
+        self.stale=False
+        self.failed_at=0.0
+        self.last_build_ms=0.0
+        self.counters={"marks":0, "unlocked":0, "recommends":0, "unknown_nodes":0, "builds":0, "build_errors":0}
+
+    # Snapshot lifecycle (同 concept_index.CompetencyIndex)
+    def _build(self):
+        t0=time.perf_counter()
+        try:
+            names, edges=self.loader()
+            dag=PrereqDAG(names, edges)
+        except Exception as e:
+            with self.lock:
+                self.counters["build_errors"]+=1
+                self.refreshing=False
+                self.failed_at=time.time()
+            print(f"Prerequisite DAG build error: {e}")
+            return None
+        with self.lock:
+            self.dag=dag
+            self.stale=False
+            self.refreshing=False
+            self.counters["builds"]+=1
+            self.last_build_ms=round((time.perf_counter()-t0)*1000, 1)
+        return dag
+
+    def _refresh_async(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing=True
+        threading.Thread(target=self._build, name="prereq-dag", daemon=True).start()
+
+    def get(self):
+        dag=self.dag
+        if dag is None:
+            if time.time()-self.failed_at<30:
+                return None
+            with self.build_lock:
+                if self.dag is None:
+                    self._build()
+            return self.dag
+        # 快照过期或见到快照外的节点时后台重建；未知节点至少间隔 5 秒才触发一次
+        age=time.time()-dag.built_at
+        if age>self.ttl or (self.stale and age>5):
+            self._refresh_async()
+        return dag
+
+    def invalidate(self):
+        with self.lock:
+            self.stale=True
+
+    # Learners
+    def _frontier(self, dag, session_id):
+        """(state, fresh) for the current snapshot; mastery is read outside the lock."""
+        with self.lock:
+            state=self.learners.get(session_id)
+            if state is not None and state.dag is dag:
+                self.learners.move_to_end(session_id)
+                return state, False
+        state=LearnerFrontier(dag, self.mastered_source(session_id) if session_id else ())
+        with self.lock:
+            current=self.learners.get(session_id)
+            if current is not None and current.dag is dag:
+                return current, False
+            self.learners[session_id]=state
+            self.learners.move_to_end(session_id)
+            while len(self.learners)>self.max_learners:
+                self.learners.popitem(last=False)
+        return state, True
+
+    def mark(self, session_id, node_keys, already=()):
+        """Mark concepts mastered for a learner; returns newly unlocked node keys, or None without a snapshot.
+
+        mastery_store must already contain node_keys: a learner rebuilt from
+        it here already counts them, so the unlocked successors are read off
+        the fresh frontier instead of from the marks. `already` is what the
+        learner had mastered before this call; re-marking one of those
+        unlocks nothing.
+        """
+        dag=self.get()
+        if dag is None:
+            return None
+        ids=[dag.ids.get(k) for k in node_keys]
+        unknown=sum(1 for i in ids if i is None)
+        state, fresh=self._frontier(dag, session_id)
+        unlocked=[]
+        with self.lock:
+            if fresh:
+                for i in set(i for i, k in zip(ids, node_keys) if i is not None and k not in already):
+                    for j in dag.successors(i):
+                        if j in state.frontier and j not in unlocked:
+                            unlocked.append(j)
+            else:
+                for i in ids:
+                    if i is not None:
+                        unlocked.extend(state.mark(i))
+            self.counters["marks"]+=len(node_keys)
+            self.counters["unlocked"]+=len(unlocked)
+            self.counters["unknown_nodes"]+=unknown
+        if unknown:
+            self.invalidate()
+        return [dag.keys[j] for j in unlocked]
+
+    def recommend(self, session_id, k=5):
+        """Next concepts in topological order among those whose prerequisites are all mastered."""
+        dag=self.get()
+        if dag is None:
+            return None
+        state, _=self._frontier(dag, session_id)
+        with self.lock:
+            picked=state.next(k)
+            self.counters["recommends"]+=1
+        return [{"id": dag.keys[i], "name": dag.names[i], "rank": dag.rank[i]} for i in picked]
+
+    def forget(self, session_id):
+        with self.lock:
+            self.learners.pop(session_id, None)
+
+    def stats(self):
+        dag=self.dag
+        with self.lock:
+            out=dict(self.counters)
+            out["learners"]=len(self.learners)
+        out["nodes"]=len(dag) if dag else 0
+        out["edges"]=len(dag.targets) if dag else 0
+        out["last_build_ms"]=self.last_build_ms
+        out["age"]=round(time.time()-dag.built_at, 1) if dag else None
+        return out
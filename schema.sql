@@ -27,6 +27,8 @@ CREATE TABLE IF NOT EXISTS learning_logs (
     user_id INT,
     question_id VARCHAR(100),
     is_correct BOOLEAN,
+    db_name VARCHAR(64),
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_learning_logs_session (session_id, id),
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
 );
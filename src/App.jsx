@@ -27,33 +27,48 @@ export default function App() {
   // Background Tasks
   const [tasks, setTasks] = useState([]);
 
-  // Poll for task updates
+  // Task updates are pushed over one /task_events stream for all active tasks
+  const activeTaskIds = tasks
+      .filter(t => ['queued', 'running', 'cancelling'].includes(t.status))
+      .map(t => t.id)
+      .join(',');
+
   useEffect(() => {
-    if (tasks.length === 0) return;
-
-    const activeTasks = tasks.filter(t => ['queued', 'running', 'cancelling'].includes(t.status));
-    if (activeTasks.length === 0) return;
-
-    const interval = setInterval(async () => {
-        const updatedTasks = await Promise.all(tasks.map(async (task) => {
-            if (['completed', 'failed', 'cancelled'].includes(task.status)) return task;
-            
-            try {
-                const res = await fetch(`/task_status?task_id=${task.id}`);
-                if (res.ok) {
-                    const status = await res.json();
-                    return { ...task, ...status, id: task.id }; // Merge status
+    if (!activeTaskIds) return;
+
+    const mergeTask = (status) => {
+        setTasks(prev => prev.map(t => t.id === status.id ? { ...t, ...status } : t));
+    };
+
+    let pollTimer = null;
+    const source = new EventSource(`/task_events?task_ids=${encodeURIComponent(activeTaskIds)}&stream=1`);
+    source.addEventListener('task', (e) => mergeTask(JSON.parse(e.data)));
+    source.addEventListener('missing', (e) => {
+        const { id } = JSON.parse(e.data);
+        mergeTask({ id, status: 'failed', message: '任务不存在或记录已过期' });
+    });
+    source.addEventListener('end', () => source.close());
+    source.onerror = () => {
+        // EventSource reconnects by itself (resuming from Last-Event-ID); only when the
+        // server refused the stream (e.g. 503 when busy) fall back to polling /task_status
+        if (source.readyState !== EventSource.CLOSED || pollTimer) return;
+        pollTimer = setInterval(async () => {
+            for (const taskId of activeTaskIds.split(',')) {
+                try {
+                    const res = await fetch(`/task_status?task_id=${taskId}`);
+                    if (res.ok) mergeTask({ ...(await res.json()), id: taskId });
+                } catch (e) {
+                    console.error("Poll failed", e);
                 }
-            } catch (e) {
-                console.error("Poll failed", e);
             }
-            return task;
-        }));
-        setTasks(updatedTasks);
-    }, 1000);
+        }, 2000);
+    };
 
-    return () => clearInterval(interval);
-  }, [tasks]);
+    return () => {
+        source.close();
+        if (pollTimer) clearInterval(pollTimer);
+    };
+  }, [activeTaskIds]);
 
   const handleTaskStart = (taskId, filename) => {
       setTasks(prev => [...prev, { id: taskId, filename, status: 'queued', message: 'Starting...' }]);
@@ -73,6 +88,22 @@ export default function App() {
       }
   };
 
+  const handleResumeTask = async (taskId) => {
+      try {
+          const res = await fetch('/resume_task', {
+              method: 'POST',
+              headers: { 'Content-Type': 'application/json' },
+              body: JSON.stringify({ task_id: taskId })
+          });
+          if (res.ok) {
+              // Back to 'queued' so polling picks it up again
+              setTasks(prev => prev.map(t => t.id === taskId ? { ...t, status: 'queued', resumable: false, error: null, message: 'Queued to resume' } : t));
+          }
+      } catch (e) {
+          console.error("Resume failed", e);
+      }
+  };
+
   const handleClearTask = (taskId) => {
       setTasks(prev => prev.filter(t => t.id !== taskId));
   };
@@ -299,19 +330,56 @@ export default function App() {
         console.log("Retrieved evidence:", evidence);
       }
       
-      // 2. Call LLM API
-      const response = await fetch('/llm', {
+      // 2. Call LLM API (streamed as server-sent events)
+      const response = await fetch('/llm?stream=1', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           question: text,
           evidence: evidence,
-          session_id: sessionId
+          session_id: sessionId,
+          db_name: currentDb || undefined
         })
       });
-      
-      const data = await response.json();
-      setMessages(prev => [...prev, { role: 'assistant', content: data.answer }]);
+
+      const contentType = response.headers.get('Content-Type') || '';
+      if (!response.body || !contentType.includes('text/event-stream')) {
+        const data = await response.json();
+        setMessages(prev => [...prev, { role: 'assistant', content: data.answer }]);
+        return;
+      }
+
+      // Append tokens to a placeholder assistant message as they arrive
+      let answer = '';
+      setMessages(prev => [...prev, { role: 'assistant', content: '' }]);
+      const updateAnswer = (content) => setMessages(prev => {
+        const next = [...prev];
+        next[next.length - 1] = { role: 'assistant', content };
+        return next;
+      });
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const evt of events) {
+          const isDone = evt.startsWith('event: done');
+          const dataLine = evt.split('\n').find(l => l.startsWith('data:'));
+          if (!dataLine) continue;
+          const data = JSON.parse(dataLine.slice(5));
+          if (isDone) {
+            answer = data.answer || answer;
+          } else if (data.delta) {
+            answer += data.delta;
+            setLoading(false);
+          }
+          updateAnswer(answer);
+        }
+      }
     } catch (err) {
       console.error(err);
       setMessages(prev => [...prev, { role: 'assistant', content: "抱歉，连接 AI 时出现错误。" }]);
@@ -359,6 +427,7 @@ export default function App() {
          <TaskMonitor 
             tasks={tasks} 
             onCancelTask={handleCancelTask} 
+            onResumeTask={handleResumeTask}
             onClearTask={handleClearTask} 
          />
       </div>
@@ -1,9 +1,14 @@
 import React, { useState, useEffect } from 'react';
-import { getSession, createNode, updateNode, deleteNode, createRelation } from '../utils/neo4j';
+import { createNode, updateNode, deleteNode, createRelation } from '../utils/neo4j';
+import { fetchQuestions } from '../utils/api';
+
+const PAGE_SIZE = 30;
+const KB_FIELDS = ['id', 'content', 'type', 'options', 'concept', 'answer', 'analysis'];
 
 export function KnowledgeBase({ currentDb, onTaskStart }) {
     const [questions, setQuestions] = useState([]);
     const [loading, setLoading] = useState(false);
+    const [nextCursor, setNextCursor] = useState(null);
     
     // UI State
     const [showAddQuestion, setShowAddQuestion] = useState(false);
@@ -22,27 +27,12 @@ export function KnowledgeBase({ currentDb, onTaskStart }) {
         if(currentDb) fetchAllQuestions();
     }, [currentDb]);
 
-    async function fetchAllQuestions() {
-        setLoading(true);
+    async function fetchAllQuestions(cursor = null) {
+        setLoading(!cursor);
         try {
-            const { session, driver } = await getSession(currentDb);
-            const res = await session.run(`
-                MATCH (q:Question)
-                OPTIONAL MATCH (m:Concept)<-[:TESTS]-(q)
-                RETURN q, elementId(q) as id, m.name as conceptName
-                ORDER BY q.created_at DESC
-            `);
-            const qs = res.records.map(r => {
-                const props = r.get('q').properties;
-                return { 
-                    ...props, 
-                    id: r.get('id'),
-                    conceptName: r.get('conceptName') 
-                };
-            });
-            setQuestions(qs);
-            await session.close();
-            await driver.close();
+            const page = await fetchQuestions({ db: currentDb, limit: PAGE_SIZE, fields: KB_FIELDS, cursor });
+            setQuestions(prev => cursor ? [...prev, ...page.questions] : page.questions);
+            setNextCursor(page.nextCursor);
         } catch (err) {
             console.error(err);
         } finally {
@@ -89,37 +79,23 @@ export function KnowledgeBase({ currentDb, onTaskStart }) {
         
         setUploading(true);
         try {
-            // Read file as Base64 for binary support
-            const reader = new FileReader();
-            reader.readAsDataURL(file);
-            reader.onload = async () => {
-                const base64Content = reader.result;
-                const res = await fetch('/upload_doc', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ 
-                        file_base64: base64Content,
-                        filename: file.name,
-                        db_name: currentDb 
-                    })
-                });
-                const data = await res.json();
-                if(data.ok) {
-                    onTaskStart && onTaskStart(data.task_id, file.name);
-                    alert("文档已提交后台解析，请关注右下角任务进度。");
-                    setShowUploadModal(false);
-                } else {
-                    alert("上传失败: " + data.error);
-                }
-                setUploading(false);
-            };
-            reader.onerror = () => {
-                alert("文件读取失败");
-                setUploading(false);
-            };
+            // Stream the file as multipart form data (no base64 inflation)
+            const form = new FormData();
+            form.append('db_name', currentDb);
+            form.append('file', file, file.name);
+            const res = await fetch('/upload_file', { method: 'POST', body: form });
+            const data = await res.json().catch(() => ({ error: `HTTP ${res.status}` }));
+            if(data.ok) {
+                onTaskStart && onTaskStart(data.task_id, file.name);
+                alert("文档已提交后台解析，请关注右下角任务进度。");
+                setShowUploadModal(false);
+            } else {
+                alert("上传失败: " + data.error);
+            }
         } catch(err) {
             console.error(err);
             alert("上传出错");
+        } finally {
             setUploading(false);
         }
     }
@@ -299,6 +275,14 @@ export function KnowledgeBase({ currentDb, onTaskStart }) {
                                 </div>
                             </div>
                         ))}
+                        {nextCursor && (
+                            <button
+                                onClick={() => fetchAllQuestions(nextCursor)}
+                                className="w-full py-3 text-sm text-gray-400 bg-white/5 border border-white/10 rounded-xl hover:bg-white/10 transition-colors"
+                            >
+                                加载更多
+                            </button>
+                        )}
                         {questions.length === 0 && !showAddQuestion && (
                             <div className="flex flex-col items-center justify-center py-20 text-gray-500 opacity-50">
                                 <span className="material-symbols-outlined text-6xl mb-4">quiz</span>
@@ -1,9 +1,15 @@
 import React, { useState, useEffect } from 'react';
-import { getSession } from '../utils/neo4j';
+import { fetchQuestions as fetchQuestionPage } from '../utils/api';
+
+const PAGE_SIZE = 30;
+const LIST_FIELDS = ['id', 'content', 'type', 'user_result', 'concept'];
+const QUIZ_FIELDS = ['id', 'content', 'type', 'options', 'concept', 'answer', 'analysis'];
 
 export function LearningProgress({ currentDb, sessionId }) {
     const [questions, setQuestions] = useState([]);
     const [loading, setLoading] = useState(false);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [conceptStats, setConceptStats] = useState([]);
     const [activeQuiz, setActiveQuiz] = useState(false); // If true, we are in Quiz mode
     
     // Quiz State
@@ -16,33 +22,30 @@ export function LearningProgress({ currentDb, sessionId }) {
     const [streak, setStreak] = useState(0);
 
     useEffect(() => {
-        if(currentDb && !activeQuiz) fetchQuestions();
+        if(currentDb && !activeQuiz) {
+            fetchQuestions();
+            fetchConceptStats();
+        }
     }, [currentDb, activeQuiz]);
 
-    async function fetchQuestions() {
-        setLoading(true);
+    async function fetchConceptStats() {
+        // One call for every Concept instead of one /question_stats per concept
         try {
-            const { session, driver } = await getSession(currentDb);
-            const res = await session.run(`
-                MATCH (q:Question)
-                OPTIONAL MATCH (m:Concept)<-[:TESTS]-(q)
-                RETURN q, elementId(q) as id, q.user_result as result, m.name as conceptName
-                ORDER BY q.created_at DESC
-            `);
-            
-            const qs = res.records.map(r => {
-                const props = r.get('q').properties;
-                return {
-                    ...props,
-                    id: r.get('id'),
-                    user_result: r.get('result'),
-                    conceptName: r.get('conceptName')
-                };
-            });
-            
-            setQuestions(qs);
-            await session.close();
-            await driver.close();
+            const res = await fetch(`/question_stats?all=1&db=${encodeURIComponent(currentDb)}&session_id=${encodeURIComponent(sessionId || '')}`);
+            const data = await res.json();
+            setConceptStats((data.concepts || []).filter(c => c.total > 0));
+        } catch (err) {
+            console.error(err);
+        }
+    }
+
+    async function fetchQuestions(cursor = null) {
+        setLoading(!cursor);
+        try {
+            // Only the fields the cards render; answers are fetched when practice starts
+            const page = await fetchQuestionPage({ db: currentDb, session_id: sessionId, limit: PAGE_SIZE, fields: LIST_FIELDS, cursor });
+            setQuestions(prev => cursor ? [...prev, ...page.questions] : page.questions);
+            setNextCursor(page.nextCursor);
         } catch (err) {
             console.error(err);
         } finally {
@@ -50,11 +53,18 @@ export function LearningProgress({ currentDb, sessionId }) {
         }
     }
 
-    function startPractice(question) {
-        setQuizQueue([question]);
+    async function startPractice(question) {
+        let full = question;
+        try {
+            const page = await fetchQuestionPage({ db: currentDb, ids: [question.id], fields: QUIZ_FIELDS, limit: 1 });
+            full = page.questions[0] || question;
+        } catch (err) {
+            console.error(err);
+        }
+        setQuizQueue([full]);
         setActiveQuiz(true);
         setStreak(0);
-        nextQuestion([question]);
+        nextQuestion([full]);
     }
 
     function nextQuestion(queue = quizQueue) {
@@ -96,7 +106,8 @@ export function LearningProgress({ currentDb, sessionId }) {
                 body: JSON.stringify({
                     question_id: currentQuestion.id,
                     is_correct: correct,
-                    session_id: sessionId
+                    session_id: sessionId,
+                    db: currentDb
                 })
             });
         } catch (err) {
@@ -283,6 +294,22 @@ export function LearningProgress({ currentDb, sessionId }) {
                 </div>
             </div>
 
+            {conceptStats.length > 0 && (
+                <div className="flex flex-wrap gap-3 mb-6">
+                    {conceptStats.map(c => (
+                        <div key={c.id} className="px-3 py-2 rounded-xl bg-white/5 border border-white/10 min-w-[10rem]">
+                            <div className="flex justify-between text-xs text-gray-300 mb-1">
+                                <span className="truncate mr-2">{c.name}</span>
+                                <span>{c.mastered}/{c.total}</span>
+                            </div>
+                            <div className="h-1 bg-white/10 rounded overflow-hidden">
+                                <div className="h-full bg-green-500/70" style={{ width: `${Math.round(c.mastered * 100 / c.total)}%` }} />
+                            </div>
+                        </div>
+                    ))}
+                </div>
+            )}
+
             {loading ? (
                 <div className="flex justify-center py-20">
                     <span className="material-symbols-outlined text-4xl animate-spin text-primary">cyclone</span>
@@ -333,6 +360,14 @@ export function LearningProgress({ currentDb, sessionId }) {
                             </button>
                         </div>
                     ))}
+                    {nextCursor && (
+                        <button
+                            onClick={() => fetchQuestions(nextCursor)}
+                            className="col-span-full py-3 text-sm text-gray-400 bg-white/5 border border-white/10 rounded-xl hover:bg-white/10 transition-colors"
+                        >
+                            加载更多
+                        </button>
+                    )}
                     {questions.length === 0 && (
                         <div className="col-span-full text-center py-20 text-gray-500 opacity-50">
                             <span className="material-symbols-outlined text-6xl mb-4">quiz</span>
@@ -1,6 +1,13 @@
 import React, { useState, useEffect } from 'react';
 
-export function TaskMonitor({ tasks, onCancelTask, onClearTask }) {
+function formatEta(seconds) {
+    if (seconds == null) return '';
+    if (seconds < 60) return `${Math.ceil(seconds)} 秒`;
+    if (seconds < 3600) return `${Math.ceil(seconds / 60)} 分钟`;
+    return `${(seconds / 3600).toFixed(1)} 小时`;
+}
+
+export function TaskMonitor({ tasks, onCancelTask, onClearTask, onResumeTask }) {
     if (tasks.length === 0) return null;
 
     return (
@@ -36,6 +43,43 @@ export function TaskMonitor({ tasks, onCancelTask, onClearTask }) {
                         {task.message}
                     </p>
 
+                    {task.status === 'running' && task.pages_total > 1 && !task.chunks_total && (
+                        <div className="h-1 bg-white/10 rounded mb-3 overflow-hidden">
+                            <div
+                                className="h-full bg-primary transition-all"
+                                style={{ width: `${Math.round((task.pages_done || 0) * 100 / task.pages_total)}%` }}
+                            />
+                        </div>
+                    )}
+
+                    {task.chunks_total > 0 && task.status !== 'completed' && (
+                        <div className="mb-3">
+                            <div className="h-1 bg-white/10 rounded overflow-hidden">
+                                <div
+                                    className="h-full bg-primary transition-all"
+                                    style={{ width: `${Math.round((task.chunks_done || 0) * 100 / task.chunks_total)}%` }}
+                                />
+                            </div>
+                            <div className="flex justify-between text-[10px] text-gray-500 mt-1">
+                                <span>分块 {task.chunks_done || 0}/{task.chunks_total}</span>
+                                {task.status === 'running' && task.throughput > 0 && (
+                                    <span>{task.throughput.toFixed(1)} 块/秒 · 剩余约 {formatEta(task.eta_seconds)}</span>
+                                )}
+                            </div>
+                        </div>
+                    )}
+
+                    {task.resumable && (task.status === 'failed' || task.status === 'cancelled') && (
+                        <div className="flex justify-end">
+                            <button
+                                onClick={() => onResumeTask(task.id)}
+                                className="text-xs bg-white/10 hover:bg-primary/20 text-gray-300 hover:text-primary px-2 py-1 rounded transition-colors border border-white/5 hover:border-primary/30"
+                            >
+                                继续任务
+                            </button>
+                        </div>
+                    )}
+
                     {(task.status === 'running' || task.status === 'queued') && (
                         <div className="flex justify-end">
                             <button 
@@ -0,0 +1,18 @@
+// Backend (api_llm.py) helpers
+
+export async function fetchQuestions(params = {}) {
+  const qs = new URLSearchParams();
+  Object.entries(params).forEach(([k, v]) => {
+    if (v === undefined || v === null || v === '') return;
+    qs.set(k, Array.isArray(v) ? v.join(',') : String(v));
+  });
+  // Responses carry an ETag with Cache-Control: no-cache, so the browser revalidates instead of re-downloading.
+  // The server still runs the query for a revalidation; a 304 saves the transfer and re-render only
+  const res = await fetch(`/questions?${qs}`);
+  const data = await res.json();
+  if (data.error) throw new Error(data.error);
+  return {
+    questions: (data.questions || []).map(q => ({ ...q, conceptName: q.concept })),
+    nextCursor: data.next_cursor || null
+  };
+}
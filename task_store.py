@@ -0,0 +1,273 @@
+"""
+Indexing task registry for lightrag_wrapper.
+
+Each task is a TaskRecord with __slots__ for its known fields. Fields that are
+rarely set go into a small `extra` dict. Records support the dict-style
+access the indexing code already uses (task['status'], task.get(...)).
+
+TaskStore owns every record behind one lock. Each change gets a new version
+from a process-wide sequence and wakes /task_events waiters. Queued and
+running tasks always stay in memory. Finished ones are evicted once there are
+more than TASK_KEEP_FINISHED of them, or once they finished more than
+TASK_KEEP_SECONDS ago. Both limits are checked on every change and every
+read, so expired tasks do not linger in a process that runs no more jobs.
+
+With a backend (SQLiteTaskBackend on lightrag_data/jobs.db by default), every
+change is written through. Evicted and pre-restart tasks are then still
+found by get() and list(), and queued work is resumed after a restart.
+Without a backend the store is memory-only.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+class TaskRecord:
+    __slots__ = (
+        "id", "status", "filename", "type", "db_name", "priority", "sha256", "size",
+        "created_at", "updated_at", "started_at", "finished_at", "version",
+        "stage", "message", "error", "pages_done", "pages_total",
+        "chunks_done", "chunks_total", "throughput", "eta_seconds",
+        "dedup_hits", "dedup_misses", "extra",
+    )
+
+    def __init__(self, fields):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.update(fields)
+
+    def __getitem__(self, key):
+        if key in _SLOTS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in _SLOTS:
+            value = getattr(self, key)
+            return default if value is None else value
+        return self.extra.get(key, default) if self.extra else default
+
+    def __setitem__(self, key, value):
+        if key in _SLOTS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def update(self, fields):
+        for k, v in fields.items():
+            self[k] = v
+
+    def to_dict(self):
+        out = {k: getattr(self, k) for k in _SLOTS if getattr(self, k) is not None}
+        if self.extra:
+            out.update(self.extra)
+        return out
+
+_SLOTS = frozenset(TaskRecord.__slots__) - {"extra"}
+
+class SQLiteTaskBackend:
+    """Task records as JSON rows in SQLite; also what survives a restart."""
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, db_name TEXT, "
+            "priority INTEGER, created_at REAL, record TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at, id)")
+        self.conn.commit()
+
+    def save(self, task):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?)",
+                (task['id'], task['status'], task.get('db_name'), task.get('priority', 0),
+                 task.get('created_at'), json.dumps(task))
+            )
+            self.conn.commit()
+
+    def get(self, task_id):
+        with self.lock:
+            row = self.conn.execute("SELECT record FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def pending(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT record FROM jobs WHERE status IN ('queued', 'running', 'cancelling') ORDER BY created_at"
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def list(self, statuses=None, db_name=None, before=None, limit=50):
+        """Newest first; `before` is the (created_at, id) keyset cursor of the previous page."""
+        where, args = [], []
+        if statuses:
+            where.append(f"status IN ({','.join('?' * len(statuses))})")
+            args.extend(statuses)
+        if db_name:
+            where.append("db_name = ?")
+            args.append(db_name)
+        if before:
+            where.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            args.extend([before[0], before[0], before[1]])
+        sql = "SELECT record FROM jobs" + (" WHERE " + " AND ".join(where) if where else "")
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        with self.lock:
+            rows = self.conn.execute(sql, args + [limit]).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+class TaskStore:
+    def __init__(self, backend=None, keep_finished=None, keep_seconds=None):
+        self.backend = backend
+        self.keep_finished = int(keep_finished or os.environ.get("TASK_KEEP_FINISHED", "500"))
+        self.keep_seconds = float(keep_seconds or os.environ.get("TASK_KEEP_SECONDS", "3600"))
+        self.tasks = {}
+        self.finished = OrderedDict()   # task_id -> time it reached a terminal status
+        self.changed = threading.Condition(threading.Lock())
+        # Starts at the current time in ms so a client's since_version stays
+        # older than any change made after a restart
+        self.version = int(time.time() * 1000)
+        self.evictions = 0
+
+    def attach(self, backend):
+        """Persist through `backend` from now on; records already in memory are written to it."""
+        with self.changed:
+            self.backend = backend
+            for task in self.tasks.values():
+                self._save(task)
+
+    def _save(self, task):
+        if self.backend is not None:
+            self.backend.save(task.to_dict())
+
+    def _track(self, task):
+        # 调用方持有锁
+        if task.status in TERMINAL_STATUSES:
+            self.finished[task.id] = time.time()
+            self.finished.move_to_end(task.id)
+        else:
+            self.finished.pop(task.id, None)
+
+    def _evict(self):
+        cutoff = time.time() - self.keep_seconds
+        while self.finished:
+            task_id, at = next(iter(self.finished.items()))
+            if len(self.finished) <= self.keep_finished and at >= cutoff:
+                break
+            self.finished.popitem(last=False)
+            self.tasks.pop(task_id, None)
+            self.evictions += 1
+
+    def add(self, fields):
+        """Register a task (a new one, or one reloaded from the backend); returns its record."""
+        with self.changed:
+            task = self.tasks.get(fields['id'])
+            if task is None:
+                task = self.tasks[fields['id']] = TaskRecord(fields)
+            self._track(task)
+            self._evict()
+            return task
+
+    def load(self, task_id):
+        """In-memory record, pulling it back from the backend if it was evicted."""
+        with self.changed:
+            task = self.tasks.get(task_id)
+        if task is not None or self.backend is None:
+            return task
+        fields = self.backend.get(task_id)
+        return self.add(fields) if fields else None
+
+    def update(self, task_id, fields, expect=None):
+        """Apply fields and persist; returns (status before, record) or (None, None) for an unknown task.
+
+        With `expect`, the fields are applied only while the status is one of
+        those; otherwise nothing changes and (status, None) is returned.
+        """
+        with self.changed:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return None, None
+            before = task.status
+            if expect is not None and before not in expect:
+                return before, None
+            task.update(fields)
+            self.version += 1
+            task.version = self.version
+            task.updated_at = time.time()
+            self._save(task)
+            self._track(task)
+            self._evict()
+            self.changed.notify_all()
+            return before, task
+
+    def get(self, task_id):
+        with self.changed:
+            self._evict()
+            return self.tasks.get(task_id)
+
+    def __contains__(self, task_id):
+        with self.changed:
+            self._evict()
+            return task_id in self.tasks
+
+    def snapshot(self, task_id):
+        """Plain dict copy of a task from memory or the backend, or None."""
+        with self.changed:
+            self._evict()
+            task = self.tasks.get(task_id)
+            if task is not None:
+                return task.to_dict()
+        return self.backend.get(task_id) if self.backend is not None else None
+
+    def wait(self, task_ids, since, timeout):
+        """(version, [dicts of the given tasks changed after `since`]), blocking up to `timeout` for one."""
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while True:
+                changed = [self.tasks[t].to_dict() for t in task_ids
+                           if t in self.tasks and (self.tasks[t].version or 0) > since]
+                remaining = deadline - time.monotonic()
+                if changed or remaining <= 0:
+                    return self.version, changed
+                self.changed.wait(remaining)
+
+    def list(self, statuses=None, db_name=None, before=None, limit=50):
+        """Newest-first page of tasks as dicts; `before` is the last (created_at, id) of the previous page."""
+        if self.backend is not None:
+            rows = self.backend.list(statuses, db_name, before, limit)
+            with self.changed:
+                self._evict()
+                # 内存中的记录总是最新的
+                return [self.tasks[r['id']].to_dict() if r['id'] in self.tasks else r for r in rows]
+        with self.changed:
+            self._evict()
+            rows = [t.to_dict() for t in self.tasks.values()
+                    if (not statuses or t.status in statuses) and (not db_name or t.db_name == db_name)]
+        rows.sort(key=lambda r: (r.get('created_at') or 0, r['id']), reverse=True)
+        if before:
+            rows = [r for r in rows if (r.get('created_at') or 0, r['id']) < tuple(before)]
+        return rows[:limit]
+
+    def pending(self):
+        return self.backend.pending() if self.backend is not None else []
+
+    def stats(self):
+        with self.changed:
+            self._evict()
+            by_status = {}
+            for task in self.tasks.values():
+                by_status[task.status] = by_status.get(task.status, 0) + 1
+            return {"in_memory": len(self.tasks), "finished_in_memory": len(self.finished),
+                    "evictions": self.evictions, "by_status": by_status}
@@ -0,0 +1,85 @@
+import answer_cache
+from answer_cache import AnswerCache
+
+
+def _cache(**kw):
+    kw.setdefault("semantic", False)
+    kw.setdefault("db_path", "")
+    return AnswerCache(**kw)
+
+
+def test_exact_hit_ignores_case_spacing_and_trailing_punctuation():
+    cache = _cache()
+    cache.put("m", "什么是 算法", "ctx", "answer", ["a -> b"])
+    hit = cache.get("m", "  什么是   算法？ ", "ctx")
+    assert hit == {"answer": "answer", "context_path": ["a -> b"], "tier": "exact"}
+
+
+def test_model_and_context_are_part_of_the_key():
+    cache = _cache()
+    cache.put("m", "q", "ctx", "answer")
+    assert cache.get("other", "q", "ctx") is None
+    assert cache.get("m", "q", "other ctx") is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    cache = _cache(ttl=10)
+    cache.put("m", "q", "c", "a")
+    now[0] += 9
+    assert cache.get("m", "q", "c")
+    now[0] += 2
+    assert cache.get("m", "q", "c") is None
+    assert cache.stats()["expired"] == 1 and cache.stats()["entries"] == 0
+
+
+def test_lru_eviction_by_entry_count():
+    cache = _cache(max_entries=2)
+    cache.put("m", "q1", "c", "a1")
+    cache.put("m", "q2", "c", "a2")
+    assert cache.get("m", "q1", "c")          # q1 becomes most recently used
+    cache.put("m", "q3", "c", "a3")
+    assert cache.get("m", "q2", "c") is None
+    assert cache.get("m", "q1", "c") and cache.get("m", "q3", "c")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_eviction_by_memory_cap():
+    cache = _cache(max_bytes=400)
+    for i in range(5):
+        cache.put("m", f"q{i}", "c", "x" * 100)
+    stats = cache.stats()
+    assert stats["bytes"] <= 400
+    assert stats["entries"] < 5 and cache.get("m", "q4", "c")
+
+
+def test_semantic_tier_matches_near_duplicates_in_the_same_context():
+    cache = _cache(semantic=True, threshold=0.8)
+    cache.put("m", "请解释一下什么是二叉搜索树", "ctx", "bst")
+    hit = cache.get("m", "请解释一下什么是二叉搜索树呢", "ctx")
+    assert hit["tier"] == "semantic" and hit["answer"] == "bst"
+    assert cache.get("m", "请解释一下什么是二叉搜索树呢", "other ctx") is None
+    assert cache.get("m", "快速排序的时间复杂度", "ctx") is None
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    path = str(tmp_path / "answers.db")
+    first = _cache(db_path=path)
+    first.put("m", "q", "c", "a", ["p"])
+    first.close()
+    second = _cache(db_path=path)
+    assert second.get("m", "q", "c") == {"answer": "a", "context_path": ["p"], "tier": "exact"}
+    second.close()
+
+
+def test_empty_answers_are_not_stored():
+    cache = _cache()
+    cache.put("m", "q", "c", "")
+    assert cache.stats()["stores"] == 0
+
+
+def test_get_cache_respects_llm_cache_switch(monkeypatch):
+    monkeypatch.setenv("LLM_CACHE", "0")
+    assert answer_cache.get_cache() is None
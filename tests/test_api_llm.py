@@ -0,0 +1,812 @@
+import http.client
+import importlib.machinery
+import importlib.util
+import json
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import answer_cache
+import api_llm
+import llm_client
+import mastery_store
+import task_store
+
+
+class FakeMySQL:
+    """_get_mysql_conn() replacement recording what each connection executed."""
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.connecting = threading.Event()
+        self.conns = []
+        self.written = []
+        self.fail = False
+
+    def connect(self):
+        self.connecting.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        conn = FakeConn(self)
+        self.conns.append(conn)
+        return conn
+
+
+class FakeConn:
+    def __init__(self, db):
+        self.db = db
+        self.closed = False
+        self.ping_fails = False
+        self.pending = []
+
+    def ping(self, reconnect=False):
+        if self.ping_fails:
+            raise OSError("gone")
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.db.written.extend(self.pending)
+        self.pending = []
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def executemany(self, sql, rows):
+        if self.conn.db.fail:
+            raise RuntimeError("insert failed")
+        self.conn.pending.append((sql.split()[2], list(rows)))
+
+
+@pytest.fixture
+def mysql(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MYSQL_LOG_FLUSH_MS", "10000")
+    db = FakeMySQL()
+    monkeypatch.setattr(api_llm, "_get_mysql_conn", db.connect)
+    return db
+
+
+def test_pool_reuses_pinged_connections_and_discards_broken_ones(mysql):
+    pool = api_llm._MySQLPool(1)
+    a = pool.acquire()
+    pool.release(a)
+    assert pool.acquire() is a
+    pool.release(a, broken=True)
+    assert a.closed
+    b = pool.acquire()
+    pool.release(b)
+    b.ping_fails = True
+    c = pool.acquire()
+    assert c is not b and b.closed
+    pool.release(c)
+    pool.release(mysql.connect())
+    assert pool.idle.qsize() == 1 and mysql.conns[-1].closed
+    assert pool.created == 3
+
+
+def test_logger_writes_one_batch_per_table_on_close(mysql):
+    logger = api_llm._WriteBehindLogger()
+    for i in range(3):
+        assert logger.log("dialogue", ("s1", "user", f"q{i}", ""))
+    assert logger.log("learning", ("s1", "q1", True, "neo4j"))
+    logger.close()
+    assert sorted(mysql.written) == [
+        ("dialogue_logs", [("s1", "user", "q0", ""), ("s1", "user", "q1", ""), ("s1", "user", "q2", "")]),
+        ("learning_logs", [("s1", "q1", True, "neo4j")]),
+    ]
+    stats = logger.stats()
+    assert (stats["enqueued"], stats["flushed"], stats["batches"], stats["dropped"]) == (4, 4, 1, 0)
+    assert stats["pool_created"] == 1
+
+
+def test_full_queue_drops_rows_after_a_short_block(mysql, monkeypatch):
+    monkeypatch.setenv("MYSQL_LOG_BATCH", "1")
+    monkeypatch.setenv("MYSQL_LOG_QUEUE", "2")
+    monkeypatch.setenv("MYSQL_LOG_BLOCK_MS", "20")
+    mysql.gate = threading.Event()
+    logger = api_llm._WriteBehindLogger()
+    assert logger.log("dialogue", ("s1", "user", "0", ""))
+    # 写线程取走第一条后卡在建连上，队列只能再放两条
+    assert mysql.connecting.wait(5)
+    assert logger.log("dialogue", ("s1", "user", "1", ""))
+    assert logger.log("dialogue", ("s1", "user", "2", ""))
+    assert not logger.log("dialogue", ("s1", "user", "3", ""))
+    stats = logger.stats()
+    assert (stats["enqueued"], stats["dropped"], stats["queued"]) == (3, 1, 2)
+    mysql.gate.set()
+    logger.close()
+    assert [row[2] for _, rows in mysql.written for row in rows] == ["0", "1", "2"]
+    assert logger.stats()["flushed"] == 3
+
+
+def test_failed_batches_are_counted_and_their_connection_dropped(mysql):
+    mysql.fail = True
+    logger = api_llm._WriteBehindLogger()
+    logger.log("dialogue", ("s1", "user", "q", ""))
+    logger.log("learning", ("s1", "q1", False, "neo4j"))
+    logger.close()
+    stats = logger.stats()
+    assert (stats["failed"], stats["flushed"], stats["pool_idle"]) == (2, 0, 0)
+    assert mysql.conns[0].closed and not mysql.written
+
+
+def test_rows_fail_without_pymysql(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MYSQL_LOG_FLUSH_MS", "10000")
+    monkeypatch.setattr(api_llm, "pymysql", None)
+    assert api_llm._get_mysql_conn() is None
+    logger = api_llm._WriteBehindLogger()
+    logger.log("dialogue", ("s1", "user", "q", ""))
+    assert logger.fetch("SELECT 1", ()) is None
+    logger.close()
+    assert logger.stats()["failed"] == 1
+
+
+class FakeDriver:
+    def __init__(self, uri, auth, **options):
+        self.uri = uri
+        self.auth = auth
+        self.options = options
+        self.closed = False
+        self.sessions = []
+
+    def session(self, database=None):
+        self.sessions.append(database)
+        return FakeSession()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeNeo4j:
+    class GraphDatabase:
+        drivers = []
+
+        @classmethod
+        def driver(cls, uri, auth, **options):
+            d = FakeDriver(uri, auth, **options)
+            cls.drivers.append(d)
+            return d
+
+
+@pytest.fixture
+def neo4j(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    for name in ("NEO4J_URI", "NEO4J_USER", "NEO4J_PASSWORD", "NEO4J_DATABASE"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("NEO4J_POOL_SIZE", "7")
+    FakeNeo4j.GraphDatabase.drivers = []
+    monkeypatch.setattr(api_llm, "neo4j", FakeNeo4j)
+    api_llm._close_neo4j_drivers()
+    yield FakeNeo4j.GraphDatabase.drivers
+    api_llm._close_neo4j_drivers()
+
+
+def test_queries_share_one_driver_per_database(neo4j):
+    assert api_llm._query_neo4j(lambda s: "a") == "a"
+    assert api_llm._query_neo4j(lambda s: "b") == "b"
+    assert api_llm._query_neo4j(lambda s: "c", "other") == "c"
+    assert len(neo4j) == 2
+    assert neo4j[0].sessions == [None, None] and neo4j[1].sessions == ["other"]
+    assert neo4j[0].options["max_connection_pool_size"] == 7
+    stats = {s["database"]: s for s in api_llm._neo4j_pool_stats()}
+    assert (stats[None]["sessions"], stats["other"]["sessions"]) == (2, 1)
+
+
+def test_a_changed_password_replaces_the_driver(neo4j, monkeypatch):
+    api_llm._query_neo4j(lambda s: None)
+    monkeypatch.setenv("NEO4J_PASSWORD", "new")
+    api_llm._query_neo4j(lambda s: None)
+    assert [d.auth[1] for d in neo4j] == ["", "new"]
+    assert neo4j[0].closed and not neo4j[1].closed
+    assert len(api_llm._neo4j_pool_stats()) == 1
+
+
+def test_failed_queries_are_counted_and_release_the_session(neo4j):
+    def boom(session):
+        raise RuntimeError("bad cypher")
+    with pytest.raises(RuntimeError):
+        api_llm._query_neo4j(boom)
+    (stats,) = api_llm._neo4j_pool_stats()
+    assert (stats["sessions"], stats["active"], stats["errors"]) == (1, 0, 1)
+    api_llm._close_neo4j_drivers()
+    assert neo4j[0].closed and api_llm._neo4j_pool_stats() == []
+
+
+def test_queries_return_none_without_the_driver_package(monkeypatch):
+    monkeypatch.setattr(api_llm, "neo4j", None)
+    assert api_llm._query_neo4j(lambda s: "x") is None
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    started = None
+    gate = None
+
+    def do_GET(self):
+        self.started.set()
+        self.gate.wait(5)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(srv):
+    threading.Thread(target=srv.serve_forever, args=(0.05,), daemon=True).start()
+    return srv.server_address[1]
+
+
+def _get(port, path, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request("GET", path, headers=headers or {})
+    resp = conn.getresponse()
+    body = resp.read()
+    conn.close()
+    return resp, body
+
+
+def test_saturated_pool_answers_503_without_queueing():
+    SlowHandler.started, SlowHandler.gate = threading.Event(), threading.Event()
+    srv = api_llm.PooledHTTPServer(("127.0.0.1", 0), SlowHandler, max_workers=1, max_pending=1)
+    port = _serve(srv)
+    try:
+        results = []
+        held = [threading.Thread(target=lambda: results.append(_get(port, "/")[0].status)) for _ in range(2)]
+        held[0].start()
+        assert SlowHandler.started.wait(5)
+        held[1].start()
+        # 第二个连接占住唯一的等待位后，第三个立即被拒
+        deadline = time.monotonic() + 5
+        while srv._slots._value and time.monotonic() < deadline:
+            time.sleep(0.005)
+        resp, body = _get(port, "/")
+        assert resp.status == 503 and resp.getheader("Retry-After") == "1"
+        assert json.loads(body) == {"error": "server busy"}
+        SlowHandler.gate.set()
+        for t in held:
+            t.join(5)
+        assert results == [200, 200]
+        assert _get(port, "/")[0].status == 200
+    finally:
+        SlowHandler.gate.set()
+        srv.shutdown()
+        srv.server_close()
+
+
+@pytest.fixture
+def route_limits(monkeypatch):
+    monkeypatch.setattr(api_llm, "_route_limits", {})
+    for name in ("LLM_CONCURRENCY", "GRAPH_CONCURRENCY", "TASK_EVENTS_CONCURRENCY"):
+        monkeypatch.setenv(name, "1")
+    monkeypatch.setenv("ROUTE_QUEUE_TIMEOUT", "0.05")
+    api_llm._init_route_limits()
+    return api_llm._route_limits
+
+
+def test_route_classes_are_limited_separately(route_limits):
+    with api_llm._RouteSlot("/llm") as ok:
+        assert ok
+        t0 = time.monotonic()
+        with api_llm._RouteSlot("/upload_file") as busy:
+            assert not busy
+        assert time.monotonic() - t0 >= 0.05
+        with api_llm._RouteSlot("/submit_answers?x=1") as graph:
+            assert graph
+            with api_llm._RouteSlot("/question") as busy:
+                assert not busy
+        with api_llm._RouteSlot("/task_events") as events:
+            assert events
+            # 长连接路由不排队，满了立即拒绝
+            t0 = time.monotonic()
+            with api_llm._RouteSlot("/task_events") as busy:
+                assert not busy
+            assert time.monotonic() - t0 < 0.05
+        with api_llm._RouteSlot("/health") as free:
+            assert free
+    with api_llm._RouteSlot("/llm") as ok:
+        assert ok
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path, route_limits):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("HTTP_WORKERS", "4")
+    srv = api_llm.make_server("127.0.0.1", 0)
+    port = _serve(srv)
+    yield port
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_busy_route_answers_503_while_other_routes_serve(server, route_limits):
+    route_limits["graph"].acquire()
+    try:
+        resp, body = _get(server, "/question?id=1")
+        assert resp.status == 503 and json.loads(body) == {"error": "server busy"}
+        assert _get(server, "/metrics")[0].status == 200
+    finally:
+        route_limits["graph"].release()
+
+
+def _import_wrapper():
+    # 同 test_indexing：未安装 lightrag 时用占位模块通过导入检查
+    if importlib.util.find_spec("lightrag") is not None:
+        import lightrag_wrapper
+        return lightrag_wrapper
+    placeholder = types.ModuleType("lightrag")
+    placeholder.__spec__ = importlib.machinery.ModuleSpec("lightrag", None)
+    sys.modules["lightrag"] = placeholder
+    try:
+        import lightrag_wrapper
+    finally:
+        sys.modules.pop("lightrag", None)
+    return lightrag_wrapper
+
+
+@pytest.fixture
+def tasks(monkeypatch):
+    lw = _import_wrapper()
+    store = task_store.TaskStore()
+    monkeypatch.setattr(lw, "tasks", store)
+    monkeypatch.setattr(api_llm, "lightrag_wrapper", lw)
+    return store
+
+
+def _sse_events(resp):
+    """(event, id, data) for each SSE message; keepalive comments are skipped."""
+    event = {}
+    for raw in resp:
+        line = raw.decode("utf-8").rstrip("\n")
+        if not line:
+            if event:
+                yield event.get("event"), event.get("id"), json.loads(event["data"])
+            event = {}
+        elif not line.startswith(":"):
+            key, _, value = line.partition(": ")
+            event[key] = value
+
+
+def _stream(port, path, headers=None, body=None):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    method, data = ("GET", None) if body is None else ("POST", json.dumps(body).encode("utf-8"))
+    conn.request(method, path, body=data, headers={"Accept": "text/event-stream", **(headers or {})})
+    resp = conn.getresponse()
+    assert resp.status == 200 and resp.getheader("Content-Type").startswith("text/event-stream")
+    return _sse_events(resp)
+
+
+def test_task_events_stream_pushes_changes_until_every_task_ends(server, tasks):
+    tasks.add({"id": "t1", "status": "running", "progress": 0})
+    events = _stream(server, "/task_events?task_ids=t1,gone")
+    assert next(events) == ("missing", None, {"id": "gone", "error": "task not found"})
+    event, version, task = next(events)
+    assert (event, task["id"], task["status"]) == ("task", "t1", "running")
+
+    def work():
+        tasks.update("t1", {"progress": 50})
+        time.sleep(0.05)
+        tasks.update("t1", {"status": "completed", "progress": 100})
+    threading.Thread(target=work).start()
+    seen = [next(events) for _ in range(2)]
+    # 两次更新可能合并成一个事件推送
+    if seen[-1][0] == "task":
+        seen.append(next(events))
+    assert seen[-2][2]["status"] == "completed" and seen[-2][1] == str(tasks.version)
+    assert seen[-1] == ("end", str(tasks.version), {"version": tasks.version})
+    assert list(events) == []
+
+
+def test_task_events_reconnect_after_the_end_closes_at_once(server, tasks):
+    tasks.add({"id": "t1", "status": "running"})
+    tasks.update("t1", {"status": "failed"})
+    events = _stream(server, "/task_events?task_ids=t1", {"Last-Event-ID": str(tasks.version)})
+    assert list(events) == [("end", str(tasks.version), {"version": tasks.version})]
+
+
+def test_task_events_long_poll_returns_on_the_first_change(server, tasks):
+    tasks.add({"id": "t1", "status": "queued"})
+    resp, body = _get(server, "/task_events?task_ids=t1")
+    first = json.loads(body)
+    assert [t["status"] for t in first["tasks"]] == ["queued"]
+    threading.Timer(0.05, tasks.update, ("t1", {"status": "running"})).start()
+    t0 = time.monotonic()
+    resp, body = _get(server, f"/task_events?task_ids=t1&since={first['version']}&timeout=5")
+    assert time.monotonic() - t0 < 2
+    assert [t["status"] for t in json.loads(body)["tasks"]] == ["running"]
+    resp, body = _get(server, f"/task_events?task_ids=t1&since={tasks.version}&timeout=0.05")
+    assert json.loads(body) == {"version": tasks.version, "tasks": []}
+    assert _get(server, "/task_events")[0].status == 400
+
+
+class FakeUpstream:
+    """llm_client response: iterates over raw lines, or read() for a whole body."""
+    def __init__(self, lines, content_type="text/event-stream", status=200):
+        self.lines = lines
+        self.content_type = content_type
+        self.status = status
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def read(self):
+        return b"".join(self.lines)
+
+
+class FakeLLM:
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+
+    def chat_completion(self, messages, model, base_url, api_key, stream=False, **params):
+        self.calls.append(stream)
+        if isinstance(self.reply, Exception):
+            raise self.reply
+        return self.reply
+
+
+def _delta(text):
+    return b"data: " + json.dumps({"choices": [{"delta": {"content": text}}]}).encode("utf-8") + b"\n"
+
+
+@pytest.fixture
+def llm(monkeypatch, server):
+    monkeypatch.setenv("MS_API_KEY", "k")
+    cache = answer_cache.AnswerCache(semantic=False, db_path="")
+    monkeypatch.setattr(answer_cache, "get_cache", lambda: cache)
+    fake = FakeLLM(None)
+    monkeypatch.setattr(llm_client, "get_client", lambda: fake)
+    return fake
+
+
+def test_llm_stream_forwards_upstream_deltas_then_serves_them_from_cache(server, llm):
+    llm.reply = FakeUpstream([_delta("图"), b"\n", b": ping\n", _delta("算法"), b"data: [DONE]\n", _delta("extra")])
+    events = list(_stream(server, "/llm?stream=1", body={"question": "什么是图算法"}))
+    assert [e[2] for e in events[:-1]] == [{"delta": "图"}, {"delta": "算法"}]
+    event, _, done = events[-1]
+    assert event == "done" and done["answer"] == "图算法" and "timings" in done
+    assert llm.calls == [True]
+    # 流式回答完整结束后写入缓存，同一问题不再请求上游
+    events = list(_stream(server, "/llm", body={"question": "什么是图算法", "stream": True}))
+    assert events[0][2] == {"delta": "图算法"}
+    assert events[-1][2]["cached"] is True and llm.calls == [True]
+
+
+def test_llm_stream_sends_a_non_streamed_upstream_reply_as_one_delta(server, llm):
+    llm.reply = FakeUpstream([b'{"error": {"message": "quota exceeded"}}'], "application/json", 429)
+    events = list(_stream(server, "/llm?stream=1", body={"question": "q"}))
+    assert events[0][2] == {"delta": "quota exceeded"}
+    assert events[-1][0] == "done" and events[-1][2]["answer"] == "quota exceeded"
+
+
+def test_llm_stream_falls_back_when_the_upstream_is_unavailable(server, llm):
+    llm.reply = llm_client.LLMUnavailable("upstream down")
+    events = list(_stream(server, "/llm?stream=1", body={"question": "q"}))
+    assert events[0][2]["delta"].startswith("模型不可用")
+    event, _, done = events[-1]
+    assert event == "done" and done["degraded"] is True and done["error"] == "upstream down"
+
+
+class FakeNode:
+    def __init__(self, element_id, props):
+        self.element_id = element_id
+        self._properties = props
+
+
+class FakeResult(list):
+    def single(self):
+        return self[0] if self else None
+
+
+class QuestionGraph:
+    """Neo4j session answering the /question query by applying the filters its parameters ask for."""
+    def __init__(self, questions):
+        self.questions = questions   # [(elementId, epoch ms of created_at, properties)]
+        self.queries = []
+
+    def run(self, cypher, params):
+        self.queries.append((cypher, dict(params)))
+        rows = []
+        for eid, ts, props in self.questions:
+            if eid in params.get("done", ()) or props.get("qid") in params.get("done", ()):
+                continue
+            if eid in params.get("exclude_ids", ()) or props.get("qid") in params.get("exclude_qids", ()):
+                continue
+            if "qtype" in params and props.get("type") != params["qtype"]:
+                continue
+            if "cur_ts" in params and not (ts, eid) < (params["cur_ts"], params["cur_id"]):
+                continue
+            rows.append({"q": FakeNode(eid, props), "ts": ts, "qid_": eid})
+        rows.sort(key=lambda r: (r["ts"], r["qid_"]), reverse=True)
+        return FakeResult(rows[:params.get("limit", 1)])
+
+
+@pytest.fixture
+def questions(monkeypatch):
+    graph = QuestionGraph([
+        ("e1", 1000, {"qid": "q1", "type": "choice"}),
+        ("e2", 2000, {"qid": "q2", "type": "judge"}),
+        ("e3", 2000, {"qid": "q3", "type": "choice"}),
+        ("e4", 3000, {"qid": "q4", "type": "choice"}),
+        ("e5", 0, {"qid": "q5", "type": "choice"}),
+    ])
+    monkeypatch.setattr(api_llm, "_query_neo4j", lambda fn, database=None: fn(graph))
+    return graph
+
+
+def _question_page(port, query):
+    resp, body = _get(port, "/question?module_name=graphs&" + query)
+    assert resp.status == 200
+    page = json.loads(body)
+    return [q["qid"] for q in page["questions"]], page["next_cursor"]
+
+
+def test_question_batch_pages_newest_first_through_the_cursor(server, questions):
+    pages = []
+    cursor = ""
+    while True:
+        qids, cursor = _question_page(server, "count=2" + (f"&cursor={cursor}" if cursor else ""))
+        pages.append(qids)
+        if not cursor:
+            break
+    # 同一 created_at 的题按 elementId 倒序，没有 created_at 的排在最后
+    assert pages == [["q4", "q3"], ["q2", "q1"], ["q5"]]
+    cypher, params = questions.queries[1]
+    assert "datetime(toString(q.created_at)).epochMillis" in cypher
+    assert (params["cur_ts"], params["cur_id"]) == (2000, "e3")
+
+
+def test_question_batch_applies_the_count_limit_and_exclude_lists(server, questions, monkeypatch):
+    monkeypatch.setenv("QUESTION_BATCH_MAX", "2")
+    qids, cursor = _question_page(server, "count=10&exclude_ids=e4&exclude_qid=q2&exclude_qid=q5")
+    assert qids == ["q3", "q1"] and cursor
+    assert questions.queries[-1][1]["limit"] == 2
+    assert _question_page(server, "count=5&type=judge")[0] == ["q2"]
+
+
+def test_question_batch_skips_what_the_learner_got_right(server, questions, monkeypatch):
+    monkeypatch.setattr(api_llm, "_mastery", mastery_store.MasteryStore(lambda key: [("q4", True), ("e3", False), ("e2", True)]))
+    assert _question_page(server, "count=5&session_id=s1")[0] == ["q3", "q1", "q5"]
+
+
+def test_single_question_mode_and_bad_cursors(server, questions):
+    resp, body = _get(server, "/question?module_name=graphs&exclude_qids=q4")
+    assert json.loads(body)["question"]["qid"] == "q3"
+    for cursor in ("not-a-cursor", api_llm._encode_cursor("2024-01-01T00:00:00Z", "e3")):
+        resp, body = _get(server, f"/question?module_name=graphs&count=2&cursor={cursor}")
+        assert resp.status == 400
+
+
+class StatsGraph:
+    """Neo4j session for /question_stats and /submit_answer: one concept with a few questions."""
+    def __init__(self):
+        self.stats_queries = 0
+        self.rows = [{"d": "easy", "c": 2, "m": 1, "qs": [["e1", "q1"], ["e2", None]]},
+                     {"d": "hard", "c": 1, "m": 0, "qs": [["e3", "q3"]]}]
+
+    def run(self, cypher, params=None):
+        if "SET q.user_result" in cypher:
+            return FakeResult([{"q": object(), "cids": ["c1"], "cnames": ["graphs"]}])
+        self.stats_queries += 1
+        rows = self.rows
+        return types.SimpleNamespace(data=lambda: [dict(r) for r in rows])
+
+
+@pytest.fixture
+def stats_graph(monkeypatch):
+    graph = StatsGraph()
+    monkeypatch.setattr(api_llm, "_query_neo4j", lambda fn, database=None: fn(graph))
+    monkeypatch.setattr(api_llm, "_stats_cache", api_llm._StatsCache())
+    return graph
+
+
+def _post(port, path, obj):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request("POST", path, body=json.dumps(obj).encode("utf-8"), headers={"Content-Type": "application/json"})
+    resp = conn.getresponse()
+    body = resp.read()
+    conn.close()
+    return resp, json.loads(body)
+
+
+def test_stats_cache_drops_only_the_answered_concepts_and_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(api_llm.time, "time", lambda: now[0])
+    monkeypatch.setenv("QUESTION_STATS_TTL", "60")
+    cache = api_llm._StatsCache()
+    for key in (("db", "all"), ("db", "id", "c1"), ("db", "name", "graphs"), ("db", "name", "other"), ("db2", "all")):
+        cache.put(key, key)
+    cache.invalidate("db", ["c1"], ["graphs", "never-cached"])
+    assert [cache.get(k) for k in (("db", "all"), ("db", "id", "c1"), ("db", "name", "graphs"))] == [None] * 3
+    assert cache.get(("db", "name", "other")) and cache.get(("db2", "all"))
+    now[0] += 61
+    assert cache.get(("db2", "all")) is None
+    assert cache.stats() == {"hits": 2, "misses": 4, "invalidations": 3, "entries": 2}
+
+
+def test_question_stats_are_served_from_cache_until_an_answer_lands(server, stats_graph):
+    expected = {"total": 3, "mastered": 1, "pending": 2, "by_difficulty": {"easy": 2, "hard": 1}}
+    for _ in range(2):
+        resp, body = _get(server, "/question_stats?module_id=c1")
+        assert json.loads(body) == expected
+    assert stats_graph.stats_queries == 1
+    _get(server, "/question_stats?module_name=other")
+    assert stats_graph.stats_queries == 2
+    stats_graph.rows[0]["m"] = 2
+    assert _post(server, "/submit_answer", {"qid": "q2", "is_correct": True})[1] == {"ok": True}
+    resp, body = _get(server, "/question_stats?module_id=c1")
+    assert json.loads(body)["mastered"] == 2 and stats_graph.stats_queries == 3
+    # 其他概念的缓存不受影响
+    _get(server, "/question_stats?module_name=other")
+    assert stats_graph.stats_queries == 3
+
+
+def test_question_stats_count_a_learners_own_answers(server, stats_graph, monkeypatch):
+    monkeypatch.setattr(api_llm, "_mastery", mastery_store.MasteryStore(lambda key: [("q3", True), ("e2", True), ("q1", False)]))
+    resp, body = _get(server, "/question_stats?module_id=c1&session_id=s1")
+    assert json.loads(body)["mastered"] == 2
+    resp, body = _get(server, "/question_stats?module_id=c1")
+    assert json.loads(body)["mastered"] == 1 and stats_graph.stats_queries == 1
+
+
+class PageGraph:
+    """Neo4j session returning fixed /questions rows; records each query."""
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def run(self, cypher, params):
+        self.queries.append((cypher, dict(params)))
+        return FakeResult(dict(r) for r in self.rows[:params["limit"]])
+
+
+def _question_row(eid, qid, ts, concepts=("graphs",)):
+    return {"q": {"qid": qid}, "ts": ts, "qid_": eid, "qkey": qid, "concepts": list(concepts)}
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    graph = PageGraph([_question_row("e2", "q2", 2000), _question_row("e1", "q1", 1000)])
+    monkeypatch.setattr(api_llm, "_query_neo4j", lambda fn, database=None: fn(graph))
+    return graph
+
+
+def test_questions_answer_304_while_the_page_is_unchanged(server, pages):
+    resp, body = _get(server, "/questions?fields=qid,concept")
+    etag = resp.getheader("ETag")
+    assert resp.status == 200 and resp.getheader("Cache-Control") == "no-cache"
+    assert json.loads(body)["questions"][0] == {"qid": "q2", "concept": "graphs", "concepts": ["graphs"]}
+    resp, body = _get(server, "/questions?fields=qid,concept", {"If-None-Match": etag})
+    assert resp.status == 304 and body == b"" and resp.getheader("ETag") == etag
+    # 标签取自查询后的响应体，重新验证仍会执行查询
+    assert len(pages.queries) == 2
+    pages.rows[0] = _question_row("e2", "q2", 2000, ("trees",))
+    resp, body = _get(server, "/questions?fields=qid,concept", {"If-None-Match": etag})
+    assert resp.status == 200 and resp.getheader("ETag") != etag
+
+
+def test_questions_page_with_a_numeric_cursor(server, pages):
+    resp, body = _get(server, "/questions?limit=1")
+    page = json.loads(body)
+    assert [q["id"] for q in page["questions"]] == ["e2"]
+    _get(server, "/questions?limit=1&cursor=" + page["next_cursor"])
+    cypher, params = pages.queries[-1]
+    assert (params["cur_ts"], params["cur_id"]) == (2000, "e2")
+    assert "ORDER BY ts DESC, qid_ DESC LIMIT $limit" in cypher
+    assert _get(server, "/questions?fields=password")[0].status == 400
+
+
+class ZPDGraph:
+    """Neo4j session for _propagate_zpd: records each propagated id set per database."""
+    def __init__(self):
+        self.calls = []
+        self.database = None
+
+    def run(self, cypher, params):
+        assert cypher == api_llm._ZPD_PROPAGATE
+        self.calls.append((self.database, sorted(params["ids"])))
+        return FakeResult([{"unlocked": ["next-" + i for i in sorted(params["ids"])]}])
+
+
+@pytest.fixture
+def zpd(monkeypatch):
+    monkeypatch.setenv("ZPD_COALESCE_MS", "50")
+    graph = ZPDGraph()
+
+    def query(fn, database=None):
+        graph.database = database
+        return fn(graph)
+    monkeypatch.setattr(api_llm, "_query_neo4j", query)
+    coalescer = api_llm._ZPDCoalescer()
+    monkeypatch.setattr(api_llm, "_zpd_coalescer", coalescer)
+    yield graph, coalescer
+    coalescer.flush()
+
+
+def _wait_flushes(coalescer, n):
+    deadline = time.monotonic() + 5
+    while coalescer.stats()["flushes"] < n and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return coalescer.stats()
+
+
+def test_coalescer_propagates_each_database_once_per_window(zpd):
+    graph, coalescer = zpd
+    assert coalescer.add("db1", ["a", "b"]) == 2
+    assert coalescer.add("db1", ["b", "c"]) == 3
+    assert coalescer.add("db2", ["x"]) == 1
+    stats = _wait_flushes(coalescer, 2)
+    assert sorted(graph.calls) == [("db1", ["a", "b", "c"]), ("db2", ["x"])]
+    assert (stats["requests"], stats["flushes"], stats["nodes"], stats["unlocked"], stats["pending"]) == (3, 2, 4, 4, 0)
+    # 下一个窗口重新计时
+    coalescer.add("db1", ["d"])
+    assert _wait_flushes(coalescer, 3)["flushes"] == 3 and graph.calls[-1] == ("db1", ["d"])
+
+
+def test_deferred_zpd_updates_return_202_and_flush_together(server, zpd):
+    graph, coalescer = zpd
+    resp, body = _post(server, "/zpd_update", {"node_ids": ["a"], "defer": True})
+    assert resp.status == 202 and body == {"ok": True, "deferred": True, "pending": 1}
+    resp, body = _post(server, "/zpd_update", {"node_id": "b", "defer": True})
+    assert body["pending"] == 2
+    _wait_flushes(coalescer, 1)
+    assert graph.calls == [(None, ["a", "b"])]
+    resp, body = _post(server, "/zpd_update", {"node_id": "c"})
+    assert resp.status == 200 and body == {"ok": True, "unlocked": ["next-c"]}
+    assert coalescer.stats()["requests"] == 2
+
+
+def test_health_reports_every_subsystem_and_isolates_failures(server, monkeypatch):
+    monkeypatch.setenv("MS_API_KEY", "k")
+    broken = types.SimpleNamespace(stats=lambda: 1 / 0)
+    monkeypatch.setattr(api_llm, "_mastery", broken)
+    resp, body = _get(server, "/health")
+    res = json.loads(body)
+    assert resp.status == 200 and res["ok"] is True and res["ms_key_present"] is True
+    assert set(res) == {"ok", "ms_key_present", "base", "model"} | {name for name, _ in api_llm._HEALTH_STATS}
+    assert res["mastery"] == {"error": "division by zero"}
+    assert res["question_stats_cache"]["entries"] >= 0
+
+
+def test_resume_task_route(server, monkeypatch):
+    resumed = []
+    wrapper = types.SimpleNamespace(resume_task=lambda task_id: resumed.append(task_id) or task_id == "t1")
+    monkeypatch.setattr(api_llm, "lightrag_wrapper", wrapper)
+    assert _post(server, "/resume_task", {"task_id": "t1"})[1] == {"ok": True}
+    resp, body = _post(server, "/resume_task", {"task_id": "t2"})
+    assert resp.status == 400 and "cannot be resumed" in body["error"]
+    assert _post(server, "/resume_task", {})[1] == {"error": "task_id required"}
+    assert resumed == ["t1", "t2"]
@@ -0,0 +1,65 @@
+import time
+
+from concept_index import AhoCorasick, CompetencyIndex, GraphSnapshot
+
+NAMES = {"r": "计算思维", "s": "算法设计", "a": "算法", "t": "数据结构", "x": "孤立概念"}
+EDGES = [("r", "s"), ("s", "a"), ("r", "t")]
+
+
+def _graph():
+    return NAMES, list(NAMES), EDGES, ["r"]
+
+
+def test_aho_corasick_finds_overlapping_words():
+    found = sorted(AhoCorasick(["算法", "算法设计", "设计"]).find("学习算法设计"))
+    assert found == [(2, "算法"), (2, "算法设计"), (4, "设计")]
+
+
+def test_lookup_prefers_longer_names_and_returns_root_paths():
+    snap = GraphSnapshot(*_graph())
+    assert snap.match("算法设计里的算法") == ["s", "a"]
+    assert snap.lookup("什么是算法") == ["计算思维 -> 算法设计 -> 算法"]
+
+
+def test_unreachable_and_unknown_concepts_have_no_paths():
+    snap = GraphSnapshot(*_graph())
+    assert snap.lookup("孤立概念") == []
+    assert snap.lookup("没有匹配") == []
+
+
+def test_path_table_keeps_at_most_k_shortest_paths():
+    names = {n: n * 2 for n in "rabz"}
+    edges = [("r", "a"), ("r", "b"), ("a", "z"), ("b", "z"), ("r", "z")]
+    paths = GraphSnapshot(names, list(names), edges, ["r"], k=2).paths["z"]
+    assert paths == [("r", "z"), ("r", "a", "z")]
+
+
+def test_index_builds_once_and_refreshes_after_invalidate():
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return _graph()
+
+    index = CompetencyIndex(loader, ttl=3600)
+    assert index.lookup("算法") == ["计算思维 -> 算法设计 -> 算法"]
+    index.lookup("算法")
+    assert len(loads) == 1
+    index.invalidate()
+    index.lookup("算法")
+    for _ in range(100):
+        if index.stats()["builds"] == 2:
+            break
+        time.sleep(0.01)
+    assert len(loads) == 2
+
+
+def test_failed_first_build_returns_none_for_fallback():
+    def loader():
+        raise RuntimeError("neo4j unavailable")
+
+    index = CompetencyIndex(loader, ttl=60)
+    assert index.lookup("算法") is None
+    assert index.stats()["build_errors"] == 1
+    assert index.lookup("算法") is None
+    assert index.stats()["build_errors"] == 1
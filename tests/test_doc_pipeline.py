@@ -0,0 +1,100 @@
+import base64
+import hashlib
+import os
+
+import pytest
+
+import doc_pipeline
+from doc_pipeline import Chunker
+
+
+def _decode(tmp_path, text):
+    src, dst = tmp_path / "in.b64", tmp_path / "out.bin"
+    src.write_text(text, encoding="utf-8")
+    size = doc_pipeline.decode_base64_file(str(src), str(dst))
+    return size, dst.read_bytes()
+
+
+@pytest.mark.parametrize("wrap", [
+    lambda b: b,
+    lambda b: "data:application/pdf;base64," + b,
+    lambda b: "\n".join(b[i:i + 76] for i in range(0, len(b), 76)),
+    lambda b: b.rstrip("="),
+])
+def test_decode_base64_file_across_block_boundaries(tmp_path, monkeypatch, wrap):
+    monkeypatch.setattr(doc_pipeline, "B64_BLOCK", 1024)
+    data = os.urandom(10 * 1024 + 7)
+    size, out = _decode(tmp_path, wrap(base64.b64encode(data).decode("ascii")))
+    assert size == len(data) and out == data
+
+
+def test_detect_kind_by_extension_then_magic(tmp_path):
+    pdf, zipped, plain = tmp_path / "a", tmp_path / "b", tmp_path / "c"
+    pdf.write_bytes(b"%PDF-1.7")
+    zipped.write_bytes(b"PK\x03\x04")
+    plain.write_bytes(b"hello")
+    assert doc_pipeline.detect_kind(str(pdf)) == "pdf"
+    assert doc_pipeline.detect_kind(str(zipped), "upload") == "docx"
+    assert doc_pipeline.detect_kind(str(zipped), "notes.txt") == "text"
+    assert doc_pipeline.detect_kind(str(plain), "report.docx") == "docx"
+    assert doc_pipeline.detect_kind(str(plain)) == "text"
+
+
+def test_clean_text_collapses_spaces_and_blank_lines():
+    assert doc_pipeline.clean_text("a \t　b\n \n\n\n c ") == "a b\n\nc "
+
+
+def test_iter_text_file_reads_in_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(doc_pipeline, "TEXT_BLOCK", 5)
+    path = tmp_path / "t.txt"
+    path.write_text("知识图谱与能力模型", encoding="utf-8")
+    blocks = list(doc_pipeline.iter_text_file(str(path)))
+    assert "".join(blocks) == "知识图谱与能力模型" and len(blocks) == 2
+
+
+def test_chunker_cuts_at_sentence_boundaries_with_overlap():
+    text = "".join(f"第{i}句话的内容比较长一些。" for i in range(40))
+    chunker = Chunker(size=100, overlap=10)
+    chunks = chunker.feed(text) + chunker.flush()
+    assert all(len(c) <= 100 for c in chunks)
+    assert all(c.endswith("。") for c in chunks[:-1])
+    for prev, nxt in zip(chunks, chunks[1:]):
+        assert nxt.startswith(prev[-10:])
+
+
+def test_chunker_is_independent_of_feed_sizes():
+    text = "段落一。" * 300 + "\n\n" + "Sentence two. " * 200
+    whole = Chunker(size=256, overlap=32)
+    expected = whole.feed(text) + whole.flush()
+    pieces = Chunker(size=256, overlap=32)
+    got = []
+    for i in range(0, len(text), 37):
+        got += pieces.feed(text[i:i + 37])
+    assert got + pieces.flush() == expected
+
+
+def test_chunker_hard_cuts_text_without_breaks():
+    chunker = Chunker(size=50, overlap=5)
+    chunks = chunker.feed("x" * 120) + chunker.flush()
+    assert [len(c) for c in chunks] == [50, 50, 30]
+
+
+def test_docx_paragraphs_include_table_rows(tmp_path):
+    docx = pytest.importorskip("docx")
+    doc = docx.Document()
+    doc.add_paragraph("第一段")
+    doc.add_paragraph("   ")
+    table = doc.add_table(rows=1, cols=2)
+    table.rows[0].cells[0].text = "概念"
+    table.rows[0].cells[1].text = "算法"
+    path = str(tmp_path / "d.docx")
+    doc.save(path)
+    assert doc_pipeline.docx_paragraphs(path) == ["第一段", "概念 | 算法"]
+
+
+def test_base64_sha256_matches_the_decoded_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(doc_pipeline, "B64_BLOCK", 1024)
+    data = os.urandom(5000)
+    encoded = "data:application/octet-stream;base64," + base64.b64encode(data).decode("ascii")
+    size, out = _decode(tmp_path, encoded)
+    assert doc_pipeline.base64_sha256(encoded) == (hashlib.sha256(out).hexdigest(), size)
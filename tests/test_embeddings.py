@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+import embeddings
+from embeddings import Batcher, HashBackend
+
+
+class RecordingBackend:
+    model_id = "rec"
+    dim = 4
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def embed(self, texts):
+        self.calls.append(list(texts))
+        if self.fail:
+            raise RuntimeError("embedding upstream 503")
+        return np.array([[len(t), 0, 0, 1] for t in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def batcher_factory():
+    made = []
+
+    def make(backend, **kw):
+        kw.setdefault("wait_ms", 50)
+        b = Batcher(backend, **kw)
+        made.append(b)
+        return b
+
+    yield make
+    for b in made:
+        b.close()
+
+
+def test_hash_backend_is_deterministic_and_normalised():
+    backend = HashBackend(dim=64)
+    a, b, c = backend.embed(["图 算法", "图  算法", "排序"])
+    assert np.array_equal(a, b)
+    assert np.isclose(np.linalg.norm(a), 1.0)
+    assert not np.array_equal(a, c)
+    assert backend.embed([]).shape == (0, 64)
+
+
+def test_make_backend_by_name():
+    assert isinstance(embeddings.make_backend("hash"), HashBackend)
+    with pytest.raises(ValueError):
+        embeddings.make_backend("random")
+
+
+def test_concurrent_requests_share_one_backend_call(batcher_factory):
+    backend = RecordingBackend()
+    batcher = batcher_factory(backend, batch_size=10, wait_ms=300)
+    futs = [batcher.submit(["a", "bb"]), batcher.submit(["bb", "ccc"]), batcher.submit([])]
+    results = [f.result(5) for f in futs]
+    assert backend.calls == [["a", "bb", "ccc"]]
+    assert results[1][:, 0].tolist() == [2, 3]
+    assert results[2].shape == (0, 4)
+    assert batcher.stats()["requests"] == 3
+
+
+def test_batches_are_split_at_batch_size(batcher_factory):
+    backend = RecordingBackend()
+    batcher = batcher_factory(backend, batch_size=2, wait_ms=0)
+    out = batcher.submit(["a", "b", "c"]).result(5)
+    assert [len(c) for c in backend.calls] == [2, 1]
+    assert out.shape == (3, 4)
+
+
+def test_cached_texts_are_not_embedded_again(tmp_path, batcher_factory):
+    path = str(tmp_path / "emb.db")
+    backend = RecordingBackend()
+    first = batcher_factory(backend, cache_path=path, wait_ms=0)
+    first.submit(["a", "bb"]).result(5)
+    first.close()
+
+    second = batcher_factory(backend, cache_path=path, wait_ms=0)
+    out = second.submit(["bb", "ccc"]).result(5)
+    assert backend.calls == [["a", "bb"], ["ccc"]]
+    assert out[:, 0].tolist() == [2, 3]
+    stats = second.stats()
+    assert stats["cache_hits"] == 1 and stats["embedded"] == 1
+
+
+def test_backend_errors_fail_every_waiting_request(batcher_factory):
+    batcher = batcher_factory(RecordingBackend(fail=True), wait_ms=0)
+    with pytest.raises(RuntimeError, match="503"):
+        batcher.submit(["a"]).result(5)
+    assert batcher.stats()["errors"] == 1
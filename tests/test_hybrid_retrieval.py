@@ -0,0 +1,112 @@
+import concurrent.futures
+
+import hybrid_retrieval
+from hybrid_retrieval import RetrievalCache, Retriever, approx_tokens, merge
+
+
+def test_approx_tokens_counts_cjk_per_character():
+    assert approx_tokens("") == 0
+    assert approx_tokens("图算法") == 3
+    assert approx_tokens("abcdefgh") == 2
+    assert approx_tokens("图ab") == 2
+
+
+def test_merge_drops_lines_seen_earlier_or_in_the_evidence():
+    blocks = [("naive", "A\nB"), ("local", "b\nC\n  A  ")]
+    text, stats = merge(blocks, 100, seen=hybrid_retrieval.seen_lines("c"))
+    assert text == "[naive]\nA\nB"
+    assert stats == {"lines": 2, "duplicates": 3, "truncated": False, "tokens": 2}
+
+
+def test_merge_keeps_headers_only_for_surviving_lines():
+    blocks = [("naive", "A"), ("local", "-----Entities-----\nA\n-----Relations-----\nR")]
+    text, _ = merge(blocks, 100)
+    assert text == "[naive]\nA\n\n[local]\n-----Relations-----\nR"
+
+
+def test_merge_stops_at_the_token_budget():
+    text, stats = merge([("naive", "一二三\n四五六\n七八九"), ("local", "X")], 7)
+    assert text == "[naive]\n一二三\n四五六"
+    assert stats["truncated"] and stats["tokens"] == 6
+
+
+def test_cache_evicts_least_recently_used():
+    cache = RetrievalCache(max_entries=2, ttl=60)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    assert cache.get("b") is None and cache.get("a") == "1"
+    assert cache.stats() == {"hits": 2, "misses": 1, "evictions": 1, "entries": 2}
+
+
+def test_cache_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(hybrid_retrieval.time, "time", lambda: now[0])
+    cache = RetrievalCache(max_entries=2, ttl=10)
+    cache.put("a", "1")
+    now[0] += 11
+    assert cache.get("a") is None
+
+
+class FakeBackend:
+    """submit() for Retriever; answers per mode, or raises/hangs for the given modes."""
+    def __init__(self, answers, hang=(), fail=()):
+        self.answers = answers
+        self.hang = set(hang)
+        self.fail = set(fail)
+        self.calls = []
+        self.gen = {"db1": 1}
+
+    def submit(self, db, question, mode, top_k, max_tokens):
+        self.calls.append((db, mode, max_tokens))
+        fut = concurrent.futures.Future()
+        if mode in self.fail:
+            fut.set_exception(RuntimeError("keyword extraction failed"))
+        elif mode not in self.hang:
+            fut.set_result(self.answers[mode])
+        return fut
+
+    def generation(self, db):
+        return self.gen.get(db, 0)
+
+
+def _retriever(backend):
+    return Retriever(backend.submit, backend.generation, RetrievalCache(ttl=60))
+
+
+def test_second_identical_query_is_served_from_cache():
+    backend = FakeBackend({"naive": "A\nB", "local": "B\nC"})
+    retriever = _retriever(backend)
+    first = retriever.retrieve("什么是图？", "db1", ("naive", "local"), 5, 100, seen_text="A")
+    assert first["context"] == "[naive]\nB\n\n[local]\nC"
+    assert first["modes"]["naive"]["cached"] is False
+    again = retriever.retrieve("  什么是图？ ", "db1", ("naive", "local"), 5, 100, seen_text="A")
+    assert again["context"] == first["context"]
+    assert again["modes"]["naive"] == {"cached": True, "tokens": approx_tokens("A\nB")}
+    assert len(backend.calls) == 2
+
+
+def test_generation_and_budget_are_part_of_the_cache_key():
+    backend = FakeBackend({"naive": "A"})
+    retriever = _retriever(backend)
+    retriever.retrieve("q", "db1", ("naive",), 5, 100)
+    retriever.retrieve("q", "db1", ("naive",), 5, 200)
+    backend.gen["db1"] = 2
+    retriever.retrieve("q", "db1", ("naive",), 5, 200)
+    retriever.retrieve("q", "db2", ("naive",), 5, 200)
+    assert backend.calls == [("db1", "naive", 100), ("db1", "naive", 200), ("db1", "naive", 200), ("db2", "naive", 200)]
+
+
+def test_failed_and_slow_modes_are_reported_not_raised():
+    backend = FakeBackend({"naive": "A"}, hang={"global"}, fail={"local"})
+    retriever = _retriever(backend)
+    out = retriever.retrieve("q", "db1", ("naive", "local", "global"), 5, 100,
+                             graph_lookup=lambda q: ["变量 -> 分支"], timeout=0.05)
+    assert out["context"] == "[naive]\nA"
+    assert out["modes"]["global"] == {"error": "timeout"}
+    assert out["modes"]["local"] == {"error": "keyword extraction failed"}
+    assert out["graph_paths"] == ["变量 -> 分支"]
+    # 失败的结果不进缓存
+    retriever.retrieve("q", "db1", ("local",), 5, 100)
+    assert backend.calls.count(("db1", "local", 100)) == 2
@@ -0,0 +1,296 @@
+import asyncio
+import base64
+import hashlib
+import json
+import importlib.machinery
+import importlib.util
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import types
+
+import pytest
+
+import task_store
+
+
+def _import_wrapper():
+    # lightrag_wrapper only checks at import that lightrag is installed; the
+    # tests replace get_rag, so a placeholder module stands in when it is not
+    if importlib.util.find_spec("lightrag") is not None:
+        import lightrag_wrapper
+        return lightrag_wrapper
+    placeholder = types.ModuleType("lightrag")
+    placeholder.__spec__ = importlib.machinery.ModuleSpec("lightrag", None)
+    sys.modules["lightrag"] = placeholder
+    try:
+        import lightrag_wrapper
+    finally:
+        sys.modules.pop("lightrag", None)
+    return lightrag_wrapper
+
+
+lw = _import_wrapper()
+
+
+class FakeRag:
+    """Stands in for a LightRAG instance; records every ainsert call.
+
+    Clearing `gate` holds every insert until it is set again.
+    """
+    def __init__(self, fail_on=()):
+        self.calls = []
+        self.fail_on = set(fail_on)
+        self.gate = threading.Event()
+        self.gate.set()
+
+    async def ainsert(self, chunks):
+        while not self.gate.is_set():
+            await asyncio.sleep(0.005)
+        self.calls.append(list(chunks))
+        if len(self.calls) in self.fail_on:
+            raise RuntimeError("upstream 502")
+
+
+def test_importing_the_task_queue_loads_no_heavy_packages():
+    # api_llm imports lightrag_wrapper at startup; LightRAG, numpy and the document
+    # parsers must only be loaded by the code paths that use them
+    code = textwrap.dedent("""
+        import importlib.machinery, importlib.util, json, sys, time, types
+        if importlib.util.find_spec("lightrag") is None:
+            placeholder = types.ModuleType("lightrag")
+            placeholder.__spec__ = importlib.machinery.ModuleSpec("lightrag", None)
+            sys.modules["lightrag"] = placeholder
+        t0 = time.perf_counter()
+        import lightrag_wrapper
+        ms = (time.perf_counter() - t0) * 1000
+        sys.modules.pop("lightrag", None)
+        heavy = ("lightrag", "numpy", "openai", "pypdf", "docx", "lxml", "embeddings")
+        print(json.dumps({"ms": ms, "loaded": sorted(m for m in heavy if m in sys.modules)}))
+    """)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, timeout=60, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    assert result["loaded"] == []
+    assert result["ms"] < 2000
+
+
+@pytest.fixture
+def indexing(tmp_path, monkeypatch):
+    """lightrag_wrapper with its jobs.db, spool directory and pool in tmp_path and a FakeRag."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "lightrag_data").mkdir()
+    monkeypatch.delenv("TASK_STORE", raising=False)
+    monkeypatch.setattr(lw, "tasks", task_store.TaskStore())
+    monkeypatch.setattr(lw, "_registry", lw._ContentRegistry(lw.JOBS_DB))
+    monkeypatch.setattr(lw, "_checkpoints", lw._CheckpointStore(lw.JOBS_DB))
+    monkeypatch.setattr(lw, "_generations", lw._GenerationStore(lw.JOBS_DB))
+    monkeypatch.setattr(lw, "_pool", lw._IndexingPool(1, 1))
+    monkeypatch.setattr(lw, "INDEX_CHUNK_SIZE", 100)
+    monkeypatch.setattr(lw, "INDEX_CHUNK_OVERLAP", 0)
+    monkeypatch.setattr(lw, "INDEX_CHUNK_BATCH", 2)
+    monkeypatch.setattr(lw, "INDEX_DEDUP", True)
+    rag = FakeRag()
+
+    async def get_rag(db_name="neo4j"):
+        return rag
+
+    monkeypatch.setattr(lw, "get_rag", get_rag)
+    return rag
+
+
+def _document(tag, paragraphs=6):
+    # 每段恰好填满一个分块，分块数与内容都可预期
+    return "\n\n".join(f"{tag}{i}" + "知" * (97 - len(f"{tag}{i}")) + "。" for i in range(paragraphs))
+
+
+def _wait_for(task_id, status, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if lw.get_task_status(task_id)["status"] == status:
+            return
+        time.sleep(0.005)
+    raise AssertionError(f"task {task_id} never reached {status}: {lw.get_task_status(task_id)}")
+
+
+def _tags(rag):
+    # 每个文档的分块以其标签开头，按 ainsert 调用顺序列出
+    return [call[0][0] for call in rag.calls]
+
+
+def _wait(task_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        task = lw.get_task_status(task_id)
+        if task and task["status"] in lw.TERMINAL_STATUSES:
+            return task
+        time.sleep(0.02)
+    raise AssertionError(f"task {task_id} did not finish: {lw.get_task_status(task_id)}")
+
+
+def test_same_upload_to_the_same_db_returns_the_existing_task(indexing):
+    first = lw.submit_indexing_task(_document("A"), "text", "a.txt", "db1")
+    assert lw.submit_indexing_task(_document("A"), "text", "a.txt", "db1") == first
+    assert lw.submit_indexing_task(_document("A"), "text", "a.txt", "db2") != first
+    assert _wait(first)["status"] == "completed"
+
+
+def test_base64_and_raw_uploads_of_one_file_are_deduplicated(indexing, tmp_path):
+    data = _document("B").encode("utf-8")
+    first = lw.submit_indexing_task(base64.b64encode(data).decode("ascii"), "binary", "b.txt", "db1")
+    path = tmp_path / "upload.part"
+    path.write_bytes(data)
+    again = lw.submit_indexing_file(str(path), "b.txt", "db1", 0, hashlib.sha256(data).hexdigest(), len(data))
+    assert again == first
+    assert not path.exists()
+    assert _wait(first)["status"] == "completed"
+
+
+def test_chunks_already_in_the_db_are_not_inserted_again(indexing):
+    first = _wait(lw.submit_indexing_task(_document("C", 4), "text", "c.txt", "db1"))
+    assert first["dedup_misses"] == 4
+    # 前四段相同，只多出两段
+    second = _wait(lw.submit_indexing_task(_document("C", 6), "text", "c2.txt", "db1"))
+    assert second["status"] == "completed"
+    assert (second["dedup_hits"], second["dedup_misses"]) == (4, 2)
+    inserted = [c for call in indexing.calls for c in call]
+    assert len(inserted) == len(set(inserted)) == 6
+
+
+def test_reindexing_identical_text_reports_the_original(indexing):
+    first = _wait(lw.submit_indexing_task(_document("D"), "text", "d.txt", "db1"))
+    # 仅空白不同的文本：文件哈希不同，清洗后的文本哈希相同
+    second = _wait(lw.submit_indexing_task(_document("D").replace("\n\n", "\n\n  \n"), "text", "d2.txt", "db1"))
+    assert second["duplicate_of"] == first["id"]
+    assert second["dedup_misses"] == 0
+
+
+def test_failed_job_resumes_from_its_last_checkpoint(indexing):
+    indexing.fail_on = {2}
+    task_id = lw.submit_indexing_task(_document("E"), "text", "e.txt", "db1")
+    failed = _wait(task_id)
+    assert failed["status"] == "failed" and failed["resumable"]
+    assert (failed["chunks_done"], failed["chunks_total"]) == (2, 6)
+
+    assert lw.resume_task(task_id)
+    done = _wait(task_id)
+    assert done["status"] == "completed" and done["chunks_done"] == 6
+    # 第一组不重复写入；失败的第二组整体重试
+    assert len(indexing.calls) == 4 and indexing.calls[1] == indexing.calls[2]
+    stored = [c for i, call in enumerate(indexing.calls, 1) if i not in indexing.fail_on for c in call]
+    assert len(stored) == len(set(stored)) == 6
+
+
+def test_only_failed_or_cancelled_jobs_can_be_resumed(indexing):
+    task_id = lw.submit_indexing_task(_document("F", 2), "text", "f.txt", "db1")
+    assert _wait(task_id)["status"] == "completed"
+    assert not lw.resume_task(task_id)
+    assert not lw.resume_task("no-such-task")
+
+
+def test_index_generation_counts_completed_jobs_across_restarts(indexing, monkeypatch):
+    assert lw.index_generation("db1") == 0
+    _wait(lw.submit_indexing_task(_document("N", 1), "text", "n.txt", "db1"))
+    indexing.fail_on = {2}
+    _wait(lw.submit_indexing_task(_document("O", 1), "text", "o.txt", "db1"))
+    assert lw.index_generation("db1") == 1 and lw.index_generation("db2") == 0
+    monkeypatch.setattr(lw, "_generations", lw._GenerationStore(lw.JOBS_DB))
+    assert lw.index_generation("db1") == 1
+
+
+def test_listeners_hear_about_completed_jobs_only(indexing, monkeypatch):
+    heard = []
+    monkeypatch.setattr(lw, "_index_listeners", [heard.append])
+    _wait(lw.submit_indexing_task(_document("J", 1), "text", "j.txt", "db1"))
+    indexing.fail_on = {2}
+    _wait(lw.submit_indexing_task(_document("K", 1), "text", "k.txt", "db2"))
+    assert heard == ["db1"]
+
+
+def test_stale_failed_jobs_lose_their_spool_and_checkpoints(indexing, monkeypatch):
+    indexing.fail_on = {2}
+    task_id = lw.submit_indexing_task(_document("G"), "text", "g.txt", "db1")
+    assert _wait(task_id)["resumable"]
+    # 模拟重启：内存中的记录已不在，只剩 jobs.db
+    monkeypatch.setattr(lw, "tasks", task_store.TaskStore(lw.tasks.backend))
+    lw._sweep_stale_jobs()
+    assert lw.get_task_status(task_id)["resumable"]
+    assert lw._checkpoints.done(task_id) == {0, 1}
+
+    monkeypatch.setattr(lw, "INDEX_RESUME_HOURS", 0)
+    lw._sweep_stale_jobs()
+    assert not lw.get_task_status(task_id)["resumable"]
+    assert lw._checkpoints.done(task_id) == set()
+    assert not lw.resume_task(task_id)
+
+
+def test_queued_jobs_run_by_priority_then_submission_order(indexing):
+    indexing.gate.clear()
+    first = lw.submit_indexing_task(_document("P", 1), "text", "p.txt", "db1")
+    _wait_for(first, "running")
+    later = [lw.submit_indexing_task(_document(tag, 1), "text", f"{tag}.txt", "db1", priority=priority)
+             for tag, priority in (("L", 0), ("H", 5), ("I", 5))]
+    indexing.gate.set()
+    for task_id in [first] + later:
+        assert _wait(task_id)["status"] == "completed"
+    assert _tags(indexing) == ["P", "H", "I", "L"]
+
+
+def test_jobs_over_the_per_db_cap_wait_without_blocking_other_dbs(indexing, monkeypatch):
+    monkeypatch.setattr(lw, "_pool", lw._IndexingPool(2, 1))
+    indexing.gate.clear()
+    a = lw.submit_indexing_task(_document("A", 1), "text", "a.txt", "db1")
+    _wait_for(a, "running")
+    b = lw.submit_indexing_task(_document("B", 1), "text", "b.txt", "db1")
+    c = lw.submit_indexing_task(_document("C", 1), "text", "c.txt", "db2")
+    _wait_for(c, "running")
+    assert lw.get_task_status(b)["status"] == "queued"
+    assert lw._pool.stats()["deferred"] == 1
+    indexing.gate.set()
+    for task_id in (a, b, c):
+        assert _wait(task_id)["status"] == "completed"
+    # 延后的任务在 db1 空出名额后才交还队列
+    assert _tags(indexing).index("B") > _tags(indexing).index("A")
+    assert lw._pool.stats()["deferred"] == 0
+
+
+def test_cancelling_queued_and_running_jobs(indexing):
+    indexing.gate.clear()
+    running = lw.submit_indexing_task(_document("R", 1), "text", "r.txt", "db1")
+    _wait_for(running, "running")
+    queued = lw.submit_indexing_task(_document("Q", 1), "text", "q.txt", "db1")
+    assert lw.cancel_task(queued)
+    assert lw.get_task_status(queued)["status"] == "cancelled"
+    assert lw.cancel_task(running)
+    cancelled = _wait(running)
+    assert cancelled["status"] == "cancelled" and cancelled["resumable"]
+    assert not lw.cancel_task(running)
+    indexing.gate.set()
+    # 同一个 worker 处理完已取消的排队任务后才会轮到这个
+    assert _wait(lw.submit_indexing_task(_document("S", 1), "text", "s.txt", "db1"))["status"] == "completed"
+    assert _tags(indexing) == ["S"]
+
+
+def test_cancel_landing_between_the_worker_check_and_start_wins(indexing, monkeypatch):
+    real_get = lw.tasks.get
+    raced = []
+
+    def get(task_id):
+        task = real_get(task_id)
+        if threading.current_thread().name == "indexing-loop" and not raced and task is not None:
+            # worker 已读到 'queued'，此时另一线程取消了任务
+            raced.append(task_id)
+            seen = task_store.TaskRecord(task.to_dict())
+            raced.append(lw.cancel_task(task_id))
+            return seen
+        return task
+
+    monkeypatch.setattr(lw.tasks, "get", get)
+    task_id = lw.submit_indexing_task(_document("X", 1), "text", "x.txt", "db1")
+    assert _wait(lw.submit_indexing_task(_document("Y", 1), "text", "y.txt", "db1"))["status"] == "completed"
+    assert raced == [task_id, True]
+    assert lw.get_task_status(task_id)["status"] == "cancelled"
+    assert _tags(indexing) == ["Y"]
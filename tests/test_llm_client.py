@@ -0,0 +1,98 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import llm_client
+
+
+class _Upstream(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    statuses = []     # status codes to answer with, in order; 200 once exhausted
+    body = {}
+    peers = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        type(self).peers.append(self.client_address)
+        status = type(self).statuses.pop(0) if type(self).statuses else 200
+        data = json.dumps(type(self).body if status == 200 else {"error": {"message": "busy"}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def upstream():
+    _Upstream.statuses = []
+    _Upstream.peers = []
+    _Upstream.body = {"choices": [{"message": {"content": "ok"}}]}
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Upstream)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:%d/v1" % srv.server_address[1]
+    srv.shutdown()
+    srv.server_close()
+
+
+def _client(**kw):
+    kw.setdefault("retries", 2)
+    return llm_client.LLMClient(pool_size=2, connect_timeout=2, read_timeout=5, backoff=0.001, **kw)
+
+
+def test_complete_reuses_one_keep_alive_connection(upstream):
+    client = _client()
+    for _ in range(3):
+        assert client.complete([{"role": "user", "content": "hi"}], "m", upstream, "k") == "ok"
+    pool = client.stats()["pools"][0]
+    assert pool["created"] == 1
+    assert pool["in_use"] == 0 and pool["idle"] == 1
+    assert len(set(_Upstream.peers)) == 1
+
+
+def test_retries_retryable_status_then_succeeds(upstream):
+    _Upstream.statuses = [503, 429]
+    client = _client()
+    assert client.complete([], "m", upstream, "k") == "ok"
+    stats = client.stats()
+    assert stats["retries"] == 2 and stats["failures"] == 0
+
+
+def test_gives_up_after_retries(upstream):
+    _Upstream.statuses = [502, 502, 502]
+    client = _client(retries=1)
+    with pytest.raises(llm_client.LLMUnavailable, match="busy"):
+        client.complete([], "m", upstream, "k")
+    assert client.stats()["retries"] == 1
+    assert _Upstream.statuses == [502]
+
+
+def test_client_error_is_not_retried(upstream):
+    _Upstream.statuses = [400]
+    client = _client()
+    with pytest.raises(llm_client.LLMUnavailable, match="busy"):
+        client.complete([], "m", upstream, "k")
+    assert client.stats()["retries"] == 0
+
+
+def test_embed_returns_vectors_in_input_order(upstream):
+    _Upstream.body = {"data": [{"index": 1, "embedding": [2.0]}, {"index": 0, "embedding": [1.0]}]}
+    assert _client().embed(["a", "b"], "e", upstream, "k") == [[1.0], [2.0]]
+
+
+def test_embed_rejects_count_mismatch(upstream):
+    _Upstream.body = {"data": [{"index": 0, "embedding": [1.0]}]}
+    with pytest.raises(llm_client.LLMUnavailable):
+        _client().embed(["a", "b"], "e", upstream, "k")
+
+
+def test_unreachable_host_raises_after_retries():
+    client = _client(retries=1)
+    with pytest.raises(llm_client.LLMUnavailable):
+        client.complete([], "m", "http://127.0.0.1:9/v1", "k")
+    assert client.stats()["pools"][0]["in_use"] == 0
@@ -0,0 +1,66 @@
+import mastery_store
+from mastery_store import MasteryStore
+
+
+def test_last_answer_wins_and_answered_is_kept():
+    store = MasteryStore()
+    store.record_answers("s1", [("q1", True), ("q2", False), ("q1", False), ("q2", True)])
+    assert sorted(store.correct_questions("s1")) == ["q2"]
+    assert sorted(store.answered_questions("s1")) == ["q1", "q2"]
+
+
+def test_learners_are_independent():
+    store = MasteryStore()
+    store.record_answers("s1", [("q1", True)])
+    store.mark_mastered("s1", ["c1"])
+    assert store.correct_questions("s2") == []
+    assert store.mastered("s2") == set()
+    assert store.mastered("s1") == {"c1"}
+
+
+def test_evicted_learner_is_replayed_from_the_loader():
+    log = {"s1": [("q1", True), (mastery_store.CONCEPT_PREFIX + "c1", True), ("q2", True), ("q2", False)]}
+    store = MasteryStore(loader=lambda sid: log.get(sid, []), max_learners=1)
+    assert store.correct_questions("s1") == ["q1"]
+    assert store.mastered("s1") == {"c1"}
+    store.correct_questions("s2")                 # evicts s1
+    assert store.stats()["evictions"] == 1
+    assert store.correct_questions("s1") == ["q1"]
+    assert store.stats()["loads"] == 3
+
+
+def test_failed_load_is_not_cached():
+    log = {"s1": [("q1", True)]}
+    available = [False]
+
+    def loader(session_id):
+        if not available[0]:
+            raise mastery_store.LoadUnavailable("log unavailable")
+        return log[session_id]
+
+    store = MasteryStore(loader=loader)
+    assert store.correct_questions("s1") == []
+    assert store.stats()["learners"] == 0 and store.stats()["load_errors"] == 1
+    available[0] = True
+    assert store.correct_questions("s1") == ["q1"]
+    assert store.stats()["learners"] == 1
+
+
+def test_unexpected_loader_errors_are_not_cached_either():
+    calls = []
+
+    def loader(session_id):
+        calls.append(session_id)
+        raise RuntimeError("boom")
+
+    store = MasteryStore(loader=loader)
+    store.mastered("s1")
+    store.mastered("s1")
+    assert len(calls) == 2 and store.stats()["learners"] == 0
+
+
+def test_keys_are_interned_once_across_learners():
+    store = MasteryStore()
+    for sid in ("a", "b", "c"):
+        store.record_answers(sid, [("q1", True), ("q2", True)])
+    assert store.stats()["questions"] == 2
@@ -0,0 +1,104 @@
+import pytest
+
+import metrics
+import tracing
+from metrics import Counter, Histogram
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, "_metrics", [])
+    monkeypatch.setattr(metrics, "_collectors", [])
+
+
+def test_counter_renders_sorted_labelled_samples():
+    c = Counter("requests_total", "Requests", ("route", "status"))
+    c.inc("/llm", "200")
+    c.inc("/llm", "200", n=2)
+    c.inc("/graph", "500")
+    assert c.render() == [
+        'requests_total{route="/graph",status="500"} 1',
+        'requests_total{route="/llm",status="200"} 3',
+    ]
+
+
+def test_unlabelled_counter_has_no_braces():
+    c = Counter("ticks_total", "Ticks")
+    c.inc()
+    assert c.render() == ["ticks_total 1"]
+
+
+def test_label_values_are_escaped():
+    c = Counter("x_total", "X", ("v",))
+    c.inc('a"b\\c\nd')
+    assert c.render() == ['x_total{v="a\\"b\\\\c\\nd"} 1']
+
+
+def test_histogram_buckets_are_cumulative_with_inf_sum_and_count():
+    h = Histogram("latency_seconds", "Latency", ("dep",), buckets=(1, 0.1))
+    for v in (0.05, 0.5, 0.7, 3):
+        h.observe(v, "llm")
+    assert h.render() == [
+        'latency_seconds_bucket{dep="llm",le="0.1"} 1',
+        'latency_seconds_bucket{dep="llm",le="1"} 3',
+        'latency_seconds_bucket{dep="llm",le="+Inf"} 4',
+        'latency_seconds_sum{dep="llm"} 4.25',
+        'latency_seconds_count{dep="llm"} 4',
+    ]
+
+
+def test_render_includes_help_type_and_collectors(registry, capsys):
+    metrics.counter("hits_total", "Cache hits").inc(n=5)
+
+    def broken():
+        raise RuntimeError("pool gone")
+
+    metrics.add_collector(broken)
+    metrics.add_collector(lambda: [
+        ("queue_depth", "gauge", "Queued tasks", [({"db": "main"}, 3), ({"db": "idle"}, None)]),
+    ])
+    text = metrics.render().decode("utf-8")
+    assert text == (
+        "# HELP hits_total Cache hits\n"
+        "# TYPE hits_total counter\n"
+        "hits_total 5\n"
+        "# HELP queue_depth Queued tasks\n"
+        "# TYPE queue_depth gauge\n"
+        'queue_depth{db="main"} 3\n'
+    )
+    assert "pool gone" in capsys.readouterr().out
+
+
+def test_timed_sums_dependency_time_per_request(registry, monkeypatch):
+    seen = []
+    monkeypatch.setattr(metrics.DEPENDENCY_SECONDS, "observe", lambda v, dep: seen.append(dep))
+    ticks = iter([1.0, 1.5, 2.0, 2.25, 3.0, 4.0])
+    monkeypatch.setattr(metrics.time, "perf_counter", lambda: next(ticks))
+
+    metrics.begin_request()
+    with metrics.timed("neo4j"):
+        pass
+    with metrics.timed("neo4j"):
+        pass
+    assert metrics.end_request() == {"neo4j": 0.75}
+
+    with metrics.timed("mysql"):
+        pass
+    assert metrics.end_request() == {}
+    assert seen == ["neo4j", "neo4j", "mysql"]
+
+
+def test_timed_call_is_a_span_of_the_current_trace():
+    tracing.start("r1", "GET", "/graph")
+    try:
+        with pytest.raises(ValueError):
+            with metrics.timed("neo4j"):
+                raise ValueError("bad cypher")
+        metrics.degraded("graph_fallback")
+        trace = tracing.current()
+        assert [s["name"] for s in trace.spans] == ["neo4j"]
+        assert trace.spans[0]["error"] == "ValueError"
+        assert trace.attrs == {"degraded": "graph_fallback"}
+    finally:
+        tracing.finish(200)
+    assert metrics.DEGRADED.values[("graph_fallback",)] >= 1
@@ -0,0 +1,104 @@
+from prereq_dag import LearnerFrontier, PrereqDAG, PrereqEngine
+
+#   a ─┬─> c ──> e
+#   b ─┘   d ──┘
+NAMES = {"a": "变量", "b": "表达式", "c": "分支", "d": "循环", "e": "函数"}
+EDGES = [("a", "c"), ("b", "c"), ("c", "e"), ("d", "e"), ("a", "c")]
+
+
+def test_csr_layout_and_in_degrees():
+    dag = PrereqDAG(NAMES, EDGES)
+    ids = dag.ids
+    assert sorted(dag.keys[j] for j in dag.successors(ids["a"])) == ["c"]
+    assert list(dag.successors(ids["e"])) == []
+    assert dag.indeg[ids["c"]] == 2 and dag.indeg[ids["e"]] == 2
+    assert len(dag.targets) == 4            # 重复边只计一次
+    assert sorted(dag.keys[i] for i in dag.roots) == ["a", "b", "d"]
+
+
+def test_topological_rank_orders_prerequisites_first():
+    dag = PrereqDAG(NAMES, EDGES)
+    for src, dst in EDGES:
+        assert dag.rank[dag.ids[src]] < dag.rank[dag.ids[dst]]
+
+
+def test_nodes_only_seen_in_edges_and_cycles_are_tolerated():
+    dag = PrereqDAG({"a": "A"}, [("a", "x"), ("x", "y"), ("y", "x"), ("z", "z")])
+    assert set(dag.keys) == {"a", "x", "y", "z"}
+    assert sorted(dag.rank) == list(range(4))
+    assert len(dag.targets) == 3            # 自环被忽略
+
+
+def test_node_unlocks_only_when_all_prerequisites_are_mastered():
+    dag = PrereqDAG(NAMES, EDGES)
+    learner = LearnerFrontier(dag)
+    ids = dag.ids
+    assert learner.mark(ids["a"]) == []
+    assert learner.mark(ids["a"]) == []     # 重复标记不重复计数
+    assert learner.mark(ids["b"]) == [ids["c"]]
+    assert learner.mark(ids["d"]) == []
+    assert learner.mark(ids["c"]) == [ids["e"]]
+    assert learner.frontier == {ids["e"]}
+
+
+def test_frontier_is_rebuilt_from_mastered_keys():
+    dag = PrereqDAG(NAMES, EDGES)
+    learner = LearnerFrontier(dag, ["a", "b", "unknown"])
+    assert {dag.keys[i] for i in learner.frontier} == {"c", "d"}
+
+
+def _engine(mastered):
+    return PrereqEngine(lambda: (NAMES, EDGES), lambda sid: mastered.get(sid, set()), ttl=3600)
+
+
+def test_engine_mark_and_recommend():
+    mastered = {"s1": set()}
+    engine = _engine(mastered)
+    assert [r["id"] for r in engine.recommend("s1", k=5)] == ["a", "b", "d"]
+    mastered["s1"] |= {"a", "b"}
+    assert engine.mark("s1", ["a", "b"]) == ["c"]
+    assert [r["id"] for r in engine.recommend("s1", k=2)] == ["d", "c"]
+
+
+def test_fresh_learner_reports_unlocks_from_the_marked_nodes():
+    # mastery_store 已包含本次标记：新建的 frontier 已计入，解锁结果从 frontier 读出
+    engine = _engine({"s1": {"a", "b"}})
+    assert engine.mark("s1", ["b"]) == ["c"]
+    assert engine.stats()["learners"] == 1
+
+
+def test_remarking_with_a_cold_frontier_reports_nothing_new():
+    mastered = {"s1": {"a", "b"}}
+    assert _engine(mastered).mark("s1", ["a", "b"], already=set()) == ["c"]
+    # 新进程（或快照刷新后）的 frontier 从 mastery 重建，早已解锁的 c 不再计入
+    engine = _engine(mastered)
+    assert engine.mark("s1", ["a"], already={"a", "b"}) == []
+    assert engine.stats()["unlocked"] == 0
+    mastered["s1"].add("d")
+    assert engine.mark("s1", ["d"], already={"a", "b"}) == []
+    mastered["s1"].add("c")
+    assert engine.mark("s1", ["c", "a"], already={"a", "b", "d"}) == ["e"]
+
+
+def test_unknown_nodes_mark_the_snapshot_stale():
+    engine = _engine({})
+    assert engine.mark("s1", ["nope"]) == []
+    assert engine.stale and engine.stats()["unknown_nodes"] == 1
+
+
+def test_engine_without_a_snapshot_returns_none():
+    def loader():
+        raise RuntimeError("neo4j unavailable")
+
+    engine = PrereqEngine(loader, lambda sid: set(), ttl=60)
+    assert engine.mark("s1", ["a"]) is None
+    assert engine.recommend("s1") is None
+
+
+def test_learners_are_evicted_least_recently_used_first():
+    engine = PrereqEngine(lambda: (NAMES, EDGES), lambda sid: set(), ttl=3600, max_learners=2)
+    for sid in ("s1", "s2", "s1", "s3"):
+        engine.recommend(sid)
+    assert set(engine.learners) == {"s1", "s3"}
+    engine.forget("s1")
+    assert set(engine.learners) == {"s3"}
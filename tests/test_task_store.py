@@ -0,0 +1,137 @@
+import threading
+
+import pytest
+
+import task_store
+from task_store import SQLiteTaskBackend, TaskRecord, TaskStore
+
+
+def _task(task_id, status="queued", created_at=1.0, **fields):
+    return dict(id=task_id, status=status, created_at=created_at, db_name="db1", **fields)
+
+
+def test_record_supports_dict_access_and_extra_fields():
+    task = TaskRecord({"id": "t1", "status": "queued", "resumable": True})
+    assert task["status"] == "queued" and task["resumable"] is True
+    assert task.get("error", "none") == "none"
+    assert "status" in task and "error" not in task
+    with pytest.raises(KeyError):
+        task["missing"]
+    task["error"] = "boom"
+    assert task.to_dict() == {"id": "t1", "status": "queued", "error": "boom", "resumable": True}
+
+
+def test_update_bumps_the_version_and_returns_the_previous_status():
+    store = TaskStore()
+    store.add(_task("t1"))
+    start = store.version
+    before, task = store.update("t1", {"status": "running"})
+    assert before == "queued" and task.status == "running"
+    assert task.version == store.version == start + 1
+    assert store.update("nope", {"status": "running"}) == (None, None)
+
+
+def test_expected_status_makes_update_a_compare_and_set():
+    store = TaskStore()
+    store.add(_task("t1"))
+    version = store.version
+    assert store.update("t1", {"status": "running"}, expect=("cancelled",)) == ("queued", None)
+    assert store.get("t1").status == "queued" and store.version == version
+    before, task = store.update("t1", {"status": "running"}, expect=("queued",))
+    assert before == "queued" and task.status == "running"
+
+
+def test_finished_tasks_are_evicted_beyond_keep_finished():
+    store = TaskStore(keep_finished=2)
+    for i in range(4):
+        store.add(_task(f"t{i}"))
+    store.add(_task("live", status="running"))
+    for i in range(4):
+        store.update(f"t{i}", {"status": "completed"})
+    assert set(store.tasks) == {"t2", "t3", "live"}
+    assert store.stats()["evictions"] == 2
+
+
+def test_finished_tasks_are_evicted_after_keep_seconds(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(task_store.time, "time", lambda: now[0])
+    store = TaskStore(keep_seconds=60)
+    store.add(_task("old"))
+    store.add(_task("queued"))
+    store.update("old", {"status": "failed"})
+    now[0] += 61
+    store.add(_task("new"))
+    assert "old" not in store and "queued" in store and "new" in store
+
+
+def test_expired_tasks_are_evicted_on_reads_without_further_changes(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(task_store.time, "time", lambda: now[0])
+    store = TaskStore(keep_seconds=60)
+    for task_id in ("a", "b", "live"):
+        store.add(_task(task_id))
+    store.update("a", {"status": "completed"})
+    store.update("b", {"status": "cancelled"})
+    now[0] += 61
+    assert store.get("a") is None
+    assert [t["id"] for t in store.list()] == ["live"]
+    assert store.snapshot("b") is None and "live" in store
+    assert store.stats()["evictions"] == 2
+
+
+def test_wait_returns_changes_after_since():
+    store = TaskStore()
+    store.add(_task("t1"))
+    since = store.version
+    timer = threading.Timer(0.05, store.update, ("t1", {"status": "running"}))
+    timer.start()
+    version, changed = store.wait(["t1", "unknown"], since, timeout=5)
+    timer.join()
+    assert version == since + 1
+    assert [t["status"] for t in changed] == ["running"]
+
+
+def test_wait_times_out_without_changes():
+    store = TaskStore()
+    store.add(_task("t1"))
+    store.update("t1", {"status": "running"})
+    assert store.wait(["t1"], store.version, timeout=0.05) == (store.version, [])
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return SQLiteTaskBackend(str(tmp_path / "jobs.db"))
+
+
+def test_backend_list_pages_newest_first_with_filters(backend):
+    for i, (status, db) in enumerate([("completed", "db1"), ("failed", "db1"), ("queued", "db2"),
+                                      ("completed", "db2"), ("completed", "db1")]):
+        backend.save(dict(_task(f"t{i}", status=status, created_at=float(i // 2)), db_name=db))
+    first = backend.list(limit=2)
+    assert [r["id"] for r in first] == ["t4", "t3"]
+    last = first[-1]
+    assert [r["id"] for r in backend.list(before=(last["created_at"], last["id"]), limit=10)] == ["t2", "t1", "t0"]
+    assert [r["id"] for r in backend.list(statuses=["completed"], db_name="db1")] == ["t4", "t0"]
+    assert [r["id"] for r in backend.pending()] == ["t2"]
+
+
+def test_evicted_tasks_are_loaded_back_from_the_backend(backend):
+    store = TaskStore(backend, keep_finished=1)
+    for i in range(3):
+        store.add(_task(f"t{i}", created_at=float(i)))
+        store.update(f"t{i}", {"status": "completed", "message": f"done {i}"})
+    assert "t0" not in store
+    assert store.snapshot("t0")["message"] == "done 0"
+    assert [r["id"] for r in store.list()] == ["t2", "t1", "t0"]
+    assert store.load("t0")["message"] == "done 0" and "t0" in store
+    assert store.load("nope") is None
+
+
+def test_attach_writes_existing_records_through(backend):
+    store = TaskStore()
+    store.add(_task("t1"))
+    store.attach(backend)
+    assert backend.get("t1")["status"] == "queued"
+    store.update("t1", {"status": "running"})
+    assert backend.get("t1")["status"] == "running"
+    assert [r["id"] for r in store.pending()] == ["t1"]
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture(autouse=True)
+def clean_trace(monkeypatch):
+    for name in ("TRACE_LOG", "TRACE_SAMPLE", "TRACE_SLOW_MS", "PROFILE_SAMPLE", "PROFILE_ALLOW_QUERY"):
+        monkeypatch.delenv(name, raising=False)
+    yield
+    tracing.finish(0)
+
+
+def test_request_id_header_is_validated():
+    assert tracing.new_request_id("abc-123.x_y") == "abc-123.x_y"
+    for bad in (None, "", "has space", "a" * 65, "x;rm"):
+        rid = tracing.new_request_id(bad)
+        assert rid != bad and len(rid) == 16
+
+
+def test_spans_are_noops_outside_a_request():
+    with tracing.span("orphan"):
+        tracing.add_span("late", 0.0, 1.0)
+        tracing.annotate(k=1)
+    assert tracing.current() is None and tracing.timings() == {}
+
+
+def test_nested_spans_record_their_parent():
+    tracing.start("r1", "POST", "/llm")
+    with tracing.span("retrieval", mode="naive") as s:
+        with tracing.span("neo4j"):
+            pass
+        s.set(hits=3)
+    spans = tracing.current().spans
+    assert [s["name"] for s in spans] == ["neo4j", "retrieval"]
+    assert spans[0]["parent"] == "retrieval"
+    assert "parent" not in spans[1]
+    assert spans[1]["attrs"] == {"mode": "naive", "hits": 3}
+
+
+def test_timings_sum_repeated_spans_and_report_total():
+    trace = tracing.start("r1", "POST", "/llm")
+    with tracing.span("llm"):
+        tracing.add_span("rag", trace.t0, 0.25, mode="naive")
+    tracing.add_span("rag", trace.t0, 0.5)
+    timings = tracing.timings()
+    assert timings["rag"] == 750.0
+    assert set(timings) == {"llm", "rag", "total"}
+    assert tracing.current().spans[0]["parent"] == "llm"
+
+
+def test_finish_writes_sampled_traces(tmp_path, monkeypatch):
+    log = tmp_path / "trace.jsonl"
+    monkeypatch.setenv("TRACE_LOG", str(log))
+    monkeypatch.setenv("TRACE_SAMPLE", "1")
+    tracing.start("r1", "GET", "/graph")
+    tracing.annotate(degraded="graph_fallback")
+    rec = tracing.finish(200)
+    assert tracing.current() is None
+    line = json.loads(log.read_text(encoding="utf-8").splitlines()[-1])
+    assert line == rec
+    assert line["request_id"] == "r1" and line["status"] == 200
+    assert line["attrs"] == {"degraded": "graph_fallback"}
+
+
+def test_unsampled_fast_traces_are_not_written(tmp_path, monkeypatch):
+    log = tmp_path / "trace.jsonl"
+    monkeypatch.setenv("TRACE_LOG", str(log))
+    monkeypatch.setenv("TRACE_SAMPLE", "0")
+    tracing.start("fast", "GET", "/graph")
+    tracing.finish(200)
+    monkeypatch.setenv("TRACE_SLOW_MS", "0")
+    tracing.start("slow", "GET", "/graph")
+    tracing.finish(200)
+    ids = [json.loads(l)["request_id"] for l in log.read_text(encoding="utf-8").splitlines()]
+    assert ids == ["slow"]
@@ -0,0 +1,119 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+import upload_stream
+from upload_stream import UploadError, UploadTooLarge
+
+BOUNDARY = "----form7MA4YWxk"
+# 文件内容中包含与分隔符相近的字节，检验分块边界处不会误切
+PAYLOAD = b"%PDF-1.4\r\n------form7MA4YWx not a delimiter\r\n--" + bytes(range(256)) * 8
+
+
+def _multipart(payload=PAYLOAD, filename="C:\\docs\\report.pdf"):
+    parts = [
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="db_name"\r\n\r\nneo4j\r\n'.encode(),
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: application/pdf\r\n\r\n'.encode() + payload + b"\r\n",
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="priority"\r\n\r\n5\r\n'.encode(),
+        f"--{BOUNDARY}--\r\n".encode(),
+    ]
+    return b"".join(parts)
+
+
+def _headers(body, **extra):
+    headers = {"Content-Type": f'multipart/form-data; boundary="{BOUNDARY}"', "Content-Length": str(len(body))}
+    headers.update(extra)
+    return headers
+
+
+def _receive(tmp_path, body, headers, max_bytes=1 << 20):
+    return upload_stream.receive(io.BytesIO(body), headers, str(tmp_path), max_bytes)
+
+
+@pytest.mark.parametrize("block", [1, 3, 7, 16, 17, 64, 4096])
+def test_multipart_file_and_fields_for_any_block_split(tmp_path, monkeypatch, block):
+    monkeypatch.setattr(upload_stream, "BLOCK", block)
+    body = _multipart()
+    up = _receive(tmp_path, body, _headers(body))
+    with open(up["path"], "rb") as f:
+        assert f.read() == PAYLOAD
+    assert up["size"] == len(PAYLOAD)
+    assert up["sha256"] == hashlib.sha256(PAYLOAD).hexdigest()
+    assert up["filename"] == "report.pdf"
+    assert up["fields"] == {"db_name": "neo4j", "priority": "5"}
+
+
+def test_raw_chunked_body(tmp_path):
+    data = b"hello world, " * 50
+    body = b"".join(b"%x;ext=1\r\n%s\r\n" % (len(data[i:i + 100]), data[i:i + 100])
+                    for i in range(0, len(data), 100)) + b"0\r\nX-Trailer: 1\r\n\r\n"
+    up = _receive(tmp_path, body, {"Transfer-Encoding": "chunked", "Content-Type": "application/octet-stream"})
+    assert open(up["path"], "rb").read() == data
+    assert up["filename"] is None and up["fields"] == {}
+
+
+def test_content_length_over_limit_is_rejected_up_front(tmp_path):
+    with pytest.raises(UploadTooLarge):
+        _receive(tmp_path, b"", {"Content-Length": str(10 << 20)}, max_bytes=1 << 20)
+    assert os.listdir(tmp_path) == []
+
+
+def test_limit_is_enforced_while_streaming(tmp_path):
+    body = b"x" * 5000
+    with pytest.raises(UploadTooLarge) as err:
+        _receive(tmp_path, body, {"Content-Length": str(len(body))}, max_bytes=1000)
+    assert err.value.status == 413
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("body, headers, message", [
+    (b"abc", {"Content-Length": "10"}, "truncated"),
+    (b"", {"Content-Length": "0"}, "empty"),
+    (b"zz\r\n", {"Transfer-Encoding": "chunked"}, "malformed"),
+    (b"x", {"Content-Type": "multipart/form-data", "Content-Length": "1"}, "boundary"),
+])
+def test_malformed_bodies(tmp_path, body, headers, message):
+    with pytest.raises(UploadError, match=message) as err:
+        _receive(tmp_path, body, headers)
+    assert err.value.status == 400
+    assert os.listdir(tmp_path) == []
+
+
+def test_multipart_without_file_part(tmp_path):
+    body = f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="a"\r\n\r\n1\r\n--{BOUNDARY}--\r\n'.encode()
+    with pytest.raises(UploadError, match="no file part"):
+        _receive(tmp_path, body, _headers(body))
+
+
+def test_truncated_multipart(tmp_path):
+    body = _multipart()[:-40]
+    with pytest.raises(UploadError, match="truncated"):
+        _receive(tmp_path, body, _headers(body))
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_epilogue_is_consumed_so_the_connection_can_be_reused(tmp_path, monkeypatch, chunked):
+    monkeypatch.setattr(upload_stream, "BLOCK", 16)
+    body = _multipart() + b"epilogue the client may send\r\n"
+    headers = _headers(body)
+    if chunked:
+        del headers["Content-Length"]
+        headers["Transfer-Encoding"] = "chunked"
+        body = b"%x\r\n%s\r\n0\r\n\r\n" % (len(body), body)
+    next_request = b"GET /health HTTP/1.1\r\n\r\n"
+    rfile = io.BytesIO(body + next_request)
+    up = upload_stream.receive(rfile, headers, str(tmp_path), 1 << 20)
+    assert up["size"] == len(PAYLOAD)
+    assert rfile.read() == next_request
+
+
+def test_oversized_epilogue_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_stream, "BLOCK", 16)
+    body = _multipart() + b"x" * (upload_stream.MAX_FIELD + 64)
+    with pytest.raises(UploadError, match="after the multipart body"):
+        _receive(tmp_path, body, _headers(body))
+    assert os.listdir(tmp_path) == []
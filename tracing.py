@@ -0,0 +1,192 @@
+"""
+Per-request tracing and opt-in profiling.
+
+Each HTTP request gets a request id (taken from X-Request-ID when the proxy
+sets one) and a thread-local trace. Stages wrap themselves in `span(name)`,
+and dependency calls timed through metrics.timed() show up as spans too.
+When the request finishes, its trace is written as one JSON line to
+TRACE_LOG ("-" for stdout). Requests are sampled by TRACE_SAMPLE, and slow
+ones are always written. cProfile runs for PROFILE_SAMPLE of requests, or for
+?profile=1 when PROFILE_ALLOW_QUERY is set. The stats are dumped to
+PROFILE_DIR/<request id>.prof and the top functions are added to the trace
+line.
+"""
+import os
+import re
+import io
+import json
+import time
+import uuid
+import random
+import cProfile
+import pstats
+import threading
+
+_local=threading.local()
+_write_lock=threading.Lock()
+_profile_lock=threading.Lock()   # cProfile 同一时刻只能有一个实例处于启用状态
+_out={"path":None, "file":None}
+_REQUEST_ID=re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return float(default)
+
+class Trace:
+    __slots__=("request_id", "method", "route", "t0", "started", "spans", "stack", "attrs", "profiler", "profile_path")
+
+    def __init__(self, request_id, method, route):
+        self.request_id=request_id
+        self.method=method
+        self.route=route
+        self.t0=time.perf_counter()
+        self.started=time.time()
+        self.spans=[]
+        self.stack=[]
+        self.attrs={}
+        self.profiler=None
+        self.profile_path=None
+
+def new_request_id(header=None):
+    header=(header or "").strip()
+    return header if _REQUEST_ID.match(header) else uuid.uuid4().hex[:16]
+
+def start(request_id, method, route, profile=False):
+    """Begin the trace of the current request; profile=True asks for a cProfile run (still subject to PROFILE_ALLOW_QUERY)."""
+    trace=Trace(request_id, method, route)
+    _local.trace=trace
+    want=(profile and os.environ.get("PROFILE_ALLOW_QUERY","0").lower() in ("1","true","yes")) \
+        or random.random()<_env_float("PROFILE_SAMPLE", "0")
+    if want and _profile_lock.acquire(blocking=False):
+        trace.profile_path=os.path.join(os.environ.get("PROFILE_DIR","profiles"), f"{request_id}.prof")
+        trace.profiler=cProfile.Profile()
+        try:
+            trace.profiler.enable()
+        except ValueError:
+            # 其他分析工具（调试器等）已占用
+            trace.profiler=None
+            trace.profile_path=None
+            _profile_lock.release()
+    return trace
+
+def current():
+    return getattr(_local, "trace", None)
+
+def request_id():
+    trace=current()
+    return trace.request_id if trace else None
+
+def annotate(**attrs):
+    trace=current()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+class span:
+    """Time a stage of the current request; a no-op outside a traced request."""
+    def __init__(self, name, **attrs):
+        self.name=name
+        self.attrs=attrs
+
+    def __enter__(self):
+        self.trace=current()
+        if self.trace is not None:
+            self.t0=time.perf_counter()
+            self.trace.stack.append(self.name)
+        return self
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __exit__(self, exc_type, exc, tb):
+        trace=self.trace
+        if trace is None:
+            return False
+        trace.stack.pop()
+        rec={"name":self.name, "start_ms":round((self.t0-trace.t0)*1000, 2), "ms":round((time.perf_counter()-self.t0)*1000, 2)}
+        if trace.stack:
+            rec["parent"]=trace.stack[-1]
+        if self.attrs:
+            rec["attrs"]=self.attrs
+        if exc_type is not None:
+            rec["error"]=exc_type.__name__
+        trace.spans.append(rec)
+        return False
+
+def add_span(name, t0, seconds, **attrs):
+    """Record a stage timed elsewhere (e.g. on another thread); t0 is its time.perf_counter() start."""
+    trace=current()
+    if trace is None:
+        return
+    rec={"name":name, "start_ms":round((t0-trace.t0)*1000, 2), "ms":round(seconds*1000, 2)}
+    if trace.stack:
+        rec["parent"]=trace.stack[-1]
+    if attrs:
+        rec["attrs"]=attrs
+    trace.spans.append(rec)
+
+def timings():
+    """{span name: ms} of the current request so far (repeated spans summed), plus "total"."""
+    trace=current()
+    if trace is None:
+        return {}
+    out={}
+    for rec in trace.spans:
+        out[rec["name"]]=round(out.get(rec["name"], 0)+rec["ms"], 2)
+    out["total"]=round((time.perf_counter()-trace.t0)*1000, 2)
+    return out
+
+def _stop_profiler(trace):
+    prof=trace.profiler
+    trace.profiler=None
+    try:
+        prof.disable()
+        os.makedirs(os.path.dirname(trace.profile_path) or ".", exist_ok=True)
+        prof.dump_stats(trace.profile_path)
+        buf=io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(int(os.environ.get("PROFILE_TOP","25")))
+        return buf.getvalue()
+    except Exception as e:
+        print(f"Profile dump error: {e}")
+        return None
+    finally:
+        _profile_lock.release()
+
+def _write(line):
+    path=os.environ.get("TRACE_LOG","").strip()
+    if not path:
+        return
+    with _write_lock:
+        if path=="-":
+            print(line, flush=True)
+            return
+        if _out["path"]!=path:
+            if _out["file"]:
+                _out["file"].close()
+            _out["file"]=open(path, "a", encoding="utf-8")
+            _out["path"]=path
+        _out["file"].write(line+"\n")
+        _out["file"].flush()
+
+def finish(status):
+    """End the current trace and write it out if sampled, slow or profiled; returns the record."""
+    trace=current()
+    _local.trace=None
+    if trace is None:
+        return None
+    ms=(time.perf_counter()-trace.t0)*1000
+    profile=_stop_profiler(trace) if trace.profiler is not None else None
+    rec={"ts":round(trace.started, 3), "request_id":trace.request_id, "method":trace.method, "route":trace.route,
+         "status":status, "ms":round(ms, 2), "spans":trace.spans}
+    if trace.attrs:
+        rec["attrs"]=trace.attrs
+    if profile is not None:
+        rec["profile_file"]=trace.profile_path
+        rec["profile"]=profile
+    if profile is not None or ms>=_env_float("TRACE_SLOW_MS", "1000") or random.random()<_env_float("TRACE_SAMPLE", "1"):
+        try:
+            _write(json.dumps(rec, ensure_ascii=False, default=str))
+        except Exception as e:
+            print(f"Trace write error: {e}")
+    return rec
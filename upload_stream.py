@@ -0,0 +1,202 @@
+"""
+Streaming request-body reader for document uploads.
+
+The body is copied from the socket to a temp file in fixed-size blocks while
+its SHA-256 is computed, so an upload never sits in memory as a whole. Both a
+raw body (application/octet-stream, optionally Transfer-Encoding: chunked)
+and multipart/form-data with a single file part are accepted. The size limit
+is checked against Content-Length up front and again while streaming.
+"""
+import os
+import hashlib
+import tempfile
+
+BLOCK = 64 * 1024
+MAX_FIELD = 64 * 1024   # non-file multipart fields are small and kept in memory
+
+class UploadError(Exception):
+    status = 400
+
+class UploadTooLarge(UploadError):
+    status = 413
+
+def _iter_body(rfile, headers):
+    """Yield raw body blocks for a Content-Length or chunked request."""
+    if "chunked" in (headers.get("Transfer-Encoding") or "").lower():
+        while True:
+            line = rfile.readline(1024)
+            try:
+                size = int(line.split(b";", 1)[0].strip(), 16)
+            except ValueError:
+                raise UploadError("malformed chunked body")
+            if size == 0:
+                # trailers until the blank line
+                while rfile.readline(1024) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            while size:
+                block = rfile.read(min(size, BLOCK))
+                if not block:
+                    raise UploadError("upload truncated")
+                size -= len(block)
+                yield block
+            rfile.readline(8)
+        return
+    remaining = int(headers.get("Content-Length") or 0)
+    while remaining:
+        block = rfile.read(min(remaining, BLOCK))
+        if not block:
+            raise UploadError("upload truncated")
+        remaining -= len(block)
+        yield block
+
+def _boundary(content_type):
+    for part in content_type.split(";")[1:]:
+        key, _, value = part.strip().partition("=")
+        if key.lower() == "boundary" and value:
+            return value.strip('"').encode("latin-1")
+    raise UploadError("multipart boundary missing")
+
+def _disposition(header_block):
+    """Parse name/filename out of a part's Content-Disposition header."""
+    params = {}
+    for line in header_block.decode("utf-8", errors="replace").split("\r\n"):
+        key, _, value = line.partition(":")
+        if key.strip().lower() != "content-disposition":
+            continue
+        for item in value.split(";")[1:]:
+            k, _, v = item.strip().partition("=")
+            params[k.lower()] = v.strip().strip('"')
+    return params
+
+class _Sink:
+    """Temp file + running hash + size limit."""
+    def __init__(self, directory, max_bytes):
+        self.max_bytes = max_bytes
+        self.sha = hashlib.sha256()
+        self.size = 0
+        fd, self.path = tempfile.mkstemp(prefix="upload-", suffix=".part", dir=directory)
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f"upload exceeds {self.max_bytes // (1024 * 1024)} MB")
+        self.sha.update(data)
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def _read_multipart(blocks, boundary, sink):
+    """Stream the first file part into sink; returns (fields, filename)."""
+    delim = b"\r\n--" + boundary
+    buf = b"\r\n"   # 让首个分隔符与后续分隔符同形
+    fields = {}
+    filename = None
+    state = "preamble"
+    name = None
+    value = b""
+    blocks = iter(blocks)
+    eof = False
+    while True:
+        if state == "preamble":
+            pos = buf.find(delim)
+            if pos != -1:
+                buf = buf[pos + len(delim):]
+                state = "after_delim"
+                continue
+            buf = buf[-len(delim):]
+        elif state == "after_delim":
+            if len(buf) >= 2:
+                if buf.startswith(b"--"):
+                    return fields, filename
+                state = "headers"
+                continue
+        elif state == "headers":
+            pos = buf.find(b"\r\n\r\n")
+            if pos != -1:
+                disp = _disposition(buf[:pos])
+                buf = buf[pos + 4:]
+                name = disp.get("name") or ""
+                is_file = "filename" in disp and filename is None
+                if is_file:
+                    filename = os.path.basename(disp["filename"].replace("\\", "/")) or "upload"
+                state = "file" if is_file else "field"
+                value = b""
+                continue
+            if len(buf) > MAX_FIELD:
+                raise UploadError("multipart headers too large")
+        else:
+            pos = buf.find(delim)
+            # 保留可能被截断的分隔符前缀，其余数据可以安全写出
+            safe = pos if pos != -1 else max(0, len(buf) - len(delim))
+            if state == "file":
+                sink.write(buf[:safe])
+            else:
+                value += buf[:safe]
+                if len(value) > MAX_FIELD:
+                    raise UploadError(f"field {name!r} too large")
+            buf = buf[safe:]
+            if pos != -1:
+                if state == "field":
+                    fields[name] = value.decode("utf-8", errors="replace")
+                buf = buf[len(delim):]
+                state = "after_delim"
+                continue
+        if eof:
+            raise UploadError("multipart body truncated")
+        try:
+            buf += next(blocks)
+        except StopIteration:
+            eof = True
+
+def _drain(blocks):
+    """Read what follows the closing boundary, so it is not taken for the next request on a keep-alive connection."""
+    left = MAX_FIELD
+    for block in blocks:
+        left -= len(block)
+        if left < 0:
+            raise UploadError("unexpected data after the multipart body")
+
+def receive(rfile, headers, directory, max_bytes):
+    """Stream the request body to a temp file under `directory`.
+
+    Returns {"path", "size", "sha256", "filename", "fields"}; the caller owns
+    the file. Raises UploadError / UploadTooLarge and removes the partial file.
+    """
+    length = headers.get("Content-Length")
+    if length and int(length) > max_bytes + MAX_FIELD:
+        raise UploadTooLarge(f"upload exceeds {max_bytes // (1024 * 1024)} MB")
+    os.makedirs(directory, exist_ok=True)
+    content_type = headers.get("Content-Type") or ""
+    sink = _Sink(directory, max_bytes)
+    try:
+        blocks = _iter_body(rfile, headers)
+        if content_type.lower().startswith("multipart/form-data"):
+            fields, filename = _read_multipart(blocks, _boundary(content_type), sink)
+            if filename is None:
+                raise UploadError("no file part in multipart body")
+            _drain(blocks)
+        else:
+            fields, filename = {}, None
+            for block in blocks:
+                sink.write(block)
+        sink.close()
+    except BaseException:
+        sink.discard()
+        raise
+    if not sink.size:
+        sink.discard()
+        raise UploadError("empty upload")
+    return {"path": sink.path, "size": sink.size, "sha256": sink.sha.hexdigest(),
+            "filename": filename, "fields": fields}